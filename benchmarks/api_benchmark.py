@@ -17,6 +17,8 @@ import operator
 
 import jax
 import jax.numpy as jnp
+from jax.config import config
+import numpy as np
 
 import google_benchmark as benchmark
 
@@ -66,6 +68,54 @@ def jit_simple_many_args(state):
     f(args).block_until_ready()
 
 
+def without_jit_fast_path(f):
+  """Runs a benchmark with the jit dispatch fast path disabled."""
+  @functools.wraps(f)
+  def wrapper(state):
+    prev = config.read("jax_jit_dispatch_fast_path")
+    config.update("jax_jit_dispatch_fast_path", False)
+    try:
+      return f(state)
+    finally:
+      config.update("jax_jit_dispatch_fast_path", prev)
+  return wrapper
+
+
+@benchmark.register
+@without_jit_fast_path
+def jit_trivial_slow_path(state):
+  f = jax.jit(swap)
+  a, b = f(1, 2)
+
+  while state:
+    c, d = f(a, b)
+    c.block_until_ready()
+    d.block_until_ready()
+
+
+@benchmark.register
+@without_jit_fast_path
+def jit_simple_slow_path(state):
+  a = jax.device_put(1)
+  b = jax.device_put(2)
+  f = jax.jit(operator.add)
+  f(a, b)
+
+  while state:
+    f(a, b).block_until_ready()
+
+
+@benchmark.register
+@without_jit_fast_path
+def jit_simple_many_args_slow_path(state):
+  args = [jax.device_put(i) for i in range(50)]
+  f = jax.jit(lambda xs: functools.reduce(operator.add, xs))
+  f(args)
+
+  while state:
+    f(args).block_until_ready()
+
+
 @benchmark.register
 @required_devices(2)
 def pmap_trivial_2_devices(state):
@@ -116,6 +166,36 @@ def pmap_simple_8_devices(state):
     d.block_until_ready()
 
 
+@benchmark.register
+def device_put_1000_leaves(state):
+  xs = [np.ones((4, 4), np.float32) for _ in range(1000)]
+
+  while state:
+    ys = jax.device_put(xs)
+    ys[-1].block_until_ready()
+
+
+@benchmark.register
+def device_get_1000_leaves(state):
+  xs = jax.device_put([np.ones((4, 4), np.float32) for _ in range(1000)])
+
+  while state:
+    state.pause_timing()
+    for x in xs:
+      x._npy_value = None
+    state.resume_timing()
+    jax.device_get(xs)
+
+
+@benchmark.register
+def device_get_1000_leaves_into_out(state):
+  xs = jax.device_put([np.ones((4, 4), np.float32) for _ in range(1000)])
+  out = [np.empty((4, 4), np.float32) for _ in range(1000)]
+
+  while state:
+    jax.device_get(xs, out=out)
+
+
 def swap(a, b):
   return b, a
 
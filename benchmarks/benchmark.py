@@ -93,6 +93,10 @@ def benchmark_suite(prepare: Callable[..., Callable], params_list: List[Dict],
     params_list: a list of kwargs on which to run the benchmark.
     name: the name of this benchmark suite
     target_total_secs: the ``target_total_secs`` to pass to ``benchmark``.
+
+  Returns:
+    A list with the raw times returned by ``benchmark`` for each entry of
+    ``params_list``, in order.
  """
   # Sort parameters alphabetically so benchmark results print consistently.
   params_list = [OrderedDict(sorted(p.items())) for p in params_list]
@@ -129,6 +133,8 @@ def benchmark_suite(prepare: Callable[..., Callable], params_list: List[Dict],
     print("Wrote %s results to %s" % (name, filename))
     print()
 
+  return times
+
 
 def _get_baseline_means(baseline_dir, name):
   baseline_dir = os.path.expanduser(baseline_dir)
@@ -0,0 +1,160 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Microbenchmarks for collectives under pmap, and a cost model fitted to them.
+
+To run on CPU with 8 CPU devices and write the fitted cost model, see
+`jax.experimental.collective_cost`, to a JSON file:
+
+CUDA_VISIBLE_DEVICES= XLA_FLAGS=--xla_force_host_platform_device_count=8 \
+python3 -m benchmarks.collectives_benchmark --cost_model_path=/tmp/cpu.json
+
+Each benchmark runs a collective `_ITERS` times in a loop inside one pmap, and
+the time of the same loop without the collective is subtracted before
+fitting. To make it run faster, set env var TARGET_TOTAL_SECS to a low number
+(e.g. 2).
+"""
+from absl import app
+from absl import flags
+
+import jax
+from jax import lax
+from jax import numpy as jnp
+from jax import pmap
+from jax.config import config
+from jax.experimental import collective_cost
+
+from benchmarks import benchmark
+
+import numpy as np
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string(
+    "cost_model_path", None,
+    "If set, fits a collective cost model to the results and saves it as JSON "
+    "to this path.")
+
+_ITERS = 10
+
+
+def _ring(groups, nshards):
+  groups = groups or [list(range(nshards))]
+  return [(g[i], g[(i + 1) % len(g)]) for g in groups for i in range(len(g))]
+
+
+def _collective_fn(collective, nshards, groups):
+  if collective == "none":
+    return lambda x: x
+  elif collective == "psum":
+    return lambda x: lax.psum(x, 'i', axis_index_groups=groups)
+  elif collective == "pmax":
+    return lambda x: lax.pmax(x, 'i', axis_index_groups=groups)
+  elif collective == "ppermute":
+    return lambda x: lax.ppermute(x, 'i', perm=_ring(groups, nshards))
+  elif collective == "all_to_all":
+    assert groups is None, "all_to_all doesn't support axis_index_groups"
+    return lambda x: lax.all_to_all(x, 'i', 0, 0)
+  elif collective == "all_gather":
+    return lambda x: lax.all_gather(x, 'i', axis_index_groups=groups)
+  elif collective == "psum_scatter":
+    return lambda x: lax.psum_scatter(x, 'i', axis_index_groups=groups,
+                                      tiled=True)
+  raise ValueError(collective)
+
+
+def _groups(nshards, grouped):
+  if not grouped:
+    return None
+  half = nshards // 2
+  return [list(range(half)), list(range(half, nshards))]
+
+
+def collectives_benchmark():
+  """Benchmarks each collective over array sizes and device counts.
+
+  Params:
+    collective: the collective, or "none" for the loop overhead alone.
+    nbytes: the size of each device's input to the collective.
+    nshards: the number of devices pmapped over.
+    grouped: whether to split the devices into two `axis_index_groups`.
+
+  Returns:
+    A list of `collective_cost.Measurement`s, with the loop overhead
+    subtracted.
+  """
+  def get_benchmark_fn(collective, nbytes, nshards, grouped):
+    groups = _groups(nshards, grouped)
+    group_size = nshards // 2 if grouped else nshards
+    fn = _collective_fn(collective, nshards, groups)
+
+    def step(x):
+      # Perturbing the input each iteration keeps XLA from hoisting the
+      # collective out of the loop, and keeping one element of the result
+      # keeps it live without adding much work.
+      def body(i, acc):
+        out = fn(x + i.astype(x.dtype))
+        return acc + out.reshape(-1)[0]
+      return lax.fori_loop(0, _ITERS, body, jnp.zeros((), x.dtype))
+
+    pmap_fn = pmap(step, 'i', devices=jax.local_devices()[:nshards])
+    # Collectives that split their input need its leading axis to be divisible
+    # by the group size.
+    x = np.ones((nshards, group_size, nbytes // 4 // group_size), np.float32)
+    x = pmap(lambda x: x, devices=jax.local_devices()[:nshards])(x)
+
+    def benchmark_fn():
+      pmap_fn(x).block_until_ready()
+    return benchmark_fn
+
+  params = []
+  for nshards in (2, 4, 8):
+    if nshards > jax.local_device_count(): continue
+    for grouped in (False, True):
+      if grouped and nshards < 4: continue
+      for collective in ("none",) + collective_cost.COLLECTIVES:
+        if grouped and collective == "all_to_all": continue
+        for nbytes in (2 ** 12, 2 ** 16, 2 ** 20, 2 ** 22):
+          params.append({"collective": collective, "nbytes": nbytes,
+                         "nshards": nshards, "grouped": grouped})
+  times = benchmark.benchmark_suite(get_benchmark_fn, params, "collectives")
+
+  overhead = {(p["nbytes"], p["nshards"], p["grouped"]): t.mean()
+              for p, t in zip(params, times) if p["collective"] == "none"}
+  measurements = []
+  for p, t in zip(params, times):
+    if p["collective"] == "none": continue
+    seconds = t.mean() - overhead[p["nbytes"], p["nshards"], p["grouped"]]
+    if seconds <= 0: continue  # lost in the noise
+    group_size = p["nshards"] // 2 if p["grouped"] else p["nshards"]
+    measurements.append(collective_cost.Measurement(
+        p["collective"], p["nbytes"], group_size, seconds / _ITERS))
+  return measurements
+
+
+def run_all_benchmarks():
+  measurements = collectives_benchmark()
+  if FLAGS.cost_model_path:
+    model = collective_cost.fit(measurements,
+                                platform=jax.devices()[0].platform)
+    print(model)
+    model.save(FLAGS.cost_model_path)
+    print("Wrote cost model to %s" % FLAGS.cost_model_path)
+
+
+def main(unused_argv):
+  run_all_benchmarks()
+
+
+if __name__ == "__main__":
+  config.config_with_absl()
+  app.run(main)
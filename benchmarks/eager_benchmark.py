@@ -0,0 +1,124 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Microbenchmarks for op-by-op (eager) execution of common `jax.numpy` ops.
+
+The arrays are tiny, so these mostly measure dispatch overhead, i.e. the cost
+of going through `xla.apply_primitive` for each operation.
+"""
+import jax
+import jax.numpy as jnp
+
+import google_benchmark as benchmark
+
+
+def _eager(f):
+  """Registers an eager benchmark of `f`, which maps (x, y) to an array."""
+  def wrapper(state):
+    x = jnp.arange(16, dtype=jnp.float32).reshape(4, 4)
+    y = jnp.ones((4, 4), jnp.float32)
+    f(x, y).block_until_ready()
+
+    while state:
+      f(x, y).block_until_ready()
+  wrapper.__name__ = f.__name__
+  return benchmark.register(wrapper)
+
+
+@_eager
+def eager_add(x, y):
+  return x + y
+
+
+@_eager
+def eager_add_python_scalar(x, _):
+  return x + 1.
+
+
+@_eager
+def eager_multiply(x, y):
+  return x * y
+
+
+@_eager
+def eager_exp(x, _):
+  return jnp.exp(x)
+
+
+@_eager
+def eager_where(x, y):
+  return jnp.where(x > 2, x, y)
+
+
+@_eager
+def eager_sum(x, _):
+  return jnp.sum(x)
+
+
+@_eager
+def eager_sum_axis(x, _):
+  return jnp.sum(x, axis=0)
+
+
+@_eager
+def eager_dot(x, y):
+  return jnp.dot(x, y)
+
+
+@_eager
+def eager_reshape(x, _):
+  return x.reshape(16)
+
+
+@_eager
+def eager_transpose(x, _):
+  return x.T
+
+
+@_eager
+def eager_getitem(x, _):
+  return x[1]
+
+
+@_eager
+def eager_slice(x, _):
+  return x[1:3, :2]
+
+
+@_eager
+def eager_concatenate(x, y):
+  return jnp.concatenate([x, y])
+
+
+@_eager
+def eager_astype(x, _):
+  return x.astype(jnp.int32)
+
+
+@_eager
+def eager_mlp_layer(x, y):
+  return jnp.tanh(jnp.dot(x, y) + 1.)
+
+
+@benchmark.register
+def eager_apply_primitive(state):
+  x = jnp.ones((4, 4), jnp.float32)
+  y = jnp.ones((4, 4), jnp.float32)
+  jax.lax.add(x, y).block_until_ready()
+
+  while state:
+    jax.lax.add(x, y)
+
+
+if __name__ == "__main__":
+  benchmark.main()
@@ -18,6 +18,8 @@ python3 pmap_benchmark.py
 
 To make it run faster, set env var TARGET_TOTAL_SECS to a low number (e.g. 2).
 """
+from functools import partial
+
 from absl import app
 
 import jax
@@ -139,11 +141,99 @@ def sharded_device_array_indexing_benchmark():
                             "ShardedDeviceArray_indexing")
 
 
+def pmap_reshard_benchmark():
+  """Pmap benchmark for ShardedDeviceArray arguments with a different sharding.
+
+  Measures passing the output of one pmap to another pmap that expects a
+  different layout, which reshards the argument device to device. With
+  `host_roundtrip=True` the argument is instead copied to the host and sharded
+  from there, for comparison.
+
+  Layouts:
+    replicate: a pmap output passed with `in_axes=None`, i.e. all-gathered.
+    reverse_devices: a pmap output passed to a pmap over the devices in
+      reverse order.
+    unnest: the output of a nested pmap over (2, nshards // 2) devices passed
+      to a pmap over 2 devices.
+  """
+  def get_benchmark_fn(layout, nshards, host_roundtrip):
+    devices = jax.local_devices()[:nshards]
+    x = np.random.random((nshards, 1024)).astype(np.float32)
+    if layout == "replicate":
+      x = pmap(lambda x: x, devices=devices)(x)
+      pmap_fn = pmap(lambda x, y: jnp.sum(x) + y, in_axes=(None, 0),
+                     devices=devices)
+      extra_args = (np.ones(nshards, np.float32),)
+    elif layout == "reverse_devices":
+      x = pmap(lambda x: x, devices=devices)(x)
+      pmap_fn = pmap(jnp.sum, devices=devices[::-1])
+      extra_args = ()
+    elif layout == "unnest":
+      x = pmap(pmap(lambda x: x), devices=devices)(
+          x.reshape(2, nshards // 2, 1024))
+      pmap_fn = pmap(jnp.sum, devices=devices[:2])
+      extra_args = ()
+    assert isinstance(x, jax.pxla.ShardedDeviceArray)
+
+    def benchmark_fn():
+      for _ in range(10):
+        if host_roundtrip:
+          x._npy_value = None
+          arg = np.asarray(x)
+        else:
+          arg = x
+        pmap_fn(arg, *extra_args).block_until_ready()
+    return benchmark_fn
+
+  params = []
+  for layout in ("replicate", "reverse_devices", "unnest"):
+    for nshards in (2, 4, 8):
+      if nshards > jax.local_device_count(): continue
+      for host_roundtrip in (False, True):
+        params.append({"layout": layout, "nshards": nshards,
+                       "host_roundtrip": host_roundtrip})
+  benchmark.benchmark_suite(get_benchmark_fn, params, "pmap_reshard")
+
+
+def pmap_psum_bucketed_benchmark():
+  """Benchmarks all-reducing many small gradients with and without bucketing.
+
+  Reports the number of all-reduces in the compiled step for each setting.
+  """
+
+  def get_benchmark_fn(nleaves, nshards, bucketed):
+    leaves = [np.ones((nshards, 16, 16), np.float32) for _ in range(nleaves)]
+    if bucketed:
+      reduce = partial(jax.lax.psum_bucketed, bucket_bytes=2 ** 20)
+    else:
+      reduce = jax.lax.psum
+    pmap_fn = pmap(lambda xs: reduce(xs, 'i'), 'i')
+    hlo = jax.xla_computation(lambda xs: reduce(xs, 'i'),
+                              axis_env=[('i', nshards)])([x[0] for x in leaves])
+    print(f"nleaves={nleaves} nshards={nshards} bucketed={bucketed}: "
+          f"{hlo.as_hlo_text().count(' all-reduce(')} all-reduces")
+    sharded = pmap(lambda xs: xs)(leaves)
+    def benchmark_fn():
+      jax.tree_map(lambda x: x.block_until_ready(), pmap_fn(sharded))
+    return benchmark_fn
+
+  params = []
+  for nleaves in (10, 100, 500):
+    for nshards in (2, 8):
+      if nshards > jax.local_device_count(): continue
+      for bucketed in (False, True):
+        params.append({"nleaves": nleaves, "nshards": nshards,
+                       "bucketed": bucketed})
+  benchmark.benchmark_suite(get_benchmark_fn, params, "pmap_psum_bucketed")
+
+
 def run_all_benchmarks():
   pmap_shard_sharded_device_array_benchmark()
   pmap_shard_device_array_benchmark()
   pmap_shard_outputs_benchmark()
   sharded_device_array_indexing_benchmark()
+  pmap_reshard_benchmark()
+  pmap_psum_bucketed_benchmark()
 
 
 def main(unused_argv):
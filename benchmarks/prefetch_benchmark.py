@@ -0,0 +1,81 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmarks training step time with and without `jax.prefetch_to_device`.
+
+Each step consumes a batch produced on the host by a Python generator and runs
+a small jitted MLP update on it.
+"""
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+import google_benchmark as benchmark
+
+
+def _batches(batch_size):
+  rng = np.random.RandomState(0)
+  while True:
+    x = rng.randn(batch_size, 512).astype(np.float32)
+    y = rng.randn(batch_size, 16).astype(np.float32)
+    yield x, y
+
+
+@jax.jit
+def _step(params, batch):
+  def loss(params):
+    w1, w2 = params
+    x, y = batch
+    return jnp.mean((jnp.dot(jnp.tanh(jnp.dot(x, w1)), w2) - y) ** 2)
+  grads = jax.grad(loss)(params)
+  return [w - 1e-3 * g for w, g in zip(params, grads)]
+
+
+def _train(state, prefetch):
+  batch_size = state.range(0)
+  params = [jnp.ones((512, 512), jnp.float32) * 1e-3,
+            jnp.ones((512, 16), jnp.float32) * 1e-3]
+  batches = _batches(batch_size)
+  if prefetch:
+    batches = jax.prefetch_to_device(batches, 2)
+  params = _step(params, next(batches))
+  jax.tree_map(lambda x: x.block_until_ready(), params)
+
+  while state:
+    params = _step(params, next(batches))
+  jax.tree_map(lambda x: x.block_until_ready(), params)
+  if prefetch:
+    stats = batches.stats()
+    state.counters["stalls"] = stats.stalls
+    state.counters["mean_queue_depth"] = stats.mean_queue_depth
+    batches.close()
+
+
+@benchmark.register
+@benchmark.option.arg_names(["batch_size"])
+@benchmark.option.range_multiplier(4)
+@benchmark.option.range(64, 4096)
+def train_step_without_prefetch(state):
+  _train(state, prefetch=False)
+
+
+@benchmark.register
+@benchmark.option.arg_names(["batch_size"])
+@benchmark.option.range_multiplier(4)
+@benchmark.option.range(64, 4096)
+def train_step_with_prefetch(state):
+  _train(state, prefetch=True)
+
+
+if __name__ == "__main__":
+  benchmark.main()
@@ -0,0 +1,169 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmarks for `jax.random`: the throughput of random bits in GB/s and their
+statistical quality for each PRNG implementation, key splitting, weighted
+sampling, and permutations."""
+import jax
+from jax import random
+
+import google_benchmark as benchmark
+import numpy as np
+
+
+def _throughput(state, fn, nbytes):
+  fn().block_until_ready()
+  while state:
+    fn().block_until_ready()
+  state.counters["GB/s"] = benchmark.Counter(
+      nbytes / 1e9, benchmark.Counter.kIsIterationInvariantRate)
+
+
+_IMPLS = ("threefry2x32", "philox4x32")
+
+
+def _random_bits(state, chunk_size, impl=None):
+  nbytes = state.range(0)
+  f = jax.jit(lambda key: random._random_bits(key, 32, (nbytes // 4,),
+                                              chunk_size, impl))
+  key = random.PRNGKey(0)
+  _throughput(state, lambda: f(key), nbytes)
+
+
+@benchmark.register
+@benchmark.option.arg_names(["nbytes", "impl"])
+@benchmark.option.args_product([[2 ** 16, 2 ** 20, 2 ** 24, 2 ** 28, 2 ** 30],
+                                list(range(len(_IMPLS)))])
+def random_bits(state):
+  _random_bits(state, None, _IMPLS[state.range(1)])
+
+
+@benchmark.register
+@benchmark.option.arg_names(["nbytes"])
+@benchmark.option.range_multiplier(16)
+@benchmark.option.range(2 ** 16, 2 ** 30)
+def random_bits_chunked(state):
+  _random_bits(state, 2 ** 22)
+
+
+def _quality(words):
+  """Z-scores of simple tests of uniform, independent random words.
+
+  Each is approximately standard normal for a good generator, so magnitudes
+  well above 3 point to a flaw.
+  """
+  bits = np.unpackbits(words.view(np.uint8))
+  monobit = (2 * int(bits.sum()) - bits.size) / np.sqrt(bits.size)
+  byte_counts = np.bincount(words.view(np.uint8), minlength=256)
+  expected = words.size * 4 / 256
+  chi2 = np.sum((byte_counts - expected) ** 2 / expected)
+  uniforms = words / 2. ** 32
+  serial = np.corrcoef(uniforms[:-1], uniforms[1:])[0, 1]
+  return {"monobit_z": monobit,
+          "byte_chi2_z": (chi2 - 255) / np.sqrt(2 * 255),
+          "serial_corr_z": serial * np.sqrt(words.size)}
+
+
+@benchmark.register
+@benchmark.option.arg_names(["impl"])
+@benchmark.option.dense_range(0, len(_IMPLS) - 1)
+def random_bits_quality(state):
+  impl = _IMPLS[state.range(0)]
+  f = jax.jit(lambda key: random._random_bits(key, 32, (2 ** 22,), None, impl))
+  key = random.PRNGKey(0)
+  while state:
+    words = np.asarray(f(key))
+  for name, z in _quality(words).items():
+    state.counters[name] = z
+
+
+def _split_keys(state, split_fn):
+  num_keys = state.range(0)
+  keys = random.split(random.PRNGKey(0), num_keys)
+  f = jax.jit(lambda keys: split_fn(keys, 2))
+  _throughput(state, lambda: f(keys), num_keys * 2 * 8)
+
+
+@benchmark.register
+@benchmark.option.arg_names(["num_keys"])
+@benchmark.option.range_multiplier(16)
+@benchmark.option.range(2 ** 10, 2 ** 22)
+def split_vmap(state):
+  _split_keys(state, lambda keys, num: jax.vmap(
+      lambda k: random.split(k, num))(keys))
+
+
+@benchmark.register
+@benchmark.option.arg_names(["num_keys"])
+@benchmark.option.range_multiplier(16)
+@benchmark.option.range(2 ** 10, 2 ** 22)
+def split_many(state):
+  _split_keys(state, random.split_many)
+
+
+def _per_call(state, fn):
+  fn().block_until_ready()
+  while state:
+    fn().block_until_ready()
+
+
+@benchmark.register
+@benchmark.option.arg_names(["n"])
+@benchmark.option.range_multiplier(16)
+@benchmark.option.range(2 ** 8, 2 ** 24)
+def choice_weighted_without_replacement(state):
+  n = state.range(0)
+  p = random.uniform(random.PRNGKey(1), (n,))
+  f = jax.jit(lambda key, p: random.choice(key, n, (8,), replace=False, p=p))
+  key = random.PRNGKey(0)
+  _per_call(state, lambda: f(key, p))
+
+
+@benchmark.register
+@benchmark.option.arg_names(["n"])
+@benchmark.option.range_multiplier(16)
+@benchmark.option.range(2 ** 8, 2 ** 24)
+def choice_weighted_with_replacement(state):
+  n = state.range(0)
+  p = random.uniform(random.PRNGKey(1), (n,))
+  f = jax.jit(lambda key, p: random.choice(key, n, (2 ** 16,), p=p))
+  key = random.PRNGKey(0)
+  _per_call(state, lambda: f(key, p))
+
+
+@benchmark.register
+@benchmark.option.arg_names(["n"])
+@benchmark.option.range_multiplier(16)
+@benchmark.option.range(2 ** 8, 2 ** 24)
+def alias_choice(state):
+  n = state.range(0)
+  table = random.alias_table(random.uniform(random.PRNGKey(1), (n,)))
+  f = jax.jit(lambda key, table: random.alias_choice(key, table, (2 ** 16,)))
+  key = random.PRNGKey(0)
+  _per_call(state, lambda: f(key, table))
+
+
+@benchmark.register
+@benchmark.option.arg_names(["n", "feistel"])
+@benchmark.option.args_product([[2 ** 12, 2 ** 16, 2 ** 20, 2 ** 24, 2 ** 27],
+                                [0, 1]])
+def permutation(state):
+  n = state.range(0)
+  method = "feistel" if state.range(1) else "sort"
+  f = jax.jit(lambda key: random.permutation(key, n, method=method))
+  key = random.PRNGKey(0)
+  _per_call(state, lambda: f(key))
+
+
+if __name__ == "__main__":
+  benchmark.main()
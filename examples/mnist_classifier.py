@@ -25,6 +25,7 @@ import itertools
 
 import numpy.random as npr
 
+import jax
 import jax.numpy as jnp
 from jax import jit, grad, random
 from jax.experimental import optimizers
@@ -69,7 +70,7 @@ if __name__ == "__main__":
       for i in range(num_batches):
         batch_idx = perm[i * batch_size:(i + 1) * batch_size]
         yield train_images[batch_idx], train_labels[batch_idx]
-  batches = data_stream()
+  batches = jax.prefetch_to_device(data_stream(), 2)
 
   opt_init, opt_update, get_params = optimizers.momentum(step_size, mass=momentum_mass)
 
@@ -101,8 +101,9 @@ if __name__ == "__main__":
   def spmd_update(params, batch):
     grads = grad(loss)(params, batch)
     # We compute the total gradients, summing across the device-mapped axis,
-    # using the `lax.psum` SPMD primitive, which does a fast all-reduce-sum.
-    grads = [(lax.psum(dw, 'batch'), lax.psum(db, 'batch')) for dw, db in grads]
+    # using `lax.psum_bucketed`, which packs the small per-layer gradients into
+    # a few flat buffers and does one fast all-reduce-sum per buffer.
+    grads = lax.psum_bucketed(grads, 'batch')
     return [(w - step_size * dw, b - step_size * db)
             for (w, b), (dw, db) in zip(params, grads)]
 
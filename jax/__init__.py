@@ -22,6 +22,7 @@ from .config import config
 from .api import (
   ad,  # TODO(phawkins): update users to avoid this.
   argnums_partial,  # TODO(phawkins): update Haiku to not use this.
+  cache_info,
   checkpoint,
   curry,  # TODO(phawkins): update users to avoid this.
   custom_ivjp,
@@ -38,6 +39,7 @@ from .api import (
   device_put,
   devices,
   disable_jit,
+  eager_fusion,
   eval_shape,
   flatten_fun_nokwargs,  # TODO(phawkins): update users to avoid this.
   grad,
@@ -56,8 +58,11 @@ from .api import (
   linearize,
   make_jaxpr,
   mask,
+  Mesh,
   partial,  # TODO(phawkins): update callers to use functools.partial.
   pmap,
+  precompile,
+  prefetch_to_device,
   pxla,  # TODO(phawkins): update users to avoid this.
   remat,
   shapecheck,
@@ -25,11 +25,17 @@ arrays.
 
 # flake8: noqa: F401
 import collections
+import concurrent.futures
 import functools
 import inspect
 import itertools as it
+import os
+import queue
 import threading
-from typing import Any, Callable, Iterable, Optional, Sequence, Tuple, TypeVar, Union
+import time
+import weakref
+from typing import (Any, Callable, Dict, Iterable, Optional, Sequence, Tuple,
+                    TypeVar, Union)
 from warnings import warn
 
 import numpy as np
@@ -42,7 +48,7 @@ from . import dtypes
 from .core import eval_jaxpr
 from .api_util import (wraps, flatten_fun, apply_flat_fun, flatten_fun_nokwargs,
                        flatten_fun_nokwargs2, argnums_partial, flatten_axes,
-                       donation_vector, rebase_donate_argnums)
+                       donation_vector, rebase_donate_argnums, wrap_hashably)
 from .tree_util import (tree_map, tree_flatten, tree_unflatten, tree_structure,
                         tree_transpose, tree_leaves, tree_multimap,
                         treedef_is_leaf, Partial)
@@ -63,6 +69,7 @@ from .interpreters import parallel
 from .interpreters import masking
 from .interpreters import invertible_ad as iad
 from .interpreters.invertible_ad import custom_ivjp
+from .interpreters.pxla import Mesh
 from .custom_derivatives import custom_jvp, custom_vjp
 from .config import flags, config, bool_env
 
@@ -86,6 +93,15 @@ FLAGS = flags.FLAGS
 flags.DEFINE_bool("jax_disable_jit",
                   bool_env("JAX_DISABLE_JIT", False),
                   "Disable JIT compilation and just call original Python.")
+flags.DEFINE_bool("jax_jit_dispatch_fast_path",
+                  bool_env("JAX_JIT_DISPATCH_FAST_PATH", True),
+                  "Let repeated calls to jitted functions with the same "
+                  "argument signature skip retracing bookkeeping.")
+flags.DEFINE_integer("jax_compile_async_threads",
+                     int(os.getenv("JAX_COMPILE_ASYNC_THREADS", "0")),
+                     "Number of background threads used by the "
+                     "compile_async method of jitted functions. 0 means the "
+                     "number of CPUs.")
 
 
 def _check_callable(fun):
@@ -104,7 +120,10 @@ def jit(fun: Callable[..., T],
         static_argnums: Union[int, Iterable[int]] = (),
         device=None,
         backend: Optional[str] = None,
-        donate_argnums: Union[int, Iterable[int]] = ()) -> Callable[..., T]:
+        donate_argnums: Union[int, Iterable[int]] = (),
+        in_shapes=None,
+        shape_buckets: Union[None, Sequence[int], Callable[[int], int]] = None
+        ) -> Callable[..., T]:
   """Sets up ``fun`` for just-in-time compilation with XLA.
 
   Args:
@@ -138,10 +157,39 @@ def jit(fun: Callable[..., T],
       for example recycling one of your input buffers to store a result. You
       should not re-use buffers that you donate to a computation, JAX will raise
       an error if you try to.
+    in_shapes: This is an experimental feature and the API is likely to change.
+      Optional, a pytree of polymorphic shape specs for the positional
+      arguments, as in :py:func:`mask`, e.g. ``['(n, _)', '(n,)']``. If given,
+      each shape variable is rounded up to a bucket size, the arguments are
+      zero-padded to the resulting shapes, ``fun`` is run under
+      :py:func:`mask` so that the padding does not affect the results, and the
+      outputs are sliced back to their logical shapes. Calls whose shapes fall
+      into the same buckets then share a single compiled executable. ``fun``
+      must only use primitives that support masking.
+    shape_buckets: Only used with ``in_shapes``. Either a sorted sequence of
+      bucket sizes, or a function mapping a logical size to its padded size.
+      Defaults to rounding up to the next power of two.
 
   Returns:
     A wrapped version of ``fun``, set up for just-in-time compilation.
 
+    The wrapped function also has ``compile`` and ``compile_async`` methods,
+    which take the same arguments as ``fun`` but compile it ahead of time
+    instead of running it. Non-static arguments may be given as
+    :py:class:`ShapeDtypeStruct` objects (or anything with ``shape`` and
+    ``dtype`` attributes) rather than arrays. The executable is stored in the
+    same cache used by calls of the jitted function, so a later call with
+    arrays of those shapes and dtypes runs it without compiling again.
+    ``compile_async`` compiles on a background thread pool and returns a
+    :py:class:`concurrent.futures.Future`, e.g. to precompile for several
+    input shapes concurrently at startup:
+
+    >>> import jax
+    >>> f = jax.jit(jax.numpy.tanh)
+    >>> futures = [f.compile_async(jax.ShapeDtypeStruct((n,), np.float32))
+    ...            for n in (128, 256, 512)]
+    >>> for fut in futures: fut.result()
+
   In the following example, ``selu`` can be compiled into a single fused kernel
   by XLA:
 
@@ -160,8 +208,21 @@ def jit(fun: Callable[..., T],
   _check_callable(fun)
   static_argnums = _ensure_tuple(static_argnums)
   donate_argnums = _ensure_tuple(donate_argnums)
+  if in_shapes is not None:
+    if static_argnums or donate_argnums:
+      raise ValueError("jit does not support static_argnums or donate_argnums "
+                       "together with in_shapes.")
+    return _jit_with_shape_buckets(fun, in_shapes, shape_buckets, device,
+                                   backend)
+  elif shape_buckets is not None:
+    raise ValueError("jit shape_buckets requires in_shapes.")
   donate_argnums = rebase_donate_argnums(donate_argnums, static_argnums)
 
+  # Maps call signatures seen before to (weakref to the `_xla_callable` cache
+  # entry, out_tree), so that repeated calls can skip tracing bookkeeping and
+  # go straight to the executable. Entries die when the cache entry is evicted.
+  fast_path_cache: Dict[Any, Tuple[weakref.ref, Any]] = {}
+
   @wraps(fun)
   def f_jitted(*args, **kwargs):
     if _jit_is_disabled():
@@ -170,25 +231,236 @@ def jit(fun: Callable[..., T],
       msg = ("jitted function has static_argnums={}, donate_argnums={} but "
              "was called with only {} positional arguments.")
       raise ValueError(msg.format(static_argnums, donate_argnums, len(args)))
-    f = lu.wrap_init(fun)
     if static_argnums:
       dyn_argnums = [i for i in range(len(args)) if i not in static_argnums]
-      f, dyn_args = argnums_partial(f, dyn_argnums, args)
+      dyn_args = tuple(args[i] for i in dyn_argnums)
     else:
       dyn_args = args
     args_flat, in_tree = tree_flatten((dyn_args, kwargs))
+
+    if all(map(_is_fast_path_arg, args_flat)):
+      key = _jit_fast_path_key(args, static_argnums, in_tree, args_flat)
+    else:
+      key = None
+    if key is not None:
+      entry = fast_path_cache.get(key)
+      cache_entry = entry and entry[0]()
+      if cache_entry is not None:
+        cache_entry.touch()
+        return tree_unflatten(entry[1], cache_entry.ans(*args_flat))
+
+    f = lu.wrap_init(fun)
+    if static_argnums:
+      f, dyn_args = argnums_partial(f, dyn_argnums, args)
     if donate_argnums:
       donated_invars = donation_vector(donate_argnums, dyn_args, kwargs)
     else:
       donated_invars = (False,) * len(args_flat)
     for arg in args_flat: _check_arg(arg)
     flat_fun, out_tree = flatten_fun(f, in_tree)
-    out = xla.xla_call(flat_fun, *args_flat, device=device, backend=backend,
-                       name=flat_fun.__name__, donated_invars=donated_invars)
+    with xla.capture_cache_entry() as captured:
+      out = xla.xla_call(flat_fun, *args_flat, device=device, backend=backend,
+                         name=flat_fun.__name__, donated_invars=donated_invars)
+    if (key is not None and captured and
+        not any(isinstance(x, core.Tracer) for x in out)):
+      cache_entry, = captured
+      add_fast_path(key, cache_entry, out_tree())
     return tree_unflatten(out_tree(), out)
 
+  def add_fast_path(key, cache_entry, out_tree):
+    remove = lambda _: fast_path_cache.pop(key, None)
+    fast_path_cache[key] = (weakref.ref(cache_entry, remove), out_tree)
+
+  def compile(*args, **kwargs) -> None:
+    if max(static_argnums + donate_argnums, default=-1) >= len(args):
+      msg = ("jitted function has static_argnums={}, donate_argnums={} but "
+             "was compiled with only {} positional arguments.")
+      raise ValueError(msg.format(static_argnums, donate_argnums, len(args)))
+    f = lu.wrap_init(fun)
+    if static_argnums:
+      dyn_argnums = [i for i in range(len(args)) if i not in static_argnums]
+      f, dyn_args = argnums_partial(f, dyn_argnums, args)
+    else:
+      dyn_args = args
+    args_flat, in_tree = tree_flatten((dyn_args, kwargs))
+    arg_specs = tuple(map(_abstract_arg_spec, args_flat))
+    if donate_argnums:
+      donated_invars = donation_vector(donate_argnums, dyn_args, kwargs)
+    else:
+      donated_invars = (False,) * len(args_flat)
+    flat_fun, out_tree = flatten_fun(f, in_tree)
+    cache_entry = xla.precompile_xla_call(
+        flat_fun, arg_specs, device=device, backend=backend,
+        name=flat_fun.__name__, donated_invars=donated_invars)
+    key = _jit_fast_path_key(args, static_argnums, in_tree, args_flat,
+                             arg_specs)
+    if key is not None:
+      add_fast_path(key, cache_entry, out_tree())
+
+  def compile_async(*args, **kwargs) -> concurrent.futures.Future:
+    return _get_compile_executor().submit(compile, *args, **kwargs)
+
+  f_jitted.compile = compile  # type: ignore
+  f_jitted.compile_async = compile_async  # type: ignore
   return f_jitted
 
+def _abstract_arg_spec(x):
+  """Like `xla.arg_spec`, but also accepts abstract arguments for AOT compiles."""
+  if isinstance(x, core.AbstractValue):
+    return raise_to_shaped(x), None
+  try:
+    return xla.arg_spec(x)
+  except TypeError:
+    if not (hasattr(x, 'shape') and hasattr(x, 'dtype')):
+      raise TypeError("Argument '{}' of type {} is not a valid JAX type or "
+                      "shape/dtype struct".format(x, type(x))) from None
+    return ShapedArray(tuple(x.shape), dtypes.canonicalize_dtype(x.dtype)), None
+
+BucketInfo = collections.namedtuple(
+    "BucketInfo", ["calls", "shapes", "buckets", "compiles_avoided"])
+
+# Totals over all jit functions with shape buckets, reported by `cache_info`.
+_bucket_totals = dict(calls=0, shapes=0, buckets=0)
+_bucket_totals_lock = threading.Lock()
+
+def _bucket_totals_info() -> BucketInfo:
+  with _bucket_totals_lock:
+    calls, shapes, buckets = (_bucket_totals[k]
+                              for k in ("calls", "shapes", "buckets"))
+  return BucketInfo(calls, shapes, buckets, shapes - buckets)
+
+def _jit_with_shape_buckets(fun, in_shapes, shape_buckets, device, backend):
+  unique_ids = masking.UniqueIds()
+  in_specs, in_shapes_tree = tree_flatten(in_shapes)
+  in_specs = [masking.remap_ids(unique_ids, masking.parse_spec(spec))
+              for spec in in_specs]
+  bucket_size = _bucket_size_fn(shape_buckets)
+
+  # Maps (in_tree, in_specs, padded shapes, dtypes) to (out_tree, output shape
+  # specs). Filled in when `masked_fun` is traced, i.e. once per bucket.
+  out_shapes_store: Dict[Any, Tuple[Any, Any]] = {}
+  seen_shapes = set()
+  seen_buckets = set()
+  num_calls = 0
+
+  def masked_fun(signature, logical_env_vals, padded_args):
+    in_tree, specs = signature
+    padded_shapes = tuple(np.shape(x) for x in padded_args)
+    arg_dtypes = tuple(map(_dtype, padded_args))
+    padded_env = masking.bind_shapes(specs, padded_shapes)
+    logical_env = dict(zip(sorted(padded_env), logical_env_vals))
+    flat_fun, out_tree = flatten_fun_nokwargs(lu.wrap_init(fun), in_tree)
+    outs, out_shapes = masking.mask_fun(flat_fun, logical_env, padded_env,
+                                        list(padded_args), specs)
+    out_shapes_store[signature + (padded_shapes, arg_dtypes)] = (
+        out_tree(), out_shapes)
+    return outs
+
+  masked_jitted = jit(masked_fun, static_argnums=(0,), device=device,
+                      backend=backend)
+
+  @wraps(fun)
+  def f_jitted(*args):
+    nonlocal num_calls
+    if _jit_is_disabled():
+      return fun(*args)
+    args_flat, in_tree = tree_flatten(args)
+    if in_tree != in_shapes_tree:
+      raise TypeError(f"Tree mismatch: Input {in_tree} and shape spec "
+                      f"{in_shapes_tree}.")
+    for arg in args_flat: _check_arg(arg)
+    shapes = tuple(np.shape(x) for x in args_flat)
+    arg_dtypes = tuple(map(_dtype, args_flat))
+    specs = tuple(map(masking.finalize_spec, in_specs, shapes))
+    try:
+      logical_env = masking.bind_shapes(specs, shapes)
+    except masking.ShapeError:
+      raise masking.ShapeError(
+          f"Argument shapes {tree_unflatten(in_tree, shapes)} do not match "
+          f"in_shapes {in_shapes}.") from None
+    padded_env = {k: bucket_size(n) for k, n in logical_env.items()}
+    padded_shapes = tuple(masking.eval_poly_shape(spec, padded_env)
+                          for spec in specs)
+    padded_args = map(_pad_to_shape, args_flat, padded_shapes)
+    logical_env_vals = [logical_env[k] for k in sorted(logical_env)]
+
+    signature = (in_tree, specs)
+    outs = masked_jitted(signature, logical_env_vals, padded_args)
+    out_tree, out_specs = out_shapes_store[
+        signature + (padded_shapes, arg_dtypes)]
+    out_shapes = [masking.eval_poly_shape(spec, logical_env)
+                  for spec in out_specs]
+    outs = map(_slice_to_shape, outs, out_shapes)
+
+    shape_key = (in_tree, shapes, arg_dtypes)
+    bucket_key = (in_tree, padded_shapes, arg_dtypes)
+    with _bucket_totals_lock:
+      num_calls += 1
+      _bucket_totals["calls"] += 1
+      if shape_key not in seen_shapes:
+        seen_shapes.add(shape_key)
+        _bucket_totals["shapes"] += 1
+      if bucket_key not in seen_buckets:
+        seen_buckets.add(bucket_key)
+        _bucket_totals["buckets"] += 1
+    return tree_unflatten(out_tree, outs)
+
+  def bucket_info() -> BucketInfo:
+    """Returns the number of distinct argument shapes and buckets seen so far.
+
+    ``compiles_avoided`` is the number of compilations that calling a plain
+    ``jit`` function with the same argument shapes would have needed on top of
+    the ones needed here, one per bucket. Arguments with different dtypes
+    count as different shapes and buckets.
+    """
+    return BucketInfo(num_calls, len(seen_shapes), len(seen_buckets),
+                      len(seen_shapes) - len(seen_buckets))
+
+  f_jitted.bucket_info = bucket_info  # type: ignore
+  return f_jitted
+
+def _bucket_size_fn(shape_buckets):
+  if shape_buckets is None:
+    return lambda n: n if n <= 1 else 1 << (n - 1).bit_length()
+  elif callable(shape_buckets):
+    return shape_buckets
+  buckets = sorted(map(int, shape_buckets))
+  def bucket_size(n):
+    for b in buckets:
+      if n <= b:
+        return b
+    raise ValueError(f"Size {n} is larger than the largest shape bucket "
+                     f"{buckets[-1]}.")
+  return bucket_size
+
+def _pad_to_shape(x, shape):
+  if np.shape(x) == shape:
+    return x
+  pads = [(0, p - d) for d, p in zip(np.shape(x), shape)]
+  if isinstance(x, (core.Tracer, xla.DeviceArray)):
+    from .lax import lax  # avoid a circular import
+    zero = lax._const(x, 0)
+    return lax.pad(x, zero, [(lo, hi, 0) for lo, hi in pads])
+  return np.pad(np.asarray(x), pads)
+
+def _slice_to_shape(x, shape):
+  if np.shape(x) == shape:
+    return x
+  from .lax import lax  # avoid a circular import
+  return lax.slice(x, (0,) * len(shape), shape)
+
+_compile_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_compile_executor_lock = threading.Lock()
+
+def _get_compile_executor() -> concurrent.futures.ThreadPoolExecutor:
+  global _compile_executor
+  with _compile_executor_lock:
+    if _compile_executor is None:
+      max_workers = FLAGS.jax_compile_async_threads or os.cpu_count() or 1
+      _compile_executor = concurrent.futures.ThreadPoolExecutor(
+          max_workers=max_workers, thread_name_prefix="jax_compile")
+    return _compile_executor
+
 @contextmanager
 def disable_jit():
   """Context manager that disables :py:func:`jit` behavior under its dynamic context.
@@ -236,9 +508,148 @@ def disable_jit():
   finally:
     _thread_local_state.jit_is_disabled = prev_val
 
+def eager_fusion(enable: bool = True):
+  """Context manager that fuses consecutive eager operations into one computation.
+
+  Outside of :py:func:`jit`, each primitive operation is normally compiled and
+  dispatched on its own, which for small arrays is dominated by dispatch
+  overhead. Under this context, eligible operations on arrays on the default
+  device are instead recorded and return arrays whose values are pending. The
+  recorded operations are compiled and run as a single XLA computation when
+  one of their results is first needed, e.g. when it is printed, converted to
+  NumPy, used in Python control flow, passed to a jitted function or to an
+  operation that can't be fused, or when ``block_until_ready`` is called on
+  it. Fused computations are cached, so code that repeats the same sequence of
+  operations, e.g. in a loop, compiles it once.
+
+  Operations with multiple results, control flow primitives, and operations
+  on arrays committed to a specific device are executed as usual. At most
+  ``jax_eager_fusion_max_ops`` operations are fused into one computation.
+
+  Here nothing runs until ``y`` is printed, at which point ``sin``, ``mul``
+  and ``add`` run as one computation:
+
+  >>> import jax
+  >>> import jax.numpy as jnp
+  >>> with jax.eager_fusion():
+  ...   x = jnp.arange(4.)
+  ...   y = jnp.sin(x) * 2 + 1
+  ...   print(y)  # doctest: +SKIP
+  [1.        2.682942  2.818595  1.28224  ]
+
+  Args:
+    enable: whether to fuse operations under the context. Passing ``False``
+      disables fusion within an enclosing ``eager_fusion`` context.
+  """
+  return xla.eager_fusion(enable)
+
 def _jit_is_disabled():
   return _thread_local_state.jit_is_disabled or config.read('jax_disable_jit')
 
+def _jit_fast_path_key(args, static_argnums, in_tree, args_flat,
+                       arg_specs=None):
+  """Returns the dispatch fast path key of a jit call, or None if ineligible.
+
+  Only calls that would be dispatched straight to the `xla_call` impl, i.e.
+  that have no tracer arguments and are not under a dynamic trace, can use the
+  fast path. It is also disabled without omnistaging, and under
+  ``jax_debug_nans``, whose de-optimized reruns need the slow path.
+  """
+  if not config.read('jax_jit_dispatch_fast_path'):
+    return None
+  if not config.omnistaging_enabled or config.read('jax_debug_nans'):
+    return None
+  if core.thread_local_state.trace_state.trace_stack.dynamic.level != 0:
+    return None
+  if arg_specs is None:
+    try:
+      arg_specs = tuple(map(xla.arg_spec, args_flat))
+    except TypeError:
+      return None  # e.g. tracers, or invalid types the slow path will reject
+  static_args = tuple(wrap_hashably(args[i]) for i in static_argnums)
+  return len(args), static_args, in_tree, arg_specs
+
+_fast_path_scalar_types = {bool, int, float, complex}
+
+def _is_fast_path_arg(x):
+  """Whether `x` can be passed to a cached executable without `_check_arg`."""
+  return (isinstance(x, (xla.DeviceArray, np.ndarray, np.generic)) or
+          type(x) in _fast_path_scalar_types)
+
+def cache_info() -> Dict[str, Union[lu.CacheInfo, BucketInfo]]:
+  """Returns statistics about JAX's in-memory compilation caches.
+
+  The result maps the name of each compilation cache (``_xla_callable`` for
+  :py:func:`jit`, ``parallel_callable`` for :py:func:`pmap`,
+  ``_sharded_callable`` for ``sharded_jit``, ``xla_primitive_callable`` for
+  op-by-op execution, and so on) to a ``CacheInfo``
+  named tuple with fields ``hits``, ``misses``, ``evictions``, ``currsize``
+  (the number of cached executables) and ``nbytes`` (their estimated size).
+
+  The ``jit_shape_buckets`` entry is a ``BucketInfo`` totalling the
+  ``bucket_info()`` of every :py:func:`jit` function with ``in_shapes``. Its
+  ``compiles_avoided`` field counts the compilations saved by shape bucketing.
+
+  The caches can be bounded with the
+  ``jax_compilation_cache_max_entries_per_function``,
+  ``jax_compilation_cache_max_entries`` and ``jax_compilation_cache_max_bytes``
+  flags, in which case least recently used executables are evicted first. The
+  op-by-op cache is bounded separately, by the
+  ``jax_primitive_cache_max_entries`` flag.
+
+  >>> import jax
+  >>> f = jax.jit(lambda x: x + 1)
+  >>> _ = f(1.); _ = f(2.)
+  >>> jax.cache_info()['_xla_callable'].hits  # doctest: +SKIP
+  1
+  """
+  info: Dict[str, Union[lu.CacheInfo, BucketInfo]] = dict(lu.cache_info())
+  info['xla_primitive_callable'] = xla.xla_primitive_callable.cache_info()
+  info['jit_shape_buckets'] = _bucket_totals_info()
+  return info
+
+def precompile(funs_and_args: Iterable[Tuple], max_workers: Optional[int] = None
+               ) -> None:
+  """Compiles several :py:func:`jit` or :py:func:`pmap` functions in parallel.
+
+  Each compilation populates the same cache the function uses when called, so
+  this can be used to warm up a program at startup on all available cores
+  rather than compiling serially on the first calls.
+
+  Args:
+    funs_and_args: an iterable of ``(fun, args)`` or ``(fun, args, kwargs)``
+      tuples, where ``fun`` is the result of :py:func:`jit` or :py:func:`pmap`
+      and ``args`` and ``kwargs`` are arguments to compile it for, as accepted
+      by its ``compile`` method. Non-static arguments may be
+      :py:class:`ShapeDtypeStruct` objects.
+    max_workers: optional number of threads to compile with. Defaults to the
+      thread pool shared by all ``compile_async`` calls, which has
+      ``jax_compile_async_threads`` threads.
+
+  Raises:
+    Exception: the first error raised by any of the compilations, once all of
+      them have finished.
+
+  >>> import jax
+  >>> import numpy as np
+  >>> f = jax.jit(lambda x: x + 1)
+  >>> g = jax.jit(lambda x, y: x * y)
+  >>> x = jax.ShapeDtypeStruct((128,), np.float32)
+  >>> jax.precompile([(f, (x,)), (g, (x, x))])
+  """
+  def compile_one(fun, args, kwargs={}):
+    return fun.compile(*args, **kwargs)
+
+  if max_workers is None:
+    futures = [_get_compile_executor().submit(compile_one, *item)
+               for item in funs_and_args]
+    concurrent.futures.wait(futures)
+  else:
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+      futures = [executor.submit(compile_one, *item) for item in funs_and_args]
+  for future in futures:
+    future.result()
+
 
 def xla_computation(fun: Callable,
                     static_argnums: Union[int, Iterable[int]] = (),
@@ -1029,7 +1440,10 @@ def pmap(fun: Callable[..., T],
       retrieved via jax.devices()). If specified, the size of the mapped axis
       must be equal to the number of local devices in the sequence. Nested
       :py:func:`pmap` s with ``devices`` specified in either the inner or outer :py:func:`pmap`
-      are not yet supported.
+      are not yet supported. May also be a :py:class:`Mesh`, in which case the
+      leading ``mesh.ndim`` axes of the mapped arguments are mapped over the
+      mesh axes in a single program, and each mesh axis name can be used in
+      collectives. ``axis_name`` and ``axis_size`` must then be left unset.
     backend: This is an experimental feature and the API is likely to change.
       Optional, a string representing the XLA backend. 'cpu', 'gpu', or 'tpu'.
     axis_size: Optional; the size of the mapped axis.
@@ -1040,12 +1454,27 @@ def pmap(fun: Callable[..., T],
       for example recycling one of your input buffers to store a result. You
       should not re-use buffers that you donate to a computation, JAX will raise
       an error if you try to.
+    in_shapes: This is an experimental feature and the API is likely to change.
+      Optional, a pytree of polymorphic shape specs for the positional
+      arguments, as in :py:func:`mask`, e.g. ``['(n, _)', '(n,)']``. If given,
+      each shape variable is rounded up to a bucket size, the arguments are
+      zero-padded to the resulting shapes, ``fun`` is run under
+      :py:func:`mask` so that the padding does not affect the results, and the
+      outputs are sliced back to their logical shapes. Calls whose shapes fall
+      into the same buckets then share a single compiled executable. ``fun``
+      must only use primitives that support masking.
+    shape_buckets: Only used with ``in_shapes``. Either a sorted sequence of
+      bucket sizes, or a function mapping a logical size to its padded size.
+      Defaults to rounding up to the next power of two.
 
   Returns:
     A parallelized version of ``fun`` with arguments that correspond to those of
     ``fun`` but with extra array axes at positions indicated by ``in_axes``
     and with output that has an additional leading array axis (with the same
-    size).
+    size). Like jitted functions, it has ``compile`` and ``compile_async``
+    methods for ahead-of-time compilation (see :py:func:`jit`); for these, the
+    mapped arguments are given with their full shape, including the mapped
+    axis.
 
   For example, assuming 8 XLA devices are available, :py:func:`pmap` can be used as a
   map along a leading array axis:
@@ -1163,12 +1592,40 @@ def pmap(fun: Callable[..., T],
   [0.         0.06666667 0.13333333 0.2        0.26666667 0.33333333]
   >>> print(f2(jnp.array([2., 3.])))  # doctest: +SKIP
   [ 13.  13.]
+
+  Passing a :py:class:`Mesh` as ``devices`` maps over several named axes at
+  once, which behaves like nested :py:func:`pmap` s but compiles to one
+  program. Collectives can reduce over any subset of the mesh axes:
+
+  >>> mesh = Mesh(np.array(jax.devices()).reshape(4, 2), ('data', 'model'))  # doctest: +SKIP
+  >>> @partial(pmap, devices=mesh)  # doctest: +SKIP
+  ... def f(x):
+  ...   return jax.lax.psum(x, 'model'), jax.lax.psum(x, ('data', 'model'))
+  >>>
+  >>> y, z = f(jnp.arange(8.).reshape(4, 2))  # doctest: +SKIP
+  >>> print(y)  # doctest: +SKIP
+  [[ 1.  1.]
+   [ 5.  5.]
+   [ 9.  9.]
+   [13. 13.]]
+  >>> print(z[0, 0])  # doctest: +SKIP
+  28.0
   """
   # axis_size is an optional integer representing the global axis size.
   # The aggregate size (across all hosts) size of the mapped axis must match
   # the given value.
 
   _check_callable(fun)
+  mesh = devices if isinstance(devices, pxla.Mesh) else None
+  if mesh is not None:
+    if axis_name is not None or axis_size is not None:
+      raise ValueError("pmap over a Mesh takes its axis names and sizes from "
+                       "the mesh, so axis_name and axis_size must not be set.")
+    if not config.omnistaging_enabled:
+      raise NotImplementedError("pmap over a Mesh requires omnistaging.")
+    if any(d.host_id != xb.host_id() for d in mesh.device_list):
+      raise NotImplementedError("pmap over a multi-host Mesh is not supported.")
+    axis_name, devices = mesh.axis_name, mesh.device_list
   axis_name = _TempAxisName(fun) if axis_name is None else axis_name
   static_broadcasted_tuple = _ensure_tuple(static_broadcasted_argnums)
   donate_tuple = rebase_donate_argnums(_ensure_tuple(donate_argnums),
@@ -1177,8 +1634,7 @@ def pmap(fun: Callable[..., T],
   if any(axis != 0 for axis in tree_leaves(in_axes)):
     raise ValueError(f"pmap in_axes leaves must be 0 or None, got {in_axes}")
 
-  @wraps(fun)
-  def f_pmapped(*args, **kwargs):
+  def prepare(args, kwargs):
     f = lu.wrap_init(fun)
     if static_broadcasted_tuple:
       if max(static_broadcasted_tuple) >= len(args):
@@ -1202,17 +1658,38 @@ def pmap(fun: Callable[..., T],
     else:
       donated_invars = (False,) * len(args)
     in_axes_flat = flatten_axes("pmap in_axes", in_tree, (dyn_in_axes, 0))
+    if mesh is not None:
+      args = [pxla.flatten_mesh_axes(arg, mesh) if axis is not None else arg
+              for arg, axis in zip(args, in_axes_flat)]
     local_axis_size = _mapped_axis_size(in_tree, args, in_axes_flat, "pmap")
-    for arg in args: _check_arg(arg)
     flat_fun, out_tree = flatten_fun(f, in_tree)
-    out = pxla.xla_pmap(
-        flat_fun, *args, backend=backend, axis_name=axis_name,
+    params = dict(
+        backend=backend, axis_name=axis_name,
         axis_size=local_axis_size, global_axis_size=axis_size,
         devices=None if devices is None else tuple(devices),
         mapped_invars=tuple(axis is not None for axis in in_axes_flat),
         name=flat_fun.__name__, donated_invars=tuple(donated_invars))
+    return flat_fun, out_tree, args, params
+
+  @wraps(fun)
+  def f_pmapped(*args, **kwargs):
+    flat_fun, out_tree, args, params = prepare(args, kwargs)
+    for arg in args: _check_arg(arg)
+    out = pxla.xla_pmap(flat_fun, *args, **params)
+    if mesh is not None:
+      out = [pxla.unflatten_mesh_axes(x, mesh) for x in out]
     return tree_unflatten(out_tree(), out)
 
+  def compile(*args, **kwargs) -> None:
+    flat_fun, _, args, params = prepare(args, kwargs)
+    avals = [aval for aval, _ in map(_abstract_arg_spec, args)]
+    pxla.precompile_xla_pmap(flat_fun, avals, **params)
+
+  def compile_async(*args, **kwargs) -> concurrent.futures.Future:
+    return _get_compile_executor().submit(compile, *args, **kwargs)
+
+  f_pmapped.compile = compile  # type: ignore
+  f_pmapped.compile_async = compile_async  # type: ignore
   return f_pmapped
 
 class _TempAxisName:
@@ -1655,10 +2132,17 @@ def device_put(x, device: Optional[xc.Device] = None):
   For more details on data placement see the
   :ref:`FAQ on data placement <faq-data-placement>`.
 
+  All the leaves of ``x`` are transferred together, so that putting a pytree
+  with many leaves (e.g. restoring a checkpoint) is not dominated by per-array
+  dispatch overhead. NumPy leaves are read directly, so memory-mapped arrays
+  (see :py:func:`numpy.load` with ``mmap_mode``) are transferred without an
+  intermediate host copy.
+
   Returns:
     A copy of ``x`` that resides on ``device``.
   """
-  return tree_map(lambda y: xla.device_put_p.bind(y, device=device), x)
+  leaves, treedef = tree_flatten(x)
+  return tree_unflatten(treedef, xla.device_put_many(leaves, device))
 
 
 # TODO(mattjj): consider revising
@@ -1667,13 +2151,159 @@ def _device_get(x):
     return x
   return x.copy()
 
-def device_get(x):
-  for y in tree_leaves(x):
-    try:
+def device_get(x, out=None):
+  """Transfers ``x`` to host memory.
+
+  Device-to-host copies of all the leaves of ``x`` are started before any of
+  them is waited on, so that the transfers overlap.
+
+  Args:
+    x: An array, scalar, or (nested) standard Python container thereof.
+    out: Optional, a pytree of NumPy arrays with the same structure and shapes
+      as ``x`` (for example, preallocated or memory-mapped arrays) into which
+      the values are written, rather than allocating new arrays. Sharded
+      arrays are written shard by shard, without first assembling them on the
+      host.
+
+  Returns:
+    A pytree with the same structure as ``x`` whose leaves are NumPy arrays,
+    or ``out`` if it is given.
+  """
+  leaves, treedef = tree_flatten(x)
+  for y in leaves:
+    if isinstance(y, xla.DeviceArray):
       y.copy_to_host_async()
-    except AttributeError:
-      pass
-  return tree_map(_device_get, x)
+  if out is None:
+    return tree_unflatten(treedef, map(_device_get, leaves))
+  out_leaves, out_treedef = tree_flatten(out)
+  if out_treedef != treedef:
+    raise TypeError(f"device_get out has tree structure {out_treedef}, but "
+                    f"the value has tree structure {treedef}.")
+  map(xla.device_get_into, leaves, out_leaves)
+  return out
+
+
+PrefetchStats = collections.namedtuple(
+    "PrefetchStats", ["batches", "stalls", "stall_secs", "mean_queue_depth"])
+
+def prefetch_to_device(iterator, size: int = 2, devices=None):
+  """Transfers the elements of ``iterator`` to device ahead of their use.
+
+  A background thread takes elements (pytrees of arrays) from ``iterator``,
+  transfers them to device and puts them in a queue holding at most ``size``
+  transferred elements, so that host-to-device copies of upcoming batches
+  overlap with computation on the current one.
+
+  Args:
+    iterator: an iterator of pytrees of arrays, e.g. NumPy batches.
+    size: the maximum number of elements staged on device ahead of time.
+    devices: where to put the elements. If ``None``, each leaf is transferred
+      with :py:func:`device_put` to the default device. If a single
+      :py:class:`Device`, leaves are committed to it. If a sequence of devices,
+      the leading axis of each leaf (which must have size ``len(devices)``) is
+      split across them the way :py:func:`pmap` does, so that the results can
+      be passed to a function pmapped over those devices without further
+      transfers.
+
+  Returns:
+    An iterator over the transferred elements. Its ``queue_depth`` attribute is
+    the number of elements currently staged, and its ``stats()`` method returns
+    a ``PrefetchStats`` named tuple with the number of elements returned so
+    far, how many times the consumer had to wait for an element to be staged,
+    the total time spent waiting, and the average queue depth observed by the
+    consumer. Calling ``close()``, or dropping the iterator, stops the
+    background thread early.
+
+  >>> import jax, numpy as np
+  >>> batches = (np.full(3, i, np.float32) for i in range(10))
+  >>> for batch in jax.prefetch_to_device(batches, 2):
+  ...   pass  # a training step on `batch`
+  """
+  if size < 1:
+    raise ValueError(f"prefetch_to_device size must be positive, got {size}.")
+  if devices is None:
+    put = device_put
+  elif isinstance(devices, (list, tuple)):
+    put = partial(tree_map, partial(pxla.shard_leading_axis, devices=devices))
+  else:
+    put = partial(device_put, device=devices)
+  return _PrefetchIterator(iterator, size, put)
+
+class _PrefetchIterator:
+  _done = object()
+
+  def __init__(self, iterator, size, put):
+    self._queue = queue.Queue(maxsize=size)
+    self._stop = threading.Event()
+    self._finished = False
+    self._batches = self._stalls = self._total_depth = 0
+    self._stall_secs = 0.
+    # The thread must not reference `self`, so that dropping the iterator
+    # stops it via `__del__`.
+    self._thread = threading.Thread(
+        target=_PrefetchIterator._produce,
+        args=(iter(iterator), put, self._queue, self._stop),
+        name="jax_prefetch_to_device", daemon=True)
+    self._thread.start()
+
+  @staticmethod
+  def _produce(iterator, put, q, stop):
+    def enqueue(item):
+      while not stop.is_set():
+        try:
+          q.put(item, timeout=0.1)
+          return True
+        except queue.Full:
+          pass
+      return False
+
+    try:
+      for x in iterator:
+        if stop.is_set() or not enqueue((put(x), None)):
+          return
+    except Exception as e:  # pylint: disable=broad-except
+      enqueue((_PrefetchIterator._done, e))
+    else:
+      enqueue((_PrefetchIterator._done, None))
+
+  @property
+  def queue_depth(self) -> int:
+    return self._queue.qsize()
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    if self._finished:
+      raise StopIteration
+    depth = self._queue.qsize()
+    start = time.perf_counter()
+    x, err = self._queue.get()
+    if x is self._done:
+      # Waiting for the end of the stream is not a stall.
+      self._finished = True
+      if err is not None:
+        raise err
+      raise StopIteration
+    if not depth:
+      self._stalls += 1
+      self._stall_secs += time.perf_counter() - start
+    self._batches += 1
+    self._total_depth += depth
+    return x
+
+  def close(self) -> None:
+    """Stops the background thread. Remaining staged elements are dropped."""
+    self._finished = True
+    self._stop.set()
+    self._thread.join()
+
+  def __del__(self):
+    self._stop.set()
+
+  def stats(self) -> PrefetchStats:
+    return PrefetchStats(self._batches, self._stalls, self._stall_secs,
+                         self._total_depth / max(self._batches, 1))
 
 
 def _check_arg(arg):
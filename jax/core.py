@@ -644,6 +644,31 @@ class Sublevel(int): pass
 AxisEnvFrame = namedtuple('AxisEnvFrame', ['name', 'size'])
 
 
+class MultiAxisName:
+  """Axis name of a single map over several named axes at once.
+
+  A map with this axis name behaves like a nest of maps, one per entry of
+  `names` (outermost first), so collectives inside it can refer to any subset
+  of the names. See `pxla.Mesh`.
+  """
+  __slots__ = ['names', 'sizes']
+
+  def __init__(self, names: Tuple[Any, ...], sizes: Tuple[int, ...]):
+    assert len(names) == len(sizes)
+    self.names = tuple(names)
+    self.sizes = tuple(sizes)
+
+  def __eq__(self, other):
+    return (type(other) is MultiAxisName and self.names == other.names and
+            self.sizes == other.sizes)
+
+  def __hash__(self):
+    return hash((MultiAxisName, self.names, self.sizes))
+
+  def __repr__(self):
+    return 'MultiAxisName({}, {})'.format(self.names, self.sizes)
+
+
 class TraceState:
   trace_stack: TraceStack
   substack: List[Sublevel]
@@ -931,7 +956,7 @@ class UnshapedArray(AbstractValue):
     raise TypeError(msg)
 
 class ShapedArray(UnshapedArray):
-  __slots__ = ['shape']
+  __slots__ = ['shape', '_hash']
   array_abstraction_level = 1
 
   def __init__(self, shape, dtype, weak_type=False):
@@ -952,10 +977,16 @@ class ShapedArray(UnshapedArray):
             and self.weak_type == other.weak_type)
 
   def __hash__(self):
-    # can use hash(self.dtype) and rely on the fact that numpy reuses base dtype
-    # objects, e.g. `np.zeros(3).dtype is np.zeros(4).dtype`, or we can use
-    # the unique character code via hash(self.dtype.char)
-    return hash((self.shape, self.dtype, self.weak_type))
+    # The hash is memoized, since avals are hashed on every op-by-op dispatch
+    # and DeviceArrays produced by the same executable share one aval.
+    try:
+      return self._hash
+    except AttributeError:
+      # can use hash(self.dtype) and rely on the fact that numpy reuses base
+      # dtype objects, e.g. `np.zeros(3).dtype is np.zeros(4).dtype`, or we can
+      # use the unique character code via hash(self.dtype.char)
+      self._hash = h = hash((self.shape, self.dtype, self.weak_type))
+      return h
 
   def at_least_vspace(self):
     return self
@@ -1563,13 +1594,19 @@ def omnistaging_enabler() -> None:
 
   @contextmanager
   def extend_axis_env(axis_name, size: int):
-    frame = AxisEnvFrame(axis_name, size)
-    thread_local_state.trace_state.axis_env.append(frame)
+    if type(axis_name) is MultiAxisName:
+      assert prod(axis_name.sizes) == size
+      frames = [AxisEnvFrame(n, s)
+                for n, s in zip(axis_name.names, axis_name.sizes)]
+    else:
+      frames = [AxisEnvFrame(axis_name, size)]
+    thread_local_state.trace_state.axis_env.extend(frames)
     try:
       yield
     finally:
-      frame_ = thread_local_state.trace_state.axis_env.pop()
-      assert frame is frame_
+      for frame in reversed(frames):
+        frame_ = thread_local_state.trace_state.axis_env.pop()
+        assert frame is frame_
 
   def axis_frame(axis_name):
     frames = thread_local_state.trace_state.axis_env
@@ -0,0 +1,206 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A latency/bandwidth cost model for collective operations.
+
+**Experimental: please give feedback, and expect changes.**
+
+Each collective is modeled as running over a ring of the ``n`` devices taking
+part in it (the size of its replica group). It takes some number of
+communication steps, and in total each device sends some number of bytes
+over them. Its time is
+
+  ``latency * steps(n) + seconds_per_byte * traffic(nbytes, n)``
+
+where ``nbytes`` is the size of the collective's per-device input. The two
+coefficients are fitted per collective and platform from measurements, such as
+those taken by ``benchmarks/collectives_benchmark.py``::
+
+  model = collective_cost.fit(measurements)
+  model.save('/tmp/cpu_collectives.json')
+
+  model = collective_cost.CostModel.load('/tmp/cpu_collectives.json')
+  model.estimate('psum', nbytes=4 * 2 ** 20, num_devices=8)  # in seconds
+
+Tools that choose between layouts, like the partition propagation behind
+``sharded_jit``'s ``plan_partitions``, can then weigh their communication in
+seconds rather than bytes.
+"""
+
+import json
+from typing import Dict, Iterable, NamedTuple, Optional
+
+import numpy as np
+
+COLLECTIVES = ("psum", "pmax", "ppermute", "all_to_all", "all_gather",
+               "psum_scatter")
+
+
+def steps(collective: str, num_devices: int) -> int:
+  """The number of communication steps of a ring collective."""
+  n = num_devices
+  if n == 1:
+    return 0
+  elif collective in ("psum", "pmax"):
+    return 2 * (n - 1)  # reduce-scatter, then all-gather
+  elif collective in ("all_to_all", "all_gather", "psum_scatter"):
+    return n - 1
+  elif collective == "ppermute":
+    return 1
+  raise ValueError(f"Unknown collective {collective!r}, expected one of "
+                   f"{COLLECTIVES}.")
+
+
+def traffic(collective: str, nbytes: float, num_devices: int) -> float:
+  """The bytes each device sends in a ring collective.
+
+  Args:
+    collective: the name of the collective.
+    nbytes: the size of each device's input to the collective.
+    num_devices: the number of devices taking part, i.e. the replica group
+      size.
+  """
+  n = num_devices
+  if collective in ("psum", "pmax"):
+    return 2 * nbytes * (n - 1) / n
+  elif collective in ("all_to_all", "psum_scatter"):
+    return nbytes * (n - 1) / n
+  elif collective == "all_gather":
+    return nbytes * (n - 1)
+  elif collective == "ppermute":
+    return nbytes if n > 1 else 0
+  raise ValueError(f"Unknown collective {collective!r}, expected one of "
+                   f"{COLLECTIVES}.")
+
+
+class CollectiveCost(NamedTuple):
+  """The fitted coefficients of one collective."""
+  latency: float  # seconds per step
+  seconds_per_byte: float
+
+  @property
+  def bandwidth(self) -> float:
+    """Bytes per second."""
+    return 1 / self.seconds_per_byte if self.seconds_per_byte else np.inf
+
+
+class Measurement(NamedTuple):
+  """The time one run of a collective took."""
+  collective: str
+  nbytes: int
+  num_devices: int
+  seconds: float
+
+
+class CostModel:
+  """Estimates the time of collectives from fitted per-collective costs.
+
+  Args:
+    costs: maps collective names to their :class:`CollectiveCost`.
+    platform: optional name of the platform the costs were measured on.
+  """
+
+  def __init__(self, costs: Dict[str, CollectiveCost],
+               platform: Optional[str] = None):
+    self.costs = dict(costs)
+    self.platform = platform
+
+  def estimate(self, collective: str, nbytes: float, num_devices: int) -> float:
+    """Estimates the seconds a collective takes.
+
+    Args:
+      collective: the name of the collective, one of ``COLLECTIVES``.
+      nbytes: the size of each device's input to the collective.
+      num_devices: the number of devices taking part, i.e. the replica group
+        size when using ``axis_index_groups``.
+    """
+    if collective not in self.costs:
+      raise KeyError(f"No fitted cost for {collective!r}, the model has costs "
+                     f"for {sorted(self.costs)}.")
+    cost = self.costs[collective]
+    return (cost.latency * steps(collective, num_devices) +
+            cost.seconds_per_byte * traffic(collective, nbytes, num_devices))
+
+  def to_json(self) -> str:
+    return json.dumps({
+        "platform": self.platform,
+        "costs": {name: cost._asdict() for name, cost in self.costs.items()}},
+        indent=2, sort_keys=True)
+
+  @classmethod
+  def from_json(cls, s: str) -> "CostModel":
+    data = json.loads(s)
+    return cls({name: CollectiveCost(**cost)
+                for name, cost in data["costs"].items()}, data.get("platform"))
+
+  def save(self, path: str):
+    with open(path, "w") as f:
+      f.write(self.to_json())
+
+  @classmethod
+  def load(cls, path: str) -> "CostModel":
+    with open(path) as f:
+      return cls.from_json(f.read())
+
+  def __repr__(self):
+    costs = ", ".join(f"{name}: {cost.latency * 1e6:.2f}us/step, "
+                      f"{cost.bandwidth / 1e9:.3g}GB/s"
+                      for name, cost in sorted(self.costs.items()))
+    return f"CostModel({self.platform or 'unknown platform'}; {costs})"
+
+
+def fit(measurements: Iterable[Measurement],
+        platform: Optional[str] = None) -> CostModel:
+  """Fits a :class:`CostModel` to measured collective times.
+
+  The coefficients of each collective are fitted by nonnegative least squares
+  on the relative error, so that small and large transfers weigh alike.
+
+  Args:
+    measurements: :class:`Measurement` tuples, or tuples of
+      ``(collective, nbytes, num_devices, seconds)``. Each collective needs
+      measurements over at least two sizes or device counts.
+    platform: optional name of the platform the measurements were taken on.
+  """
+  by_collective: Dict[str, list] = {}
+  for m in measurements:
+    m = Measurement(*m)
+    if m.num_devices > 1:
+      by_collective.setdefault(m.collective, []).append(m)
+
+  costs = {}
+  for name, ms in by_collective.items():
+    features = np.array([[steps(name, m.num_devices),
+                          traffic(name, m.nbytes, m.num_devices)]
+                         for m in ms], np.float64)
+    seconds = np.array([m.seconds for m in ms], np.float64)
+    weights = 1 / np.maximum(seconds, np.finfo(np.float64).tiny)
+    coeffs = _nonnegative_lstsq(features * weights[:, None], seconds * weights)
+    costs[name] = CollectiveCost(float(coeffs[0]), float(coeffs[1]))
+  return CostModel(costs, platform)
+
+
+def _nonnegative_lstsq(a, b):
+  coeffs, *_ = np.linalg.lstsq(a, b, rcond=None)
+  if np.all(coeffs >= 0):
+    return coeffs
+  # With two coefficients, the nonnegative optimum otherwise uses one of them.
+  candidates = []
+  for j in range(a.shape[1]):
+    c = np.zeros(a.shape[1])
+    norm = a[:, j] @ a[:, j]
+    if norm > 0:
+      c[j] = max(a[:, j] @ b / norm, 0)
+    candidates.append(c)
+  return min(candidates, key=lambda c: np.sum((a @ c - b) ** 2))
@@ -0,0 +1,154 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Input pipeline helpers for multi-host :func:`jax.pmap`.
+
+**Experimental: please give feedback, and expect changes.**
+
+In a multi-host ``pmap`` the mapped axis spans the devices of all hosts, laid
+out host by host: host ``h`` runs the replicas ``[h * L, (h + 1) * L)``, where
+``L`` is its local device count. Every host calls the pmapped function with
+only its own slice of each global batch, so a data loader has to agree with the
+other hosts on the global batch and then load just its part of it.
+
+:func:`host_local_batches` does that from a global index space
+``range(num_examples)``. All hosts draw the same sequence of global batches of
+indices (from the same seed), each loads only its own contiguous slice, splits
+it across its local devices, and stages it on them ahead of time with
+:func:`jax.prefetch_to_device`::
+
+  def load(indices):  # runs on this host, for this host's indices only
+    return {'image': images[indices], 'label': labels[indices]}
+
+  batches = host_local_batches(load, num_examples=len(images),
+                               global_batch_size=1024, seed=0)
+  for batch in batches:
+    state = train_step(state, batch)  # a function pmapped over all hosts
+"""
+
+from typing import Any, Callable, Iterator, Optional, Sequence
+
+import numpy as np
+
+from .. import api
+from ..lib import xla_bridge as xb
+from ..tree_util import tree_map
+
+
+def host_batch_slice(global_batch_size: int, host_id: Optional[int] = None,
+                     host_count: Optional[int] = None) -> slice:
+  """The slice of a global batch to be loaded by host ``host_id``.
+
+  Args:
+    global_batch_size: the number of examples in the global batch, which must
+      be divisible by ``host_count``.
+    host_id: defaults to :func:`jax.host_id`.
+    host_count: defaults to :func:`jax.host_count`.
+  """
+  host_id = xb.host_id() if host_id is None else host_id
+  host_count = xb.host_count() if host_count is None else host_count
+  if not 0 <= host_id < host_count:
+    raise ValueError(f"host_id must be in [0, {host_count}), got {host_id}.")
+  per_host, ragged = divmod(global_batch_size, host_count)
+  if ragged:
+    raise ValueError(f"global_batch_size {global_batch_size} must be divisible "
+                     f"by the number of hosts, {host_count}.")
+  return slice(host_id * per_host, (host_id + 1) * per_host)
+
+
+def global_batch_indices(num_examples: int, global_batch_size: int, *,
+                         seed: Optional[int] = None,
+                         num_epochs: Optional[int] = None
+                         ) -> Iterator[np.ndarray]:
+  """Yields global batches of example indices, identically on every host.
+
+  Each epoch visits ``range(num_examples)`` once, in a random order drawn from
+  ``seed`` if it is given and in order otherwise. The last
+  ``num_examples % global_batch_size`` examples of an epoch are dropped, since
+  every global batch must have the same size on all hosts.
+
+  Args:
+    num_examples: the size of the dataset.
+    global_batch_size: the number of indices in each batch.
+    seed: optional seed for shuffling. Hosts must use the same seed.
+    num_epochs: the number of passes over the dataset, or ``None`` to repeat
+      forever.
+  """
+  if global_batch_size > num_examples:
+    raise ValueError(f"global_batch_size {global_batch_size} is larger than "
+                     f"the dataset, which has {num_examples} examples.")
+  rng = None if seed is None else np.random.RandomState(seed)
+  num_batches = num_examples // global_batch_size
+  epoch = 0
+  while num_epochs is None or epoch < num_epochs:
+    order = np.arange(num_examples) if rng is None else rng.permutation(num_examples)
+    for i in range(num_batches):
+      yield order[i * global_batch_size:(i + 1) * global_batch_size]
+    epoch += 1
+
+
+def host_local_batches(load_fn: Callable[[np.ndarray], Any], num_examples: int,
+                       global_batch_size: int, *, seed: Optional[int] = None,
+                       num_epochs: Optional[int] = None, prefetch: int = 2,
+                       devices: Optional[Sequence[Any]] = None,
+                       host_id: Optional[int] = None,
+                       host_count: Optional[int] = None):
+  """Iterates over this host's slices of global batches, sharded on device.
+
+  Args:
+    load_fn: maps a 1D array of example indices to a pytree of arrays whose
+      leading axis has one entry per index. It is only ever called with this
+      host's indices, from a background thread.
+    num_examples: the size of the global index space.
+    global_batch_size: the number of examples per global batch, across all
+      hosts. Must be divisible by the total number of devices.
+    seed: optional shuffling seed, see :func:`global_batch_indices`. Hosts must
+      use the same seed.
+    num_epochs: the number of passes over the dataset, or ``None`` to repeat
+      forever.
+    prefetch: the number of batches to stage on device ahead of time.
+    devices: this host's devices, in the order of the pmap that consumes the
+      batches. Defaults to :func:`jax.local_devices`.
+    host_id: defaults to :func:`jax.host_id`. Overriding it together with
+      ``host_count`` lets a single process stand in for one host of a larger
+      job, e.g. to test the input pipeline.
+    host_count: defaults to :func:`jax.host_count`.
+
+  Returns:
+    An iterator, as returned by :func:`jax.prefetch_to_device`, over pytrees of
+    ShardedDeviceArrays. Each leaf has leading axes
+    ``(len(devices), global_batch_size // (host_count * len(devices)))`` and
+    can be passed directly to a function pmapped over all hosts' devices.
+  """
+  devices = xb.local_devices() if devices is None else list(devices)
+  host_slice = host_batch_slice(global_batch_size, host_id, host_count)
+  per_host = host_slice.stop - host_slice.start
+  per_device, ragged = divmod(per_host, len(devices))
+  if ragged:
+    raise ValueError(f"The per-host batch size {per_host} must be divisible by "
+                     f"the number of local devices, {len(devices)}.")
+
+  def split(x):
+    x = np.asarray(x)
+    if x.shape[:1] != (per_host,):
+      raise ValueError(f"load_fn must return arrays with a leading axis of "
+                       f"size {per_host}, got shape {x.shape}.")
+    return x.reshape((len(devices), per_device) + x.shape[1:])
+
+  def host_batches():
+    for indices in global_batch_indices(num_examples, global_batch_size,
+                                        seed=seed, num_epochs=num_epochs):
+      yield tree_map(split, load_fn(indices[host_slice]))
+
+  return api.prefetch_to_device(host_batches(), prefetch, devices)
@@ -375,11 +375,13 @@ tf_not_yet_impl = [
 
   lax.igamma_grad_a_p,
   random.random_gamma_p,
+  random.philox4x32_p,
   lax.random_gamma_grad_p,
 
   # Not high priority?
   lax.after_all_p, lax.all_to_all_p, lax.create_token_p, lax.cummax_p, lax.cummin_p,
   lax.infeed_p, lax.outfeed_p, lax.pmax_p, lax.pmin_p, lax.ppermute_p, lax.psum_p,
+  lax.all_gather_p, lax.psum_scatter_p,
 
   pxla.xla_pmap_p, pxla.axis_index_p,
 ]
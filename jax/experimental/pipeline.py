@@ -0,0 +1,363 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pipeline-parallel execution of a model split into stages over a pmap axis.
+
+**Experimental: please give feedback, and expect changes.**
+
+A model that is too deep for one device can be split into ``num_stages``
+consecutive stages, with stage ``s`` living on device ``s`` of a
+:func:`jax.pmap` axis. A batch is split into ``num_microbatches``
+micro-batches, which flow through the stages one after another so that all
+stages are busy at once, except during the fill and drain "bubble" at the
+start and end of the pipeline. Activations move between neighbouring stages
+with :func:`jax.lax.ppermute`, and each device runs a :func:`jax.lax.scan`
+over the ticks of a static schedule.
+
+The functions here are called inside a ``pmap`` over the stage axis. Every
+stage maps an activation of one shape and dtype to an activation of the same
+shape and dtype, and all stages share one parameter structure, so that the
+per-stage parameters can be stacked along the mapped axis::
+
+  def stage_fn(w, x):
+    return jnp.tanh(jnp.dot(x, w))
+
+  def loss_fn(y, target):
+    return jnp.mean((y - target) ** 2)
+
+  @partial(jax.pmap, axis_name='stages', in_axes=(0, None, None))
+  def train_step(w, microbatches, targets):
+    loss, grads = pipeline_value_and_grad(
+        stage_fn, loss_fn, w, microbatches, targets, axis_name='stages',
+        schedule='1f1b')
+    return loss, w - 0.1 * grads
+
+  # ws: (num_stages, d, d); microbatches, targets: (num_microbatches, b, d)
+  loss, ws = train_step(ws, microbatches, targets)
+
+Stages may also be given as a list of ``num_stages`` functions, one per
+stage, in which case each device runs its own with :func:`jax.lax.switch`.
+
+Only the input of each stage is kept for every micro-batch in flight: the
+backward pass recomputes the stage's forward pass from it, as
+:func:`jax.checkpoint` does. The schedule then bounds the activation memory.
+With ``'gpipe'`` all forward passes run before all backward passes, so every
+stage holds one input per micro-batch. With ``'1f1b'`` each stage alternates
+between one forward and one backward pass once the pipeline is full, and
+holds at most ``num_stages`` inputs, however many micro-batches there are.
+"""
+
+from functools import partial
+import operator
+from typing import (Any, Callable, Dict, List, NamedTuple, Sequence, Tuple,
+                    Union)
+
+import numpy as np
+
+from .. import api
+from .. import lax
+from .. import numpy as jnp
+from ..tree_util import tree_map, tree_multimap
+
+Stages = Union[Callable, Sequence[Callable]]
+
+
+class Schedule(NamedTuple):
+  """A static pipeline schedule.
+
+  ``forward[t, s]`` and ``backward[t, s]`` are the micro-batches whose forward
+  and backward passes stage ``s`` runs at tick ``t``, or ``-1`` if it runs
+  none. ``buffer_size`` is the largest number of micro-batches any stage has
+  to hold activations or cotangents for at once.
+  """
+  forward: np.ndarray
+  backward: np.ndarray
+  buffer_size: int
+
+
+def _stage_ops(schedule, num_stages, num_microbatches, stage):
+  forward = [('F', i) for i in range(num_microbatches)]
+  backward = [('B', i) for i in range(num_microbatches)]
+  if schedule == 'forward':
+    return forward
+  elif schedule == 'gpipe':
+    return forward + backward
+  elif schedule == '1f1b':
+    warmup = min(num_stages - stage - 1, num_microbatches)
+    steady = [op for pair in zip(forward[warmup:], backward) for op in pair]
+    return forward[:warmup] + steady + backward[num_microbatches - warmup:]
+  else:
+    raise ValueError("schedule must be one of 'gpipe' or '1f1b', "
+                     f"got {schedule!r}.")
+
+
+def pipeline_schedule(schedule: str, num_stages: int,
+                      num_microbatches: int) -> Schedule:
+  """Computes the schedule used by :func:`pipeline_value_and_grad`.
+
+  Every stage runs its passes in order, each as early as its inputs allow: a
+  forward pass one tick after the previous stage ran it, a backward pass one
+  tick after both its own forward pass and the next stage's backward pass.
+
+  Args:
+    schedule: ``'gpipe'``, ``'1f1b'``, or ``'forward'`` for the forward passes
+      only, as run by :func:`pipeline_apply`.
+    num_stages: the number of pipeline stages.
+    num_microbatches: the number of micro-batches.
+  """
+  ops = [_stage_ops(schedule, num_stages, num_microbatches, s)
+         for s in range(num_stages)]
+  done: Dict[Tuple[str, int, int], int] = {}
+  position = [0] * num_stages
+  rows: Dict[str, List[List[int]]] = {'F': [], 'B': []}
+  tick = 0
+  while any(p < len(o) for p, o in zip(position, ops)):
+    row = {'F': [-1] * num_stages, 'B': [-1] * num_stages}
+    for s in range(num_stages):
+      if position[s] == len(ops[s]):
+        continue
+      kind, i = ops[s][position[s]]
+      if kind == 'F':
+        deps = [('F', s - 1, i)] if s > 0 else []
+      else:
+        deps = [('F', s, i)] + ([('B', s + 1, i)] if s < num_stages - 1 else [])
+      if all(done.get(dep, tick) < tick for dep in deps):
+        row[kind][s] = i
+        done[(kind, s, i)] = tick
+        position[s] += 1
+    rows['F'].append(row['F'])
+    rows['B'].append(row['B'])
+    tick += 1
+
+  # The micro-batches a stage holds data for at any tick form a contiguous
+  # range, so `buffer_size` slots indexed by micro-batch modulo `buffer_size`
+  # never collide.
+  intervals = []
+  for s in range(num_stages):
+    fwd_recv, bwd_recv, stash = [], [], []
+    for i in range(num_microbatches):
+      if s > 0:
+        fwd_recv.append((done[('F', s - 1, i)] + 1, done[('F', s, i)]))
+      if schedule != 'forward':
+        stash.append((done[('F', s, i)], done[('B', s, i)]))
+        start = (done[('F', s, i)] if s == num_stages - 1
+                 else done[('B', s + 1, i)] + 1)
+        bwd_recv.append((start, done[('B', s, i)]))
+    intervals.extend([fwd_recv, bwd_recv, stash])
+  buffer_size = max([sum(start <= t <= stop for start, stop in live)
+                     for live in intervals for t in range(tick)] + [1])
+
+  return Schedule(np.array(rows['F'], np.int32).reshape(tick, num_stages),
+                  np.array(rows['B'], np.int32).reshape(tick, num_stages),
+                  buffer_size)
+
+
+def _stage_fn(stages, axis_name):
+  num_stages = lax.psum(1, axis_name)
+  stage = lax.axis_index(axis_name)
+  if callable(stages):
+    return stages, stage, num_stages
+  stages = list(stages)
+  if len(stages) != num_stages:
+    raise ValueError(f"Got {len(stages)} stage functions for a pipeline over "
+                     f"axis {axis_name!r} of size {num_stages}.")
+  branches = [lambda operand, f=f: f(*operand) for f in stages]
+  return (lambda params, x: lax.switch(stage, branches, (params, x)),
+          stage, num_stages)
+
+
+def _shift(x, tag, axis_name, num_stages, offset):
+  """Sends `x` and its micro-batch tag to the stage `offset` places away."""
+  perm = [(s, s + offset) for s in range(num_stages)
+          if 0 <= s + offset < num_stages]
+  if not perm:
+    return jnp.zeros_like(x), jnp.zeros_like(tag)
+  return lax.ppermute((x, tag), axis_name, perm)
+
+
+def _index(buf, i):
+  return lax.dynamic_index_in_dim(buf, i, keepdims=False)
+
+
+def _update(buf, x, i):
+  return lax.dynamic_update_index_in_dim(buf, x, i, 0)
+
+
+def _num_microbatches(microbatches):
+  if jnp.ndim(microbatches) < 1:
+    raise ValueError("microbatches must have a leading micro-batch axis, got "
+                     "a scalar.")
+  return microbatches.shape[0]
+
+
+def pipeline_apply(stages: Stages, params: Any, microbatches, *,
+                   axis_name, remat: bool = True):
+  """Runs the forward pass of a pipeline, inside a pmap over ``axis_name``.
+
+  The result is differentiable: differentiating it runs the backward passes
+  after all forward passes, as the ``'gpipe'`` schedule of
+  :func:`pipeline_value_and_grad` does.
+
+  Args:
+    stages: a function ``stage_fn(params, x)``, or a list of one such function
+      per stage.
+    params: this stage's parameters.
+    microbatches: an array of shape ``(num_microbatches,) + x.shape`` holding
+      the inputs of the first stage. Only the first stage reads it.
+    axis_name: the pmapped axis whose devices hold the stages, in order.
+    remat: whether to recompute each stage's forward pass during
+      differentiation, see :func:`jax.checkpoint`, so that only stage inputs
+      are kept for the backward pass.
+
+  Returns:
+    The outputs of the last stage, of the same shape as ``microbatches``, on
+    every device.
+
+  The outputs are summed over ``axis_name`` so that every device gets them.
+  If every device then computes the same loss from them, the cotangents of
+  all ``num_stages`` copies flow back through that sum, and the gradients
+  come out multiplied by ``num_stages``. Either divide the loss by the axis
+  size::
+
+    def loss(w):
+      outputs = pipeline_apply(stage_fn, w, microbatches, axis_name='stages')
+      return loss_fn(outputs, targets) / lax.psum(1, 'stages')
+
+  or compute it on the last stage only, e.g. by multiplying it by
+  ``lax.axis_index('stages') == num_stages - 1``.
+  """
+  apply, stage, num_stages = _stage_fn(stages, axis_name)
+  if remat:
+    apply = api.checkpoint(apply)
+  num_microbatches = _num_microbatches(microbatches)
+  sched = pipeline_schedule('forward', num_stages, num_microbatches)
+  size = sched.buffer_size
+  is_first, is_last = stage == 0, stage == num_stages - 1
+  fwd = lax.dynamic_index_in_dim(jnp.asarray(sched.forward), stage, 1,
+                                 keepdims=False)
+
+  def tick(carry, i):
+    fwd_buf, outputs = carry
+    active = i >= 0
+    i = jnp.maximum(i, 0)
+    x = jnp.where(is_first, _index(microbatches, i), _index(fwd_buf, i % size))
+    y = lax.cond(active, partial(apply, params), jnp.zeros_like, x)
+    outputs = _update(outputs, y, jnp.where(is_last & active, i,
+                                            num_microbatches))
+    y, tag = _shift(y, jnp.where(active, i + 1, 0), axis_name, num_stages, 1)
+    fwd_buf = _update(fwd_buf, y, jnp.where(tag > 0, (tag - 1) % size, size))
+    return (fwd_buf, outputs), ()
+
+  # Every buffer has one extra slot at the end, which idle ticks write to.
+  act = microbatches[0]
+  fwd_buf = jnp.zeros((size + 1,) + act.shape, act.dtype)
+  outputs = jnp.zeros((num_microbatches + 1,) + act.shape, act.dtype)
+  (_, outputs), _ = lax.scan(tick, (fwd_buf, outputs), fwd)
+  outputs = jnp.where(is_last, outputs[:num_microbatches], 0)
+  return lax.psum(outputs, axis_name)
+
+
+def pipeline_value_and_grad(stages: Stages, loss_fn: Callable, params: Any,
+                            microbatches, targets, *, axis_name,
+                            schedule: str = '1f1b'):
+  """Computes a pipeline's loss and parameter gradients, inside a pmap.
+
+  The loss is the mean over micro-batches of
+  ``loss_fn(y, target)``, where ``y`` is the last stage's output for a
+  micro-batch and ``target`` its slice of ``targets``.
+
+  Args:
+    stages: a function ``stage_fn(params, x)``, or a list of one such function
+      per stage.
+    loss_fn: a function ``loss_fn(y, target)`` returning a scalar.
+    params: this stage's parameters.
+    microbatches: an array of shape ``(num_microbatches,) + x.shape`` holding
+      the inputs of the first stage. Only the first stage reads it.
+    targets: a pytree of arrays with a leading axis of size
+      ``num_microbatches``. Only the last stage reads it.
+    axis_name: the pmapped axis whose devices hold the stages, in order.
+    schedule: ``'gpipe'`` or ``'1f1b'``, see :func:`pipeline_schedule`. Both
+      give the same results; ``'1f1b'`` needs less memory.
+
+  Returns:
+    A pair of the loss, on every device, and the gradient of the loss with
+    respect to this stage's ``params``.
+  """
+  apply, stage, num_stages = _stage_fn(stages, axis_name)
+  num_microbatches = _num_microbatches(microbatches)
+  sched = pipeline_schedule(schedule, num_stages, num_microbatches)
+  size = sched.buffer_size
+  is_first, is_last = stage == 0, stage == num_stages - 1
+  fwd, bwd = [lax.dynamic_index_in_dim(jnp.asarray(table), stage, 1,
+                                       keepdims=False)
+              for table in (sched.forward, sched.backward)]
+
+  act = microbatches[0]
+  target = tree_map(operator.itemgetter(0), targets)
+  loss_dtype = api.eval_shape(loss_fn, act, target).dtype
+  slot = lambda i, active: jnp.where(active, i % size, size)
+
+  def start_backward(operand):
+    y, i = operand
+    loss, dy = api.value_and_grad(loss_fn)(
+        y, tree_map(partial(_index, i=i), targets))
+    return loss / num_microbatches, dy / num_microbatches
+
+  def backward(operand):
+    x, dy = operand
+    _, f_vjp = api.vjp(apply, params, x)
+    return f_vjp(dy)
+
+  def idle_backward(operand):
+    return tree_map(jnp.zeros_like, params), jnp.zeros_like(operand[0])
+
+  def tick(carry, ops):
+    fwd_buf, bwd_buf, stash, grads, loss = carry
+    f, b = ops
+    f_active, b_active = f >= 0, b >= 0
+    f, b = jnp.maximum(f, 0), jnp.maximum(b, 0)
+
+    # Forward pass. Its input is stashed for the backward pass, and the last
+    # stage turns its output into the cotangent that starts the backward pass.
+    x = jnp.where(is_first, _index(microbatches, f), _index(fwd_buf, f % size))
+    y = lax.cond(f_active, partial(apply, params), jnp.zeros_like, x)
+    stash = _update(stash, x, slot(f, f_active))
+    last = is_last & f_active
+    l, dy = lax.cond(last, start_backward,
+                     lambda operand: (jnp.zeros((), loss_dtype),
+                                      jnp.zeros_like(operand[0])),
+                     (y, f))
+    bwd_buf = _update(bwd_buf, dy, slot(f, last))
+    loss = loss + l
+
+    # Backward pass, recomputing the forward pass from the stashed input.
+    dparams, dx = lax.cond(
+        b_active, backward, idle_backward,
+        (_index(stash, b % size), _index(bwd_buf, b % size)))
+    grads = tree_multimap(operator.add, grads, dparams)
+
+    y, f_tag = _shift(y, jnp.where(f_active, f + 1, 0), axis_name,
+                      num_stages, 1)
+    fwd_buf = _update(fwd_buf, y, slot(f_tag - 1, f_tag > 0))
+    dx, b_tag = _shift(dx, jnp.where(b_active, b + 1, 0), axis_name,
+                       num_stages, -1)
+    bwd_buf = _update(bwd_buf, dx, slot(b_tag - 1, b_tag > 0))
+    return (fwd_buf, bwd_buf, stash, grads, loss), ()
+
+  # Every buffer has one extra slot at the end, which idle ticks write to.
+  buf = jnp.zeros((size + 1,) + act.shape, act.dtype)
+  init = (buf, buf, buf, tree_map(jnp.zeros_like, params),
+          jnp.zeros((), loss_dtype))
+  (_, _, _, grads, loss), _ = lax.scan(tick, init, (fwd, bwd))
+  return lax.psum(loss, axis_name), grads
@@ -30,17 +30,20 @@
 
 from contextlib import contextmanager
 from collections import defaultdict
+import concurrent.futures
 import itertools as it
 import operator as op
+import os
 import threading
-from typing import (Any, Callable, Dict, List, Optional, Sequence, Set, Tuple,
-                    Type, Union)
+from typing import (Any, Callable, Dict, Iterator, List, NamedTuple, Optional,
+                    Sequence, Set, Tuple, Type, Union)
 
 from absl import logging
 import numpy as np
 
 from ..config import flags, config
 from .. import core
+from .. import dtypes
 from .. import linear_util as lu
 from .. import lazy
 from .. import source_info_util
@@ -193,6 +196,132 @@ def _axis_indices(axis_size, num_shards, is_materialized):
   return [slice(i * shard_size, (i + 1) * shard_size) for i in range(num_shards)]
 
 
+### device meshes
+
+class Mesh:
+  """An n-dimensional array of devices with a name for each of its axes.
+
+  Passing a Mesh as the ``devices`` argument of ``pmap`` maps the leading
+  ``mesh.ndim`` axes of the arguments over the mesh axes, in a single compiled
+  program. Inside the mapped function every mesh axis name is bound as if by a
+  nest of pmaps (outermost axis first), so collectives can reduce over any
+  subset of the mesh axes, e.g. ``psum(x, 'model')`` or
+  ``psum(x, ('data', 'model'))``.
+
+  For example, with 8 XLA devices available::
+
+    mesh = Mesh(np.array(jax.devices()).reshape(4, 2), ('data', 'model'))
+
+  Attributes:
+    devices: a numpy object array of devices.
+    axis_names: a tuple with one hashable name per axis of ``devices``.
+  """
+
+  def __init__(self, devices, axis_names: Sequence[Any]):
+    devices = np.asarray(devices, dtype=object)
+    axis_names = tuple(axis_names)
+    if devices.ndim != len(axis_names):
+      raise ValueError(f"Mesh of shape {devices.shape} needs one axis name per "
+                       f"axis, got axis_names={axis_names}.")
+    if len(set(axis_names)) != len(axis_names):
+      raise ValueError(f"Mesh axis names must be unique, got {axis_names}.")
+    if len({d.id for d in devices.flat}) != devices.size:
+      raise ValueError("Mesh devices must be unique.")
+    self.devices = devices
+    self.axis_names = axis_names
+
+  @property
+  def shape(self) -> Tuple[int, ...]:
+    return self.devices.shape
+
+  @property
+  def ndim(self) -> int:
+    return self.devices.ndim
+
+  @property
+  def size(self) -> int:
+    return self.devices.size
+
+  @property
+  def device_list(self) -> Tuple[xb.xla_client.Device, ...]:
+    """The devices in row-major order, i.e. in pmap replica order."""
+    return tuple(self.devices.flat)
+
+  @property
+  def axis_name(self) -> core.MultiAxisName:
+    """The axis name of a pmap over all of the mesh axes at once."""
+    return core.MultiAxisName(self.axis_names, self.shape)
+
+  def _key(self):
+    return self.axis_names, self.shape, tuple(d.id for d in self.devices.flat)
+
+  def __eq__(self, other):
+    return type(other) is Mesh and self._key() == other._key()
+
+  def __hash__(self):
+    return hash(self._key())
+
+  def __repr__(self):
+    axes = ", ".join(f"{name!r}: {size}"
+                     for name, size in zip(self.axis_names, self.shape))
+    return f"Mesh({{{axes}}})"
+
+
+def _flat_to_mesh_sharding_spec(spec: ShardingSpec,
+                                mesh_shape: Tuple[int, ...]) -> ShardingSpec:
+  """Splits the leading (pmapped) axis of `spec` into the mesh axes."""
+  k = len(mesh_shape)
+  return ShardingSpec(
+      shards_per_axis=tuple(mesh_shape) + spec.shards_per_axis[1:],
+      is_axis_materialized=(False,) * k + spec.is_axis_materialized[1:],
+      replication_factors=[(factor, index + k - 1 if index else 0)
+                           for factor, index in spec.replication_factors])
+
+def mesh_sharding_spec(mesh: Mesh, aval: ShapedArray) -> ShardingSpec:
+  """Sharding spec of a value whose leading axes are mapped over `mesh`.
+
+  This is how the results of a ``pmap`` over ``mesh`` are laid out, and
+  arguments laid out this way are passed to such a pmap without transfers.
+  """
+  flat_aval = ShapedArray(aval.shape[mesh.ndim:], aval.dtype)
+  flat_spec = _pmap_sharding_spec(mesh.size, mesh.size, 1, None, flat_aval, True)
+  return _flat_to_mesh_sharding_spec(flat_spec, mesh.shape)
+
+def flatten_mesh_axes(x, mesh: Mesh):
+  """Merges the leading ``mesh.ndim`` axes of `x` into one pmapped axis.
+
+  ShardedDeviceArrays laid out over the mesh are rewrapped without touching
+  their buffers.
+  """
+  shape = np.shape(x)
+  if tuple(shape[:mesh.ndim]) != mesh.shape:
+    raise ValueError(
+        f"pmap over a mesh of shape {mesh.shape} requires the leading axes of "
+        f"mapped arguments to match the mesh shape, got an argument of shape "
+        f"{shape}.")
+  flat_shape = (mesh.size,) + tuple(shape[mesh.ndim:])
+  if type(x) is ShardedDeviceArray and x.device_buffers is not None:
+    if (x.sharding_spec is not None and
+        x.sharding_spec == mesh_sharding_spec(mesh, x.aval)):
+      flat_aval = ShapedArray(flat_shape, x.aval.dtype)
+      flat_spec = _pmap_sharding_spec(mesh.size, mesh.size, 1, None,
+                                      ShapedArray(flat_shape[1:], x.aval.dtype),
+                                      True)
+      return ShardedDeviceArray(flat_aval, flat_spec, x.device_buffers)
+  if isinstance(x, (core.Tracer, xla.DeviceArray)):
+    return x.reshape(flat_shape)
+  return np.reshape(x, flat_shape)
+
+def unflatten_mesh_axes(x, mesh: Mesh):
+  """Inverse of `flatten_mesh_axes`, applied to the results of a pmap."""
+  shape = tuple(mesh.shape) + tuple(np.shape(x)[1:])
+  if type(x) is ShardedDeviceArray:
+    aval = ShapedArray(shape, x.aval.dtype)
+    spec = _flat_to_mesh_sharding_spec(x.sharding_spec, mesh.shape)
+    return ShardedDeviceArray(aval, spec, x.device_buffers)
+  return x.reshape(shape)
+
+
 ### util
 
 def identity(x): return x
@@ -236,6 +365,22 @@ def shard_args(devices: Sequence[xb.xla_client.Device],
   return buffers
 
 
+def shard_leading_axis(x, devices: Sequence[xb.xla_client.Device]
+                       ) -> 'ShardedDeviceArray':
+  """Splits `x` along its leading axis onto `devices`, as `pmap` would.
+
+  The result can be passed to a `pmap`ped function over the same devices
+  without further transfers.
+  """
+  aval = ShapedArray(np.shape(x), dtypes.canonicalize_dtype(np.result_type(x)))
+  sharded_aval = shard_aval(len(devices), aval)
+  sharding_spec = _pmap_sharding_spec(len(devices), len(devices), 1, None,
+                                      sharded_aval, True)
+  indices = spec_to_indices(aval.shape, sharding_spec)
+  buffers = [bufs[0] for bufs in shard_args(devices, [indices], [x])]
+  return ShardedDeviceArray(aval, sharding_spec, buffers, indices)
+
+
 shard_arg_handlers: Dict[Any, Callable[[Any, Any, Any], Sequence[Any]]] = {}
 shard_arg_handlers[core.Unit] = \
     lambda x, devices, _: [xla.device_put(core.unit, d) for d in devices]
@@ -250,6 +395,7 @@ def _shard_device_array(x, devices, indices):
   shards = x._multi_slice(start_indices, limit_indices, removed_dims)
   return [xla.device_put(s, d) for s, d in zip(shards, devices)]
 shard_arg_handlers[xla.DeviceArray] = _shard_device_array
+shard_arg_handlers[xla.PendingDeviceArray] = _shard_device_array
 
 # NOTE(skye): we could refactor to generate _multi_slice parameters directly
 # from the input ShardingSpec, rather than the indices. However, this would
@@ -507,7 +653,9 @@ class ShardedDeviceArray(xla.DeviceArray):
 
   Attributes:
     aval: A ShapedArray indicating the shape and dtype of this array.
-    sharding_spec: describes how this array is sharded across `device_buffers`.
+    sharding_spec: describes how this array is sharded across `device_buffers`,
+      or None if the buffers hold shards of different sizes (e.g. the results
+      of a ragged soft_pmap), which no ShardingSpec can describe.
     device_buffers: the buffers containing the data for this array. Each buffer
       is the same shape and on a different device. Buffers are in row-major
       order, with replication treated as an extra innermost dimension.
@@ -575,6 +723,45 @@ class ShardedDeviceArray(xla.DeviceArray):
     if self.device_buffers is None:
       raise ValueError("ShardedDeviceArray has been deleted.")
 
+  def stream_to_host(self, out: Optional[np.ndarray] = None
+                     ) -> Iterator[Tuple[Index, np.ndarray]]:
+    """Copies the shards to the host, yielding each one as soon as it arrives.
+
+    The copies of all shards are started up front and proceed concurrently, so
+    shards can be processed while others are still being transferred. Only one
+    replica of each shard is copied.
+
+    Args:
+      out: optional NumPy array with the same shape as this array (e.g. a
+        memory-mapped one) into which each shard is written before it is
+        yielded. The yielded arrays are then views into `out`.
+
+    Yields:
+      ``(index, shard)`` pairs in the order in which the copies complete, where
+      ``index`` is the part of the full array the shard holds, i.e.
+      ``np.asarray(self)[index] == shard``.
+    """
+    self._check_if_deleted()
+    if out is not None and out.shape != self.aval.shape:
+      raise ValueError(f"stream_to_host out array has shape {out.shape}, but "
+                       f"the ShardedDeviceArray has shape {self.aval.shape}.")
+    def emit(idx, shard):
+      if out is None:
+        return idx, shard
+      out[idx] = shard
+      return idx, out[idx]
+
+    if self._npy_value is not None:
+      for i in self.one_replica_buffer_indices:
+        yield emit(self.indices[i], self._npy_value[self.indices[i]])
+      return
+    self.copy_to_host_async()
+    executor = _get_host_copy_executor()
+    futures = {executor.submit(self.device_buffers[i].to_py): self.indices[i]
+               for i in self.one_replica_buffer_indices}
+    for future in concurrent.futures.as_completed(futures):
+      yield emit(futures[future], future.result())
+
   def block_until_ready(self):
     self._check_if_deleted()
     for buf in self.device_buffers:
@@ -600,6 +787,19 @@ class ShardedDeviceArray(xla.DeviceArray):
       return super(ShardedDeviceArray, self).__getitem__(idx)
 
 
+_host_copy_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_host_copy_executor_lock = threading.Lock()
+
+def _get_host_copy_executor() -> concurrent.futures.ThreadPoolExecutor:
+  global _host_copy_executor
+  with _host_copy_executor_lock:
+    if _host_copy_executor is None:
+      _host_copy_executor = concurrent.futures.ThreadPoolExecutor(
+          max_workers=os.cpu_count() or 1,
+          thread_name_prefix="jax_host_copy")
+    return _host_copy_executor
+
+
 def _hashable_index(idx):
   return tree_map(lambda x: (x.start, x.stop) if type(x) == slice else x,
                   idx)
@@ -616,9 +816,10 @@ def _shard_sharded_device_array_slow_path(x, devices, indices):
     # Look up all buffers that contain the correct slice of the logical array.
     candidates_list = candidates[_hashable_index(idx)]
     if not candidates_list:
-      # This array isn't sharded correctly. Reshard it via host roundtrip.
-      # TODO(skye): more efficient reshard?
-      return shard_arg_handlers[type(x._value)](x._value, devices, indices)
+      # This array isn't sharded correctly. Assemble the shard from slices of
+      # the existing ones, copying them device to device.
+      bufs.append(_reshard_buffer(x, idx, device))
+      continue
     # Try to find a candidate buffer already on the correct device,
     # otherwise copy one of them.
     for buf in candidates_list:
@@ -628,6 +829,84 @@ def _shard_sharded_device_array_slow_path(x, devices, indices):
     else:
       bufs.append(buf.copy_to_device(device))
   return bufs
+
+def _index_to_box(shape: Tuple[int, ...], idx: Index) -> Tuple[
+    Tuple[int, ...], Tuple[int, ...], Tuple[int, ...]]:
+  """Returns the (starts, limits, removed_dims) of the region `idx` selects."""
+  starts, limits = [0] * len(shape), list(shape)
+  removed_dims = []
+  for dim, sub_idx in enumerate(idx if isinstance(idx, tuple) else (idx,)):
+    if isinstance(sub_idx, int):
+      starts[dim], limits[dim] = sub_idx, sub_idx + 1
+      removed_dims.append(dim)
+    elif sub_idx != slice(None):
+      starts[dim], limits[dim] = sub_idx.start, sub_idx.stop
+  return tuple(starts), tuple(limits), tuple(removed_dims)
+
+def _reshard_buffer(x: 'ShardedDeviceArray', idx: Index,
+                    device: xc.Device) -> xb.xla_client._xla.PyLocalBuffer:
+  """Builds the shard `x[idx]` on `device` without a round trip to the host.
+
+  Every existing shard that overlaps the target region is sliced on the device
+  that holds it, so only the overlap is copied to `device`, where the pieces
+  are concatenated. Of several replicas of a shard, one already on `device` is
+  preferred.
+  """
+  from ..lax import lax  # avoid a circular import
+  starts, limits, removed_dims = _index_to_box(x.shape, idx)
+  sources = {}
+  for buf, src_idx in zip(x.device_buffers, x.indices):
+    key = _hashable_index(src_idx)
+    if key not in sources or buf.device() == device:
+      sources[key] = (buf, src_idx)
+
+  pieces = []
+  for buf, src_idx in sources.values():
+    src_starts, src_limits, src_removed = _index_to_box(x.shape, src_idx)
+    lo = tuple(map(max, starts, src_starts))
+    hi = tuple(map(min, limits, src_limits))
+    if any(l >= h for l, h in zip(lo, hi)):
+      continue
+    box_shape = tuple(h - l for l, h in zip(src_starts, src_limits))
+    if lo == src_starts and hi == src_limits:
+      piece = buf
+    else:
+      piece = _wrap_buffer(buf, x.aval.dtype)
+      if src_removed:
+        piece = lax.reshape(piece, box_shape)
+      piece = lax.slice(piece, tuple(l - s for l, s in zip(lo, src_starts)),
+                        tuple(h - s for h, s in zip(hi, src_starts)))
+      piece = xla._force(piece).device_buffer
+    if piece.device() != device:
+      piece = piece.copy_to_device(device)
+    piece = _wrap_buffer(piece, x.aval.dtype)
+    piece_shape = tuple(h - l for l, h in zip(lo, hi))
+    if piece.shape != piece_shape:
+      piece = lax.reshape(piece, piece_shape)
+    pieces.append((lo, piece))
+
+  out = _concatenate_grid(pieces, len(x.shape))
+  out_shape = tuple(h - l for dim, (l, h) in enumerate(zip(starts, limits))
+                    if dim not in removed_dims)
+  if out.shape != out_shape:
+    out = lax.reshape(out, out_shape)
+  return xla._force(out).device_buffer
+
+def _wrap_buffer(buf, dtype) -> xla.DeviceArray:
+  aval = ShapedArray(buf.shape().dimensions(), dtype)
+  return xla.DeviceArray(aval, buf.device(), lazy.array(aval.shape), buf)
+
+def _concatenate_grid(pieces, ndim):
+  """Concatenates blocks that tile a box, given as (start indices, block)."""
+  if len(pieces) == 1:
+    return pieces[0][1]
+  from ..lax import lax  # avoid a circular import
+  for dim in range(ndim):
+    starts = sorted({lo[dim] for lo, _ in pieces})
+    if len(starts) > 1:
+      break
+  groups = [[p for p in pieces if p[0][dim] == start] for start in starts]
+  return lax.concatenate([_concatenate_grid(g, ndim) for g in groups], dim)
 shard_arg_handlers[ShardedDeviceArray] = _shard_sharded_device_array_slow_path
 
 def _sharded_device_array_constant_handler(c, val, canonicalize_types=True):
@@ -650,7 +929,23 @@ def xla_pmap_impl(fun: lu.WrappedFun, *args, backend, axis_name, axis_size,
                                    donated_invars, *abstract_args)
   return compiled_fun(*args)
 
-@lu.cache
+def precompile_xla_pmap(fun: lu.WrappedFun, avals, *, backend, axis_name,
+                        axis_size, global_axis_size, devices, name,
+                        mapped_invars, donated_invars):
+  """Compiles `fun` as a top-level `xla_pmap` would, without executing it.
+
+  `avals` are the abstract values of the (unsharded) arguments. The result is
+  stored in the `parallel_callable` cache entry that a later top-level
+  `xla_pmap` with arguments matching `avals` will use.
+  """
+  params = dict(backend=backend, axis_name=axis_name, axis_size=axis_size,
+                global_axis_size=global_axis_size, devices=devices, name=name,
+                mapped_invars=mapped_invars, donated_invars=donated_invars)
+  fun = xla.toplevel_call_fun(xla_pmap_p, fun, params)
+  parallel_callable(fun, backend, axis_name, axis_size, global_axis_size,
+                    devices, name, mapped_invars, donated_invars, *avals)
+
+@partial(lu.cache, sizeof=xla.compiled_size_bytes)
 def parallel_callable(fun, backend, axis_name, axis_size, global_axis_size,
                       devices, name, mapped_invars, donated_invars, *avals):
   if devices is not None and len(devices) == 0:
@@ -781,7 +1076,8 @@ def parallel_callable(fun, backend, axis_name, axis_size, global_axis_size,
               f"args {avals}. (num_replicas={num_global_replicas} "
               f"num_partitions={num_partitions}")
 
-  axis_env = xla.AxisEnv(num_global_replicas, (axis_name,), (global_axis_size,), devices)
+  axis_env = xla.extend_axis_env(xla.AxisEnv(num_global_replicas, (), (), devices),
+                                 axis_name, global_axis_size)
 
   tuple_args = len(sharded_avals) > 100  # pass long arg lists as tuple for TPU
 
@@ -852,7 +1148,7 @@ def parallel_callable(fun, backend, axis_name, axis_size, global_axis_size,
       use_spmd_partitioning=use_spmd_partitioning,
   )
   compile_options.parameter_is_tupled_arguments = tuple_args
-  compiled = backend.compile(built, compile_options=compile_options)
+  compiled = xla._backend_compile(backend, built, compile_options)
 
   arg_parts_ = arg_parts or [None] * len(avals)
   input_sharding_specs = [
@@ -954,6 +1250,120 @@ def get_num_partitions(*partitions):
   return num_partitions_set.pop()
 
 
+### partition propagation
+
+# A partition rule maps the avals and partitions of an equation's inputs to
+# `(out_partitions, comm_bytes)`: the partitions of its outputs, and an
+# estimate of the bytes each device receives to compute them from inputs
+# partitioned as given. Partitions are per-dimension partition counts, or None
+# for a replicated value.
+partition_rules: Dict[core.Primitive, Callable] = {}
+
+class PartitionPropagation(NamedTuple):
+  partitions: Dict[core.Var, PartitionsOrReplicated]
+  out_parts: Tuple[PartitionsOrReplicated, ...]
+  comm_bytes: List[Tuple[core.JaxprEqn, float]]
+
+
+def normalize_partitions(parts: PartitionsOrReplicated) -> PartitionsOrReplicated:
+  """Maps partitions that don't split any dimension to None."""
+  return None if parts is None or prod(parts) == 1 else tuple(parts)
+
+def _aval_nbytes(aval) -> int:
+  return prod(aval.shape) * np.dtype(aval.dtype).itemsize
+
+def reshard_bytes(aval, src: PartitionsOrReplicated,
+                  dst: PartitionsOrReplicated) -> float:
+  """Estimates the bytes each device receives to repartition a value."""
+  src, dst = normalize_partitions(src), normalize_partitions(dst)
+  if src == dst or src is None:
+    return 0.  # Partitioning a replicated value only slices it locally.
+  num_parts = prod(src)
+  if dst is None:
+    # All-gather.
+    return _aval_nbytes(aval) * (num_parts - 1) / num_parts
+  # All-to-all.
+  return _aval_nbytes(aval) * (num_parts - 1) / num_parts ** 2
+
+def all_reduce_bytes(aval, parts: PartitionsOrReplicated,
+                     num_summands: int) -> float:
+  """Estimates the bytes each device receives to sum partial results."""
+  nbytes = _aval_nbytes(aval) / prod(normalize_partitions(parts) or ())
+  return 2 * nbytes * (num_summands - 1) / num_summands
+
+def elementwise_partitions(avals, parts, **params):
+  """Partition rule for primitives applied elementwise to same-shaped inputs.
+
+  The output follows the first partitioned input, and any other input
+  partitioned differently is repartitioned to match it.
+  """
+  parts = [normalize_partitions(p) for p in parts]
+  out = next((p for a, p in zip(avals, parts) if p is not None and a.shape),
+             None)
+  comm = sum(reshard_bytes(a, p, out) for a, p in zip(avals, parts) if a.shape)
+  return [out], comm
+
+def reduction_partitions(avals, parts, *, axes, **params):
+  """Partition rule for reductions over ``axes`` of a single operand.
+
+  Reducing over a partitioned dimension leaves each device with a partial
+  result, which is summed across devices into a replicated output.
+  """
+  aval, = avals
+  parts = normalize_partitions(parts[0])
+  if parts is None:
+    return [None], 0.
+  reduced = prod(parts[d] for d in axes)
+  if reduced > 1:
+    out_aval = ShapedArray(tuple(d for i, d in enumerate(aval.shape)
+                                 if i not in axes), aval.dtype)
+    return [None], all_reduce_bytes(out_aval, None, reduced)
+  return [tuple(p for i, p in enumerate(parts) if i not in axes)], 0.
+
+def _default_partitions(avals, parts, num_outs):
+  # Without a rule, inputs are gathered and every output is replicated.
+  return ([None] * num_outs,
+          sum(reshard_bytes(a, p, None) for a, p in zip(avals, parts)))
+
+def propagate_partitions(jaxpr: core.Jaxpr,
+                         in_parts: Sequence[PartitionsOrReplicated]
+                         ) -> PartitionPropagation:
+  """Propagates the partitions of `jaxpr`'s inputs forward through it.
+
+  Equations of primitives without a rule in ``partition_rules`` produce
+  replicated outputs. Calls, like inner ``jit``s, are propagated through.
+  """
+  env: Dict[core.Var, PartitionsOrReplicated] = {}
+  comm: List[Tuple[core.JaxprEqn, float]] = []
+
+  def read(v):
+    return None if type(v) is Literal else env.get(v)
+
+  def propagate(jaxpr, in_parts):
+    for v, parts in safe_zip(jaxpr.invars, in_parts):
+      env[v] = normalize_partitions(parts)
+    for eqn in jaxpr.eqns:
+      parts = [read(v) for v in eqn.invars]
+      avals = [v.aval for v in eqn.invars]
+      if eqn.primitive.call_primitive:
+        out_parts = propagate(eqn.params["call_jaxpr"], parts)
+        eqn_comm = 0.
+      elif eqn.primitive in partition_rules:
+        out_parts, eqn_comm = partition_rules[eqn.primitive](
+            avals, parts, **eqn.params)
+      else:
+        out_parts, eqn_comm = _default_partitions(avals, parts,
+                                                  len(eqn.outvars))
+      for v, p in safe_zip(eqn.outvars, out_parts):
+        env[v] = normalize_partitions(p)
+      if eqn_comm:
+        comm.append((eqn, eqn_comm))
+    return [read(v) for v in jaxpr.outvars]
+
+  out_parts = propagate(jaxpr, in_parts)
+  return PartitionPropagation(env, tuple(out_parts), comm)
+
+
 class ResultToPopulate: pass
 result_to_populate = ResultToPopulate()
 
@@ -1137,36 +1547,37 @@ def _pmap_translation_rule(c, axis_env,
   if global_axis_size is None:
     global_axis_size = axis_size
   new_env = xla.extend_axis_env(axis_env, axis_name, global_axis_size)
+  naxes = len(new_env.names) - len(axis_env.names)
   # Shard the in_nodes that are mapped
   in_avals = [v.aval for v in call_jaxpr.invars]
   in_nodes_sharded = (
-    _xla_shard(c, aval, new_env, in_node) if in_node_mapped else in_node
+    _xla_shard(c, aval, new_env, in_node, naxes) if in_node_mapped else in_node
     for aval, in_node, in_node_mapped in zip(in_avals, in_nodes, mapped_invars))
 
   sharded_outs = xla.jaxpr_subcomp(
       c, call_jaxpr, backend, new_env, (),
       extend_name_stack(name_stack, wrap_name(name, 'pmap')), *in_nodes_sharded)
   out_avals = [v.aval for v in call_jaxpr.outvars]
-  outs = [_xla_unshard(c, aval, new_env, shard, backend=backend)
+  outs = [_xla_unshard(c, aval, new_env, shard, naxes, backend=backend)
           for aval, shard in zip(out_avals, sharded_outs)]
   return xops.Tuple(c, outs)
 
 xla.call_translations[xla_pmap_p] = _pmap_translation_rule
 ad.primitive_transposes[xla_pmap_p] = partial(ad.map_transpose, xla_pmap_p)
 
-def _xla_shard(c, aval, axis_env, x):
+def _xla_shard(c, aval, axis_env, x, naxes=1):
   if aval is core.abstract_unit:
     return x
   elif isinstance(aval, ShapedArray):
     dims = list(c.get_shape(x).dimensions())
     zero = xb.constant(c, np.zeros((), dtype=np.uint32))
-    idxs = [_unravel_index(c, axis_env)] + [zero] * (len(dims) - 1)
+    idxs = [_unravel_index(c, axis_env, naxes)] + [zero] * (len(dims) - 1)
     return xops.Reshape(xops.DynamicSlice(x, idxs, [1] + dims[1:]), dims[1:])
   else:
     raise TypeError((aval, c.get_shape(x)))
 
 # TODO(b/110096942): more efficient gather
-def _xla_unshard(c, aval, axis_env, x, backend):
+def _xla_unshard(c, aval, axis_env, x, naxes=1, *, backend):
   if aval is core.abstract_unit:
     return x
   elif isinstance(aval, ShapedArray):
@@ -1179,12 +1590,13 @@ def _xla_unshard(c, aval, axis_env, x, backend):
     xla_shape = c.get_shape(x)
     dims = list(xla_shape.dimensions())
     padded = xops.Broadcast(xb.constant(c, np.array(0, xla_shape.numpy_dtype())),
-                         [axis_env.sizes[-1]] + dims)
+                         [prod(axis_env.sizes[-naxes:])] + dims)
     zero = xb.constant(c, np.zeros((), dtype=np.uint32))
-    idxs = [_unravel_index(c, axis_env)] + [zero] * len(dims)
+    idxs = [_unravel_index(c, axis_env, naxes)] + [zero] * len(dims)
     padded = xops.DynamicUpdateSlice(padded, xops.Reshape(x, [1] + dims), idxs)
+    axis_names = axis_env.names[-1] if naxes == 1 else axis_env.names[-naxes:]
     replica_groups_protos = xc.make_replica_groups(
-      xla.axis_groups(axis_env, axis_env.names[-1]))
+      xla.axis_groups(axis_env, axis_names))
     out = xops.CrossReplicaSum(padded, replica_groups_protos)
 
     # TODO(mattjj): remove this logic when AllReduce PRED supported on CPU / GPU
@@ -1195,9 +1607,10 @@ def _xla_unshard(c, aval, axis_env, x, backend):
   else:
     raise TypeError((aval, c.get_shape(x)))
 
-def _unravel_index(c, axis_env):
+def _unravel_index(c, axis_env, naxes=1):
+  # Row-major index over the innermost `naxes` axes of the environment.
   div = xb.constant(c, np.array(axis_env.nreps // prod(axis_env.sizes), np.uint32))
-  mod = xb.constant(c, np.array(axis_env.sizes[-1], np.uint32))
+  mod = xb.constant(c, np.array(prod(axis_env.sizes[-naxes:]), np.uint32))
   return xops.Rem(xops.Div(xops.ReplicaId(c), div), mod)
 
 
@@ -1215,14 +1628,17 @@ def _soft_pmap_callable(fun, axis_name, axis_size, mapped_invars, *avals):
     jaxpr, out_avals, consts = pe.trace_to_jaxpr_final(fun, mapped_avals)
   jaxpr = xla.apply_outfeed_rewriter(jaxpr)
 
+  # If the number of devices doesn't divide the axis size, mapped arguments are
+  # padded to a multiple of it. Collectives mask out the padding, and outputs
+  # are trimmed back to axis_size.
   num_devices = xb.local_device_count()
-  chunk_size, ragged = divmod(axis_size, num_devices)
-  if ragged:
-    msg = f"number of devices {num_devices} must divide axis size {axis_size}"
-    raise NotImplementedError(msg)
+  chunk_size = -(-axis_size // num_devices)
+  padded_size = chunk_size * num_devices
+  ragged = padded_size != axis_size
 
   jaxpr, _, consts = _soft_pmap_jaxpr(jaxpr, consts, mapped_invars,
-                                      axis_name, chunk_size)
+                                      axis_name, chunk_size,
+                                      axis_size if ragged else None)
   jaxpr_replicas = xla.jaxpr_replicas(jaxpr)
   if jaxpr_replicas != 1: raise NotImplementedError
 
@@ -1242,31 +1658,79 @@ def _soft_pmap_callable(fun, axis_name, axis_size, mapped_invars, *avals):
           num_replicas=num_devices, num_partitions=1, device_assignment=None)
   compile_options.tuple_arguments = tuple_args
   backend = xb.get_backend(None)
-  compiled = backend.compile(built, compile_options=compile_options)
+  compiled = xla._backend_compile(backend, built, compile_options)
 
+  if ragged:
+    avals = [core.unmapped_aval(padded_size, aval) if m else aval
+             for m, aval in zip(mapped_invars, mapped_avals)]
   input_specs = [
       ShardingSpec(shards_per_axis=(num_devices,) + (1,) * (aval.ndim - 1),
                    is_axis_materialized=(True,) * aval.ndim,
                    replication_factors=[])
       if mapped else
       ShardingSpec(shards_per_axis=(1,) * aval.ndim,
-                   is_axis_materialized=(False,) + (True,) * (aval.ndim - 1),
+                   is_axis_materialized=(True,) * aval.ndim,
                    replication_factors=[(num_devices, 0)])
       for aval, mapped in zip(avals, mapped_invars)]
   input_indices = [spec and spec_to_indices(aval.shape, spec)
                    for aval, spec in zip(avals, input_specs)]
   handle_args = partial(shard_args, compiled.local_devices(), input_indices)
-  handle_outs = soft_pmap_avals_to_results_handler(num_devices, chunk_size, out_avals)
+  if ragged:
+    pad = partial(_pad_leading_axis, padded_size)
+    handle_args = partial(_pad_mapped_args, handle_args, pad, mapped_invars)
+  handle_outs = soft_pmap_avals_to_results_handler(
+      num_devices, chunk_size, out_avals, axis_size)
 
   return partial(execute_replicated, compiled, backend, handle_args, handle_outs)
 
-def _soft_pmap_jaxpr(jaxpr, consts, mapped_invars, axis_name, chunk_size):
-  fun = partial(_soft_pmap_interp, chunk_size, jaxpr, consts, mapped_invars)
+def _pad_mapped_args(handle_args, pad, mapped_invars, args):
+  return handle_args([pad(x) if m else x for x, m in zip(args, mapped_invars)])
+
+def _pad_leading_axis(size, x):
+  from ..lax import lax  # avoid a circular import
+  if isinstance(x, ShardedDeviceArray) and x._npy_value is None:
+    # Copy the shards into the padded array on device, rather than through
+    # the host as `device_put` of a ShardedDeviceArray would.
+    x._check_if_deleted()
+    out = lax.full((size,) + x.aval.shape[1:], 0, x.aval.dtype)
+    for i in x.one_replica_buffer_indices:
+      idx = x.indices[i] if isinstance(x.indices[i], tuple) else (x.indices[i],)
+      buf = x.device_buffers[i]
+      aval = ShapedArray(buf.shape().dimensions(), x.aval.dtype)
+      shard = xla.DeviceArray(aval, None, lazy.array(aval.shape), buf)
+      int_dims = tuple(d for d, j in enumerate(idx) if isinstance(j, int))
+      if int_dims:
+        shard = lax.expand_dims(shard, int_dims)
+      starts = [j if isinstance(j, int) else j.start or 0 for j in idx]
+      starts += [0] * (out.ndim - len(starts))
+      out = lax.dynamic_update_slice(out, shard, starts)
+    return out
+  pads = [(0, size - np.shape(x)[0])] + [(0, 0)] * (np.ndim(x) - 1)
+  if isinstance(x, xla.DeviceArray):
+    return lax.pad(x, lax._const(x, 0), [(lo, hi, 0) for lo, hi in pads])
+  return np.pad(np.asarray(x), pads)
+
+def _soft_pmap_jaxpr(jaxpr, consts, mapped_invars, axis_name, chunk_size,
+                     valid_size):
+  def fun(*args):
+    if valid_size is None:
+      valid = None
+    else:
+      idx = core.axis_index(axis_name)  # type: ignore
+      valid = idx * chunk_size + np.arange(chunk_size) < valid_size
+    return _soft_pmap_interp(chunk_size, valid, jaxpr, consts, mapped_invars,
+                             *args)
   in_avals = [core.unmapped_aval(chunk_size, v.aval) if m else v.aval
               for v, m in zip(jaxpr.invars, mapped_invars)]
   return pe.trace_to_jaxpr_dynamic(lu.wrap_init(fun), in_avals)
 
-def _soft_pmap_interp(chunk_size, jaxpr, consts, mapped_invars, *args):
+def _soft_pmap_interp(chunk_size, valid, jaxpr, consts, mapped_invars, *args):
+  """Evaluates `jaxpr` on the chunk of the mapped axis held by one device.
+
+  `valid` is None, or if the mapped axis was padded, a boolean vector saying
+  which of the `chunk_size` elements are real. Collectives must ignore the
+  others.
+  """
   env: Dict[Var, Tuple[Any, bool]] = {}
 
   def read(atom: Union[Var, Literal]) -> Tuple[Any, bool]:
@@ -1285,13 +1749,15 @@ def _soft_pmap_interp(chunk_size, jaxpr, consts, mapped_invars, *args):
     in_vals, in_mapped = unzip2(map(read, eqn.invars))
     if eqn.primitive in xla.parallel_translations:
       rule = soft_pmap_rules[eqn.primitive]
-      out_vals, out_mapped = rule(in_vals, in_mapped, chunk_size, **eqn.params)
+      out_vals, out_mapped = rule(in_vals, in_mapped, chunk_size, valid,
+                                  **eqn.params)
       if not eqn.primitive.multiple_results:
         out_vals, out_mapped = [out_vals], [out_mapped]
     elif isinstance(eqn.primitive, core.CallPrimitive):
       # we just inline here for convenience
       call_jaxpr, params = core.extract_call_jaxpr(eqn.primitive, eqn.params)
-      out_vals = _soft_pmap_interp(chunk_size, call_jaxpr, (), in_mapped, *in_vals)
+      out_vals = _soft_pmap_interp(chunk_size, valid, call_jaxpr, (),
+                                   in_mapped, *in_vals)
       out_mapped = [True] * len(out_vals)
     elif isinstance(eqn.primitive, core.MapPrimitive):
       raise NotImplementedError  # TODO
@@ -1318,9 +1784,11 @@ def _soft_pmap_interp(chunk_size, jaxpr, consts, mapped_invars, *args):
   return out_vals
 
 # TODO(mattjj): dedup w/ with other aval_to_result_handler via ShardingSpec
-def soft_pmap_avals_to_results_handler(num_devices, chunk_size, out_avals):
+def soft_pmap_avals_to_results_handler(num_devices, chunk_size, out_avals,
+                                       axis_size=None):
   nouts = len(out_avals)
-  handlers = [soft_pmap_aval_to_result_handler(chunk_size, num_devices, aval)
+  handlers = [soft_pmap_aval_to_result_handler(chunk_size, num_devices, aval,
+                                               axis_size)
               for aval in out_avals]
   def handler(out_bufs):
     buffers = [[result_to_populate] * num_devices for _ in range(nouts)]
@@ -1332,26 +1800,57 @@ def soft_pmap_avals_to_results_handler(num_devices, chunk_size, out_avals):
     return [h(bufs) for h, bufs in zip(handlers, buffers)]
   return handler
 
-def soft_pmap_aval_to_result_handler(chunk_size, num_devices, aval):
-  axis_size = chunk_size * num_devices
+def soft_pmap_aval_to_result_handler(chunk_size, num_devices, aval,
+                                     axis_size=None):
+  padded_size = chunk_size * num_devices
+  if axis_size is None:
+    axis_size = padded_size
   if aval is core.abstract_unit:
     return lambda _: core.unit
   elif isinstance(aval, core.ShapedArray):
-    new_aval = ShapedArray((axis_size,) + aval.shape, aval.dtype)
+    padded_aval = ShapedArray((padded_size,) + aval.shape, aval.dtype)
     spec = ShardingSpec(shards_per_axis=(num_devices,) + (1,) * aval.ndim,
-                        is_axis_materialized=(True,) * new_aval.ndim,
+                        is_axis_materialized=(True,) * padded_aval.ndim,
                         replication_factors=[])
-    return lambda bufs: ShardedDeviceArray(new_aval, spec, bufs)
+    if axis_size == padded_size:
+      return lambda bufs: ShardedDeviceArray(padded_aval, spec, bufs)
+    # Drop the padding. Devices holding only padding contribute no buffer, and
+    # the buffer holding the end of the array is sliced on its device.
+    new_aval = ShapedArray((axis_size,) + aval.shape, aval.dtype)
+    num_bufs = -(-axis_size // chunk_size)
+    indices = tuple(slice(i * chunk_size, min((i + 1) * chunk_size, axis_size))
+                    for i in range(num_bufs))
+    last_size = axis_size - (num_bufs - 1) * chunk_size
+    if last_size == chunk_size:
+      # The remaining buffers still split the array into equal shards.
+      new_spec = ShardingSpec(shards_per_axis=(num_bufs,) + (1,) * aval.ndim,
+                              is_axis_materialized=(True,) * new_aval.ndim,
+                              replication_factors=[])
+    else:
+      # A ShardingSpec can only describe equally sized shards, so `indices`
+      # alone says which part of the array each buffer holds.
+      new_spec = None
+    def handler(bufs):
+      bufs = bufs[:num_bufs]
+      if last_size != chunk_size:
+        bufs[-1] = _slice_leading_axis(bufs[-1], last_size, aval.dtype)
+      return ShardedDeviceArray(new_aval, new_spec, bufs, indices)
+    return handler
   else:
     raise TypeError(aval)
 
+def _slice_leading_axis(buf, size, dtype):
+  from ..lax import lax  # avoid a circular import
+  x = _wrap_buffer(buf, dtype)
+  return xla._force(lax.slice_in_dim(x, 0, size)).device_buffer
+
 soft_pmap_p = core.MapPrimitive('soft_pmap')
 soft_pmap = soft_pmap_p.bind
 soft_pmap_p.def_impl(soft_pmap_impl)
 
 soft_pmap_rules: Dict[core.Primitive, Callable] = {}
 
-def _axis_index_soft_pmap_rule(vals, mapped, chunk_size, *, axis_name):
+def _axis_index_soft_pmap_rule(vals, mapped, chunk_size, valid, *, axis_name):
   assert not vals and not mapped
   idx = core.axis_index(axis_name)  # type: ignore
   return idx * chunk_size + np.arange(chunk_size), True
@@ -13,22 +13,26 @@
 # limitations under the License.
 
 from functools import partial
-from typing import Callable, Optional, Tuple
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
 
 import numpy as np
 
 from .. import core
+from .. import dtypes
+from .. import source_info_util
+from ..abstract_arrays import ShapedArray
 from . import ad
 from . import partial_eval as pe
 # TODO(skye): separate pmap into it's own module?
 from . import pxla
 from . import xla
 from .. import linear_util as lu
+from ..lax import lax_control_flow
 from ..lib import xla_bridge as xb
 from ..lib import xla_client as xc
 from ..api_util import flatten_axes, flatten_fun, wraps
 from ..tree_util import tree_flatten, tree_unflatten
-from ..util import extend_name_stack, wrap_name, safe_zip
+from ..util import extend_name_stack, wrap_name, safe_map, safe_zip
 from ..config import config
 
 xops = xc._xla.ops
@@ -72,7 +76,7 @@ def _pval_to_result_handler(npart, parts, pval):
     return pxla.aval_to_result_handler(spec, indices, pv)
 
 
-@lu.cache
+@partial(lu.cache, sizeof=xla.compiled_size_bytes)
 def _sharded_callable(
     fun: lu.WrappedFun, num_partitions: Optional[int],
     in_parts: Tuple[pxla.PartitionsOrReplicated, ...],
@@ -121,9 +125,9 @@ def _sharded_callable(
   device_assignment = np.reshape(device_assignment, (-1, num_partitions))
   # device_assignment = None  # TODO(skye): replace with default device assignment?
 
-  compiled = xb.get_backend().compile(
-      built, compile_options=xb.get_compile_options(
-          nrep, num_partitions, device_assignment))
+  compiled = xla._backend_compile(
+      xb.get_backend(), built,
+      xb.get_compile_options(nrep, num_partitions, device_assignment))
 
   input_specs = [
       pxla.partitioned_sharding_spec(num_partitions, parts, aval)
@@ -216,7 +220,8 @@ class PartitionSpec(tuple):
     return "PartitionSpec%s" % tuple.__repr__(self)
 
 
-def sharded_jit(fun: Callable, in_parts, out_parts, num_partitions: int = None):
+def sharded_jit(fun: Callable, in_parts, out_parts, num_partitions: int = None,
+                auto_partition: bool = False):
   """Like ``jit``, but partitions ``fun`` across multiple devices.
 
   WARNING: this feature is still under active development! It may not work well,
@@ -261,6 +266,12 @@ def sharded_jit(fun: Callable, in_parts, out_parts, num_partitions: int = None):
       calls).  Setting this should usually be unnecessary, but can be used to
       maintain device persistence across multiple sharded_jit calls when some of
       those calls only involve replicated values.
+    auto_partition: Optional. If True, the partitions of ``in_parts`` are
+      propagated through ``fun`` as described in :func:`plan_partitions`, and
+      every intermediate value is constrained to its propagated partitions
+      with ``with_sharding_constraint``. Arguments left as None in
+      ``in_parts`` are replicated, and outputs left as None in ``out_parts``
+      get their propagated partitions.
 
   Returns:
     A version of ``fun`` that will be distributed across multiple devices.
@@ -270,6 +281,12 @@ def sharded_jit(fun: Callable, in_parts, out_parts, num_partitions: int = None):
   else:
     num_parts = pxla.get_num_partitions(in_parts, out_parts)
 
+  # Maps (in_tree, in_avals, in_parts_flat) to the partitioned function, the
+  # out_tree and the out_parts_thunk of auto-partitioned calls. Reusing the
+  # partitioned function and thunk, which are part of the key of the
+  # `_sharded_callable` cache, lets repeated calls hit that cache.
+  auto_partition_cache: Dict[Any, Tuple[Callable, Any, Callable]] = {}
+
   @wraps(fun)
   def wrapped(*args, **kwargs):
     if kwargs:
@@ -278,11 +295,33 @@ def sharded_jit(fun: Callable, in_parts, out_parts, num_partitions: int = None):
     args_flat, in_tree = tree_flatten((args, kwargs))
     in_parts_flat = tuple(flatten_axes("sharded_jit in_parts",
                                        in_tree.children()[0], in_parts))
-    flat_fun, out_tree = flatten_fun(f, in_tree)
-    # TODO(skye): having a function-typed param in a primitive seems dicey, is
-    # there a better way?
-    out_parts_thunk = lambda: tuple(flatten_axes("sharded_jit out_parts",
-                                                 out_tree(), out_parts))
+    if auto_partition:
+      in_avals = tuple(_map(_shaped_abstractify, args_flat))
+      key = (in_tree, in_avals, in_parts_flat)
+      cached = auto_partition_cache.get(key)
+      if cached is None:
+        jaxpr, consts, out_tree_, propagation = _propagate(
+            fun, in_tree.children()[0], in_avals, in_parts_flat)
+        out_parts_flat = tuple(
+            _to_partition_spec(inferred) if given is None else given
+            for given, inferred in safe_zip(
+                flatten_axes("sharded_jit out_parts", out_tree_, out_parts),
+                propagation.out_parts))
+        cached = (partial(_eval_jaxpr_partitioned, jaxpr,
+                          propagation.partitions, consts),
+                  out_tree_, lambda: out_parts_flat)
+        # Closed-over tracers of an enclosing trace must not outlive it.
+        if not any(isinstance(c, core.Tracer) for c in consts):
+          auto_partition_cache[key] = cached
+      partitioned_fun, out_tree_, out_parts_thunk = cached
+      flat_fun = lu.wrap_init(partitioned_fun)
+      out_tree = lambda: out_tree_
+    else:
+      flat_fun, out_tree = flatten_fun(f, in_tree)
+      # TODO(skye): having a function-typed param in a primitive seems dicey,
+      # is there a better way?
+      out_parts_thunk = lambda: tuple(flatten_axes("sharded_jit out_parts",
+                                                   out_tree(), out_parts))
     out = sharded_call(
         flat_fun,
         *args_flat,
@@ -295,6 +334,128 @@ def sharded_jit(fun: Callable, in_parts, out_parts, num_partitions: int = None):
   return wrapped
 
 
+def _to_partition_spec(parts):
+  return None if parts is None else PartitionSpec(*parts)
+
+
+def _shaped_abstractify(x):
+  # Also accepts stand-ins with `shape` and `dtype`, like jax.ShapeDtypeStruct.
+  if hasattr(x, "shape") and hasattr(x, "dtype"):
+    return ShapedArray(tuple(x.shape), dtypes.canonicalize_dtype(x.dtype))
+  return core.raise_to_shaped(core.get_aval(x))
+
+
+def _propagate(fun, in_tree, in_avals, in_parts_flat):
+  typed_jaxpr, consts, out_tree = lax_control_flow._initial_style_jaxpr(
+      fun, in_tree, in_avals)
+  jaxpr = typed_jaxpr.jaxpr
+  propagation = pxla.propagate_partitions(
+      jaxpr, (None,) * len(consts) + tuple(in_parts_flat))
+  return jaxpr, consts, out_tree, propagation
+
+
+def _eval_jaxpr_partitioned(jaxpr, partitions, consts, *args):
+  """Like ``core.eval_jaxpr``, but constrains every equation's outputs.
+
+  Calls are inlined, so that the values inside them are constrained too.
+  """
+  env = {}
+
+  def read(v):
+    return v.val if type(v) is core.Literal else env[v]
+
+  def write(v, val):
+    env[v] = val
+
+  write(core.unitvar, core.unit)
+  safe_map(write, jaxpr.invars, tuple(consts) + args)
+  for eqn in jaxpr.eqns:
+    in_vals = safe_map(read, eqn.invars)
+    if eqn.primitive.call_primitive:
+      outs = _eval_jaxpr_partitioned(eqn.params["call_jaxpr"], partitions, (),
+                                     *in_vals)
+    else:
+      with source_info_util.user_context(eqn.source_info):
+        outs = eqn.primitive.bind(*in_vals, **eqn.params)
+      if not eqn.primitive.multiple_results:
+        outs = [outs]
+      if eqn.primitive is not sharding_constraint_p:
+        outs = [x if partitions.get(v) is None else
+                with_sharding_constraint(x, PartitionSpec(*partitions[v]))
+                for v, x in safe_zip(eqn.outvars, outs)]
+    safe_map(write, eqn.outvars, outs)
+  return safe_map(read, jaxpr.outvars)
+
+
+class PartitionPlan(NamedTuple):
+  """The result of :func:`plan_partitions`.
+
+  Attributes:
+    out_parts: the propagated partitions of the outputs, as a pytree of
+      PartitionSpecs, or None for replicated outputs, matching the outputs.
+    comm_bytes: the estimated total number of bytes each device receives.
+    comm: a list of ``(description, bytes)`` pairs for each operation that
+      communicates, most expensive first.
+  """
+  out_parts: Any
+  comm_bytes: float
+  comm: List[Tuple[str, float]]
+
+
+def plan_partitions(fun: Callable, in_parts) -> Callable[..., PartitionPlan]:
+  """Propagates input partitions through ``fun`` and estimates communication.
+
+  WARNING: this feature is still under active development! It may not work well,
+  and may change without warning!
+
+  Partitions are propagated forward through the operations of ``fun``:
+  elementwise operations keep the partitions of their inputs, and
+  ``dot_general``, reductions, ``transpose``, ``reshape`` and
+  ``broadcast_in_dim`` carry them over to the dimensions of their outputs
+  where they can. When an operation can't keep a partitioning, for example a
+  reduction over a partitioned dimension, its output is replicated and the
+  communication that costs is estimated, in bytes received per device. Other
+  operations gather their inputs and replicate their outputs.
+  ``with_sharding_constraint`` calls override the propagated partitions.
+
+  This lets you compare layouts for ``sharded_jit`` without compiling them::
+
+    def f(x, w):
+      return jnp.tanh(x @ w).sum(axis=0)
+
+    plan = plan_partitions(f, (PartitionSpec(2, 1), None))(x, w)
+    plan.out_parts   # None: the sum over axis 0 is replicated
+    plan.comm_bytes  # the all-reduce of the sum
+
+  The same propagation is used by ``sharded_jit(..., auto_partition=True)``.
+
+  Args:
+    fun: the function to analyze.
+    in_parts: the partitions of the arguments of ``fun``, as for
+      :func:`sharded_jit`. None leaves an argument replicated.
+
+  Returns:
+    A function that takes arguments for ``fun``, or ``jax.ShapeDtypeStruct``
+    stand-ins for them, and returns a :class:`PartitionPlan`.
+  """
+  def plan(*args):
+    args_flat, in_tree = tree_flatten(args)
+    in_parts_flat = tuple(flatten_axes("plan_partitions in_parts", in_tree,
+                                       in_parts))
+    in_avals = tuple(_map(_shaped_abstractify, args_flat))
+    _, _, out_tree, propagation = _propagate(fun, in_tree, in_avals,
+                                             in_parts_flat)
+    comm = sorted(
+        ((f"{eqn.primitive.name} at "
+          f"{source_info_util.summarize(eqn.source_info)}", nbytes)
+         for eqn, nbytes in propagation.comm_bytes),
+        key=lambda c: -c[1])
+    out_parts = tree_unflatten(
+        out_tree, _map(_to_partition_spec, propagation.out_parts))
+    return PartitionPlan(out_parts, sum(nbytes for _, nbytes in comm), comm)
+  return plan
+
+
 def _sharding_constraint_impl(x, partitions):
   # TODO(skye): can we also prevent this from being called in other
   # non-sharded_jit contexts? (e.g. pmap, control flow)
@@ -311,6 +472,11 @@ ad.deflinear(sharding_constraint_p,
              lambda ct, partitions: (with_sharding_constraint(ct, partitions),))
 xla.translations[sharding_constraint_p] = _sharding_constraint_translation_rule
 
+def _sharding_constraint_partitions(avals, parts, *, partitions):
+  return [partitions], pxla.reshard_bytes(avals[0], parts[0], partitions)
+
+pxla.partition_rules[sharding_constraint_p] = _sharding_constraint_partitions
+
 def with_sharding_constraint(x, partitions: Optional[PartitionSpec]):
   """Identity-like function that specifies how ``x`` should be sharded.
 
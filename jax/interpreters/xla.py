@@ -13,11 +13,15 @@
 # limitations under the License.
 
 
-from collections import defaultdict, deque, namedtuple
+from collections import OrderedDict, defaultdict, deque, namedtuple
+from contextlib import contextmanager
 import itertools as it
 import operator as op
+import os
+import threading
 from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Type, Tuple
 from warnings import warn
+import weakref
 
 from absl import logging
 import numpy as np
@@ -65,6 +69,16 @@ flags.DEFINE_bool('jax_debug_nans',
 flags.DEFINE_bool('jax_log_compiles',
                   bool_env('JAX_LOG_COMPILES', False),
                   'Print a message each time a `jit` computation is compiled.')
+flags.DEFINE_integer(
+    'jax_eager_fusion_max_ops',
+    int(os.getenv('JAX_EAGER_FUSION_MAX_OPS', '64')),
+    'Maximum number of primitive applications fused into one computation '
+    'under `eager_fusion`.')
+flags.DEFINE_integer(
+    'jax_primitive_cache_max_entries',
+    int(os.getenv('JAX_PRIMITIVE_CACHE_MAX_ENTRIES', '4096')),
+    'Maximum number of compiled primitives kept for op-by-op execution. Least '
+    'recently used entries are evicted first. 0 means unbounded.')
 
 # This flag is set on exit; no logging should be attempted
 _on_exit = False
@@ -213,6 +227,8 @@ def primitive_uses_outfeed(prim: core.Primitive, params: Dict) -> bool:
 ### op-by-op execution
 
 def arg_spec(x):
+  if type(x) is DeviceArray:
+    return x.aval, x._device
   aval = abstractify(x)
   try:
     return aval, x._device
@@ -221,12 +237,74 @@ def arg_spec(x):
 
 def apply_primitive(prim, *args, **params):
   """Impl rule that compiles and runs a single primitive 'prim' using XLA."""
-  compiled_fun = xla_primitive_callable(prim, *unsafe_map(arg_spec, args), **params)
+  if _eager_fusion_state.enabled:
+    out = _fuse_primitive(prim, args, params)
+    if out is not None:
+      return out
+  key = (prim, tuple(unsafe_map(arg_spec, args)), tuple(params.items()))
+  compiled_fun = _primitive_cache.get(key)
+  if compiled_fun is None:
+    compiled_fun = _primitive_cache_miss(key)
+  else:
+    _primitive_cache_stats.hits += 1
+    try:
+      _primitive_cache.move_to_end(key)
+    except KeyError:
+      pass  # evicted concurrently by another thread
   return compiled_fun(*args)
 
-@cache()
 def xla_primitive_callable(prim, *arg_specs: Tuple[core.AbstractValue,
                                                    Optional[Device]], **params):
+  """Returns a cached executable applying `prim` to arguments of `arg_specs`."""
+  key = (prim, arg_specs, tuple(params.items()))
+  compiled_fun = _primitive_cache.get(key)
+  if compiled_fun is None:
+    return _primitive_cache_miss(key)
+  _primitive_cache_stats.hits += 1
+  return compiled_fun
+
+# Executables for op-by-op execution, keyed by (prim, arg_specs, params) and
+# ordered from least to most recently used. This is a hand-rolled LRU cache,
+# rather than a `functools.lru_cache`, so that hits only cost one dict lookup
+# on the key `apply_primitive` builds anyway, and so that its size can be
+# configured at runtime.
+class _PrimitiveCacheStats:
+  __slots__ = ["hits", "misses", "evictions"]
+  def __init__(self): self.hits = self.misses = self.evictions = 0
+
+_primitive_cache: 'OrderedDict[Any, Callable]' = OrderedDict()
+_primitive_cache_stats = _PrimitiveCacheStats()
+
+def _primitive_cache_miss(key):
+  prim, arg_specs, params = key
+  compiled_fun = _xla_primitive_callable(prim, *arg_specs, **dict(params))
+  with lu._cache_lock:
+    _primitive_cache_stats.misses += 1
+    _primitive_cache[key] = compiled_fun
+    max_entries = FLAGS.jax_primitive_cache_max_entries
+    while max_entries and len(_primitive_cache) > max_entries:
+      _primitive_cache.popitem(last=False)
+      _primitive_cache_stats.evictions += 1
+  return compiled_fun
+
+def _primitive_cache_info() -> lu.CacheInfo:
+  with lu._cache_lock:
+    compiled_funs = list(_primitive_cache.values())
+  return lu.CacheInfo(
+      _primitive_cache_stats.hits, _primitive_cache_stats.misses,
+      _primitive_cache_stats.evictions, len(compiled_funs),
+      sum(map(compiled_size_bytes, compiled_funs)))
+
+def _primitive_cache_clear():
+  with lu._cache_lock:
+    _primitive_cache.clear()
+    _primitive_cache_stats.__init__()  # type: ignore
+
+xla_primitive_callable.cache_info = _primitive_cache_info  # type: ignore
+xla_primitive_callable.cache_clear = _primitive_cache_clear  # type: ignore
+
+def _xla_primitive_callable(prim, *arg_specs: Tuple[core.AbstractValue,
+                                                    Optional[Device]], **params):
   avals, arg_devices = unzip2(arg_specs)
   donated_invars = (False,) * len(arg_specs)
   device = _device_from_arg_devices(arg_devices)
@@ -241,8 +319,8 @@ def xla_primitive_callable(prim, *arg_specs: Tuple[core.AbstractValue,
   if not prim.multiple_results:
     handle_result = aval_to_result_handler(device, aval_out)
   else:
-    handlers = map(partial(aval_to_result_handler, device), aval_out)
-    handle_result = lambda xs: tuple(h(x) for h, x in zip(handlers, xs))
+    handlers = tuple(map(partial(aval_to_result_handler, device), aval_out))
+    handle_result = partial(_handle_results, handlers)
   tuple_args = len(avals) > 100
   if prim in initial_style_translations:
     nreps = initial_style_primitive_replicas(params)
@@ -263,9 +341,12 @@ def xla_primitive_callable(prim, *arg_specs: Tuple[core.AbstractValue,
   options.parameter_is_tupled_arguments = tuple_args
   compiled = _backend_compile(backend, built_c, options)
   if nreps == 1:
-    return partial(_execute_compiled_primitive, prim, compiled, handle_result)
+    compiled_device, = compiled.local_devices()
+    has_tokens = any(aval is core.abstract_token for aval in avals)
+    return partial(_execute_compiled_primitive, compiled, prim, compiled_device,
+                   has_tokens, handle_result)
   else:
-    return partial(_execute_replicated_primitive, prim, compiled, handle_result)
+    return partial(_execute_replicated_primitive, compiled, prim, handle_result)
 
 def _device_from_arg_devices(devices: Sequence[Optional[Device]]) -> Optional[Device]:
   """Given devices of inputs, determine where to perform a computation.
@@ -321,18 +402,35 @@ def primitive_subcomputation(prim, *avals, **params):
 
 def _backend_compile(backend, built_c, options):
   # we use a separate function call to ensure that XLA compilation appears
-  # separately in Python profiling results
+  # separately in Python profiling results. No Python-side locks are held here,
+  # so compilations started from several threads (e.g. by `compile_async`)
+  # overlap, as the backend compile releases the GIL.
   return backend.compile(built_c, compile_options=options)
 
-def _execute_compiled_primitive(prim, compiled, result_handler, *args):
-  device, = compiled.local_devices()
-  input_bufs = [device_put(x, device) for x in args if x is not token]
+def _handle_results(handlers, bufs):
+  return tuple(h(buf) for h, buf in zip(handlers, bufs))
+
+def _execute_compiled_primitive(compiled, prim, device, has_tokens,
+                                result_handler, *args):
+  if has_tokens:
+    args = [x for x in args if x is not token]
+  input_bufs = [_device_put_arg(x, device) for x in args]
   out_bufs = compiled.execute(input_bufs)
   if FLAGS.jax_debug_nans:
     check_nans(prim, out_bufs)
   return result_handler(out_bufs if prim.multiple_results else out_bufs[0])
 
-def _execute_replicated_primitive(prim, compiled, result_handler, *args):
+def _device_put_arg(x, device):
+  # Fast path for the common case of a materialized DeviceArray that already
+  # lives on the target device, which would otherwise go through several
+  # dispatches in `device_put`.
+  if type(x) is DeviceArray and lazy.is_trivial(x._lazy_expr):
+    x._check_if_deleted()
+    if x.device_buffer.device() == device:
+      return x.device_buffer
+  return device_put(x, device)
+
+def _execute_replicated_primitive(compiled, prim, result_handler, *args):
   input_bufs = [
       [device_put(x, device) for x in args if x is not token]
       for device in compiled.local_devices()]
@@ -450,6 +548,10 @@ def check_backend_params(params, outer_backend):
 AxisEnv = namedtuple('AxisEnv', ['nreps', 'names', 'sizes', 'devices'])
 
 def extend_axis_env(env, name, size):
+  if type(name) is core.MultiAxisName:
+    assert prod(name.sizes) == size
+    return AxisEnv(env.nreps, env.names + name.names, env.sizes + name.sizes,
+                   env.devices)
   return AxisEnv(env.nreps, env.names + (name,), env.sizes + (size,), env.devices)
 
 def axis_read(axis_env, axis_name):
@@ -525,16 +627,70 @@ def jaxpr_collectives(jaxpr):
 
 ### xla_call underlying jit
 
+class _CaptureState(threading.local):
+  def __init__(self):
+    self.entries: Optional[List[Any]] = None
+
+_capture_state = _CaptureState()
+
+@contextmanager
+def capture_cache_entry():
+  """Records the `_xla_callable` cache entry used by the next `xla_call` impl.
+
+  Only the outermost impl call made while the context is active is recorded,
+  so functions compiled while tracing it (e.g. inner jits) are ignored. This is
+  used by `api.jit` to populate its dispatch fast path.
+  """
+  captured: List[Any] = []
+  prev, _capture_state.entries = _capture_state.entries, captured
+  try:
+    yield captured
+  finally:
+    _capture_state.entries = prev
+
 def _xla_call_impl(fun: lu.WrappedFun, *args, device, backend, name, donated_invars):
-  compiled_fun = _xla_callable(fun, device, backend, name, donated_invars,
-                               *unsafe_map(arg_spec, args))
+  captured, _capture_state.entries = _capture_state.entries, None
+  entry = _xla_callable.cache_entry(fun, device, backend, name, donated_invars,
+                                    *unsafe_map(arg_spec, args))
+  compiled_fun = entry.ans
+  if captured is not None:
+    captured.append(entry)
   try:
     return compiled_fun(*args)
   except FloatingPointError:
+    if any(donated_invars):
+      raise  # donated arguments cannot be passed to the de-optimized version
     print("Invalid value encountered in the output of a jit function. "
           "Calling the de-optimized version.")
     return fun.call_wrapped(*args)  # probably won't return
 
+def precompile_xla_call(fun: lu.WrappedFun, arg_specs, *, device, backend, name,
+                        donated_invars):
+  """Compiles `fun` as a top-level `xla_call` would, without executing it.
+
+  `arg_specs` are `(aval, device)` pairs as returned by `arg_spec`. The result
+  is stored in the same `_xla_callable` cache entry that a later top-level
+  `xla_call` with arguments matching `arg_specs` will use, which is returned.
+  """
+  fun = toplevel_call_fun(xla_call_p, fun, dict(
+      device=device, backend=backend, name=name, donated_invars=donated_invars))
+  return _xla_callable.cache_entry(fun, device, backend, name, donated_invars,
+                                   *arg_specs)
+
+def toplevel_call_fun(primitive, fun: lu.WrappedFun, params) -> lu.WrappedFun:
+  """Returns `fun` as `primitive.bind` passes it to the impl at top level.
+
+  That is, with the transformation `core.call_bind` applies before dispatching
+  to the impl, which is part of the impl's compilation cache key.
+  """
+  trace_stack = core.thread_local_state.trace_state.trace_stack
+  if config.omnistaging_enabled:
+    level = trace_stack.dynamic.level
+  else:
+    level = trace_stack.next_level(True)
+  fun, _ = core.process_env_traces(fun, primitive, level, tuple(params.items()))
+  return fun
+
 def flatten_shape(s: XlaShape) -> Sequence[Tuple[Sequence[int], XlaShape]]:
   """Expands a given shape tree into a flat list of indices to arrays.
 
@@ -584,7 +740,19 @@ def _xla_consts(c, consts):
       id_: xb.constant(c, const) for id_, const in unique_consts.items()}
   return [xla_consts[id(const)] for const in consts]
 
-@lu.cache
+def compiled_size_bytes(compiled_fun) -> int:
+  """Estimates the memory held by a compiled function built around `compiled`.
+
+  Compiled functions are partial applications of an executor to an XLA
+  executable, e.g. ``partial(_execute_compiled, compiled, handlers)``. Trivial
+  computations, which do not hold an executable, are assigned size zero.
+  """
+  args = getattr(compiled_fun, 'args', ())
+  compiled = args[0] if args else None
+  size_fn = getattr(compiled, 'size_of_generated_code_in_bytes', None)
+  return size_fn() if size_fn else 0
+
+@partial(lu.cache, sizeof=compiled_size_bytes)
 def _xla_callable(fun: lu.WrappedFun, device, backend, name, donated_invars, *arg_specs):
   if device is not None and backend is not None:
     raise ValueError("can't specify both a device and a backend for jit, "
@@ -1221,6 +1389,202 @@ def _lazy_force_computation(aval: core.ShapedArray,
   return force_fun
 
 
+### eager op fusion
+
+class _EagerFusionState(threading.local):
+  def __init__(self):
+    self.enabled = False
+    self.trace: Optional[_FusionTrace] = None
+
+_eager_fusion_state = _EagerFusionState()
+
+@contextmanager
+def eager_fusion(enable: bool = True):
+  """Context manager that fuses consecutive eager primitive applications.
+
+  See :py:func:`jax.eager_fusion`.
+  """
+  state = _eager_fusion_state
+  prev_enabled, prev_trace = state.enabled, state.trace
+  state.enabled, state.trace = enable, None
+  try:
+    yield
+  finally:
+    # Values still pending are computed when they are first needed. The outer
+    # trace may have been flushed meanwhile, in which case it's not resumed.
+    if prev_trace is not None and prev_trace.flushed:
+      prev_trace = None
+    state.enabled, state.trace = prev_enabled, prev_trace
+
+class _FusionTrace:
+  """A sequence of eager primitive applications awaiting fused execution.
+
+  Variables are numbered by their order of creation. Each is either an input,
+  with a value in `inputs`, or the output of one of `eqns`. Outputs of the
+  fused computation are the variables whose PendingDeviceArrays are still
+  alive when the trace is flushed.
+  """
+  __slots__ = ["var_avals", "input_vars", "inputs", "input_ids", "eqns",
+               "outputs", "max_ops", "flushed"]
+
+  def __init__(self):
+    self.var_avals: List[ShapedArray] = []
+    self.input_vars: List[int] = []
+    self.inputs: List[Any] = []  # DeviceArrays or buffers
+    self.input_ids: Dict[int, int] = {}  # id of an input DeviceArray -> var
+    self.eqns: List[Tuple[core.Primitive, Tuple, Tuple[int, ...], int]] = []
+    self.outputs: List[Tuple[int, Any]] = []  # (var, weakref to the output)
+    self.max_ops = FLAGS.jax_eager_fusion_max_ops
+    self.flushed = False
+
+  def new_var(self, aval):
+    self.var_avals.append(aval)
+    return len(self.var_avals) - 1
+
+  def flush(self):
+    if self.flushed:
+      return
+    if _eager_fusion_state.trace is self:
+      _eager_fusion_state.trace = None
+    outputs = [(v, x) for v, ref in self.outputs for x in [ref()]
+               if x is not None]
+    if outputs:
+      in_avals = tuple(self.var_avals[v] for v in self.input_vars)
+      out_vars = tuple(v for v, _ in outputs)
+      key = (in_avals, tuple(self.input_vars), tuple(self.eqns), out_vars)
+      compiled = _fused_executable(key)
+      device, = compiled.local_devices()
+      input_bufs = [_device_put_arg(x, device) if isinstance(x, DeviceArray)
+                    else x for x in self.inputs]
+      out_bufs = compiled.execute(input_bufs)
+      if FLAGS.jax_debug_nans:
+        for buf in out_bufs:
+          _check_nans("eager_fusion", buf.shape(), buf)
+      for (_, x), buf in zip(outputs, out_bufs):
+        _device_buffer_slot.__set__(x, buf)  # type: ignore
+        x._fusion_trace = None
+    self.flushed = True
+    self.inputs = self.input_ids = self.eqns = self.outputs = None  # type: ignore
+
+def _fuse_primitive(prim, args, params):
+  """Records `prim` applied to `args` in the current fusion trace.
+
+  Returns a PendingDeviceArray, or None if the application can't be fused and
+  should be executed on its own.
+  """
+  if (prim.multiple_results or prim not in translations or
+      primitive_uses_outfeed(prim, params)):
+    return None
+  trace = _eager_fusion_state.trace
+  if trace is None or trace.flushed or len(trace.eqns) >= trace.max_ops:
+    if trace is not None:
+      trace.flush()
+    trace = _eager_fusion_state.trace = _FusionTrace()
+
+  avals, in_vars, new_inputs = [], [], []
+  for x in args:
+    if type(x) is PendingDeviceArray and x._fusion_trace is trace:
+      aval, var = x.aval, x._fusion_var
+    elif type(x) is DeviceArray or type(x) is PendingDeviceArray:
+      if x._device is not None:
+        return None  # committed to a device; leave placement to the slow path
+      aval, var = x.aval, trace.input_ids.get(id(x))
+      if var is None:
+        new_inputs.append((x, x))
+    else:
+      try:
+        aval = abstractify(x)
+      except TypeError:
+        return None
+      if type(aval) is not ShapedArray:
+        return None
+      # Transfer now, as an unfused application would, so that later mutations
+      # of e.g. a NumPy array can't affect the result.
+      var = None
+      new_inputs.append((x, device_put(x)))
+    avals.append(aval)
+    in_vars.append(var)
+
+  aval_out = prim.abstract_eval(*avals, **params)
+  if type(aval_out) is not ShapedArray:
+    return None
+
+  new_inputs_it = iter(new_inputs)
+  for i, (aval, var) in enumerate(zip(avals, in_vars)):
+    if var is None:
+      x, val = next(new_inputs_it)
+      var = in_vars[i] = trace.new_var(aval)
+      trace.input_vars.append(var)
+      trace.inputs.append(val)
+      if val is x:
+        trace.input_ids[id(x)] = var
+  out_var = trace.new_var(aval_out)
+  trace.eqns.append((prim, tuple(params.items()), tuple(in_vars), out_var))
+  out = PendingDeviceArray(aval_out, trace, out_var)
+  trace.outputs.append((out_var, weakref.ref(out)))
+  return out
+
+@cache()
+def _fused_executable(key):
+  in_avals, input_vars, eqns, out_vars = key
+  newvar = core.gensym()
+  env: Dict[int, core.Var] = {v: newvar(a) for v, a in zip(input_vars, in_avals)}
+  jaxpr_eqns = []
+  for prim, params, in_vars, out_var in eqns:
+    invars = [env[v] for v in in_vars]
+    aval_out = prim.abstract_eval(*(v.aval for v in invars), **dict(params))
+    env[out_var] = newvar(aval_out)
+    jaxpr_eqns.append(core.new_jaxpr_eqn(invars, [env[out_var]], prim,
+                                         dict(params)))
+  jaxpr = core.Jaxpr([], [env[v] for v in input_vars],
+                     [env[v] for v in out_vars], jaxpr_eqns)
+
+  c = xb.make_computation_builder("eager_fusion")
+  xla_args = _xla_callable_args(c, in_avals, False)
+  out_nodes = jaxpr_subcomp(c, jaxpr, None, AxisEnv(1, (), (), None), (),
+                            extend_name_stack("eager_fusion"), *xla_args)
+  built = c.build(xops.Tuple(c, out_nodes))
+  options = xb.get_compile_options(num_replicas=1, num_partitions=1)
+  return _backend_compile(xb.get_backend(None), built, options)
+
+class PendingDeviceArray(DeviceArray):
+  """A DeviceArray whose buffer is the output of a pending fused computation.
+
+  These are produced by op-by-op execution under :py:func:`eager_fusion`. The
+  computation is compiled and run the first time the buffer is needed, e.g. to
+  get the value, to block on it, or to pass it to a jitted function.
+  """
+  __slots__ = ["_fusion_trace", "_fusion_var"]
+
+  def __init__(self, aval: core.ShapedArray, trace: _FusionTrace, var: int):
+    self.aval = aval
+    self._device = None
+    self._lazy_expr = lazy.array(aval.shape)
+    self._npy_value = None
+    self._fusion_trace = trace
+    self._fusion_var = var
+    _device_buffer_slot.__set__(self, None)  # type: ignore
+
+  @property  # type: ignore
+  def device_buffer(self):
+    if self._fusion_trace is not None:
+      self._fusion_trace.flush()
+    return _device_buffer_slot.__get__(self)  # type: ignore
+
+  @device_buffer.setter
+  def device_buffer(self, buf):
+    _device_buffer_slot.__set__(self, buf)  # type: ignore
+
+_device_buffer_slot = DeviceArray.__dict__["device_buffer"]
+
+core.literalable_types.add(PendingDeviceArray)
+core.pytype_aval_mappings[PendingDeviceArray] = ConcreteArray
+pytype_aval_mappings[PendingDeviceArray] = op.attrgetter('aval')
+canonicalize_dtype_handlers[PendingDeviceArray] = identity
+device_put_handlers[PendingDeviceArray] = _device_put_device_array
+xb.register_constant_handler(PendingDeviceArray, _device_array_constant_handler)
+
+
 def _device_put_impl(x, device: Optional[Device] = None):
   if type(x) is DeviceArray:
     return _copy_device_array_to_device(x, device)
@@ -1233,6 +1597,38 @@ def _device_put_impl(x, device: Optional[Device] = None):
   handler = aval_to_result_handler(device, a)  # type: ignore[arg-type]
   return handler(device_put(x, device))
 
+def device_put_many(xs: Sequence[Any], device: Optional[Device] = None
+                    ) -> List[Any]:
+  """Like binding `device_put_p` on each of `xs`, with less per-value overhead.
+
+  Unless some of `xs` are tracers, the transfers are issued back to back
+  without going through primitive dispatch, which dominates the cost of putting
+  pytrees with many small leaves.
+  """
+  top_trace = core.find_top_trace(xs)
+  if top_trace is not None and type(top_trace) is not core.EvalTrace:
+    return [device_put_p.bind(x, device=device) for x in xs]
+  return [_device_put_impl(x, device) for x in xs]
+
+def device_get_into(x, out: np.ndarray) -> None:
+  """Copies the value of `x` into the preallocated host array `out`.
+
+  Unlike `np.copyto(out, x)`, this does not keep a host copy of `x` cached on
+  it, and only reads one replica of each shard of a sharded array.
+  """
+  if np.shape(x) != out.shape:
+    raise ValueError(f"device_get out array has shape {out.shape}, but the "
+                     f"value has shape {np.shape(x)}.")
+  if isinstance(x, DeviceArray) and x._npy_value is None:
+    if hasattr(x, "stream_to_host"):  # a pxla.ShardedDeviceArray
+      for _ in x.stream_to_host(out):
+        pass
+      return
+    if not is_device_constant(x):
+      np.copyto(out, _force(x).device_buffer.to_py())
+      return
+  np.copyto(out, x)
+
 device_put_p = core.Primitive('device_put')
 device_put_p.def_impl(_device_put_impl)
 device_put_p.def_abstract_eval(lambda x, device=None: x)
@@ -1301,9 +1697,10 @@ def omnistaging_enabler() -> None:
   del _pval_to_result_handler
 
   def _axis_index_translation_rule(c, *, axis_name, axis_env, platform):
-    div = xb.constant(c, np.array(axis_env.nreps // prod(axis_env.sizes),
+    axis_pos = axis_read(axis_env, axis_name)
+    div = xb.constant(c, np.array(axis_env.nreps // prod(axis_env.sizes[:axis_pos+1]),
                                   dtype=np.uint32))
-    mod = xb.constant(c, np.array(axis_env.sizes[-1], dtype=np.uint32))
+    mod = xb.constant(c, np.array(axis_env.sizes[axis_pos], dtype=np.uint32))
     unsigned_index = xops.Rem(xops.Div(xops.ReplicaId(c), div), mod)
     return xops.ConvertElementType(unsigned_index, xb.dtype_to_etype(np.int32))
   parallel_translations[core.axis_index_p] = _axis_index_translation_rule  # type: ignore
@@ -319,6 +319,7 @@ from .lax_fft import (
 )
 from .lax_parallel import (
   all_gather,
+  all_gather_p,
   all_to_all,
   all_to_all_p,
   axis_index,
@@ -331,6 +332,9 @@ from .lax_parallel import (
   ppermute_p,
   pshuffle,
   psum,
+  psum_bucketed,
   psum_p,
+  psum_scatter,
+  psum_scatter_p,
   pswapaxes,
 )
@@ -1878,9 +1878,11 @@ def zeros_like_array(x):
   return full_like(x, 0)
 
 for t in itertools.chain(dtypes.python_scalar_dtypes.keys(), array_types,
-                         [xla.DeviceArray, pxla.ShardedDeviceArray]):
+                         [xla.DeviceArray, xla.PendingDeviceArray,
+                          pxla.ShardedDeviceArray]):
   ad_util.jaxval_adders[t] = add
 ad_util.jaxval_zeros_likers[xla.DeviceArray] = zeros_like_array
+ad_util.jaxval_zeros_likers[xla.PendingDeviceArray] = zeros_like_array
 ad_util.jaxval_zeros_likers[pxla.ShardedDeviceArray] = zeros_like_array
 
 
@@ -1933,6 +1935,7 @@ def unop(result_dtype, accepted_dtypes, name, translation_rule=None):
                             translation_rule=translation_rule)
   batching.defvectorized(prim)
   masking.defvectorized(prim)
+  pxla.partition_rules[prim] = pxla.elementwise_partitions
   return prim
 standard_unop = partial(unop, _identity)
 _attrgetter = lambda name: lambda x, **kwargs: getattr(x, name)
@@ -1972,6 +1975,7 @@ def naryop(result_dtype, accepted_dtypes, name, translation_rule=None):
                             translation_rule=translation_rule)
   batching.defbroadcasting(prim)
   masking.defnaryop(prim)
+  pxla.partition_rules[prim] = pxla.elementwise_partitions
   return prim
 standard_naryop = partial(naryop, _input_dtype)
 
@@ -2284,6 +2288,7 @@ integer_pow_p = standard_primitive(
   translation_rule=_integer_pow_translation_rule)
 batching.defvectorized(integer_pow_p)
 masking.defvectorized(integer_pow_p)
+pxla.partition_rules[integer_pow_p] = pxla.elementwise_partitions
 ad.defjvp(integer_pow_p, _integer_pow_jvp)
 
 _replace_zero = lambda x: select(eq(x, _const(x, 0)), _ones(x), x)
@@ -2442,6 +2447,7 @@ convert_element_type_p = standard_primitive(
 ad.deflinear(convert_element_type_p, _convert_element_type_transpose_rule)
 batching.defvectorized(convert_element_type_p)
 masking.defvectorized(convert_element_type_p)
+pxla.partition_rules[convert_element_type_p] = pxla.elementwise_partitions
 
 
 def _bitcast_convert_type_shape_rule(operand, *, new_dtype):
@@ -3007,6 +3013,48 @@ batching.primitive_batchers[dot_general_p] = _dot_general_batch_rule
 masking.masking_rules[dot_general_p] = _dot_general_masking_rule
 
 
+def _dot_general_partitions(avals, parts, *, dimension_numbers, precision):
+  (lhs_contract, rhs_contract), (lhs_batch, rhs_batch) = dimension_numbers
+  lhs, rhs = avals
+  lhs_parts, rhs_parts = [pxla.normalize_partitions(p) or (1,) * a.ndim
+                          for a, p in zip(avals, parts)]
+  lhs_free = [d for d in range(lhs.ndim)
+              if d not in lhs_contract and d not in lhs_batch]
+  rhs_free = [d for d in range(rhs.ndim)
+              if d not in rhs_contract and d not in rhs_batch]
+  out_aval = ShapedArray(
+      tuple(lhs.shape[d] for d in tuple(lhs_batch) + tuple(lhs_free)) +
+      tuple(rhs.shape[d] for d in rhs_free), lhs.dtype)
+
+  lhs_summands = prod(lhs_parts[d] for d in lhs_contract)
+  rhs_summands = prod(rhs_parts[d] for d in rhs_contract)
+  if lhs_summands > 1 or rhs_summands > 1:
+    # Each device computes a partial sum over its block of the contracting
+    # dimensions, and the partial sums are all-reduced. The other operand has
+    # to be split the same way along the contracting dimensions.
+    comm = pxla.all_reduce_bytes(out_aval, None,
+                                 _max(lhs_summands, rhs_summands))
+    if lhs_summands < rhs_summands:
+      comm += pxla.reshard_bytes(lhs, parts[0], None)
+    elif rhs_summands < lhs_summands:
+      comm += pxla.reshard_bytes(rhs, parts[1], None)
+    return [None], comm
+
+  batch = tuple(_max(lhs_parts[l], rhs_parts[r])
+                for l, r in zip(lhs_batch, rhs_batch))
+  out = (batch + tuple(lhs_parts[d] for d in lhs_free) +
+         tuple(rhs_parts[d] for d in rhs_free))
+  if prod(out) > _max(prod(lhs_parts), prod(rhs_parts)):
+    # Both operands are split along different output dimensions, so keep the
+    # lhs partitions and gather the rhs.
+    out = (tuple(lhs_parts[d] for d in lhs_batch) +
+           tuple(lhs_parts[d] for d in lhs_free) + (1,) * len(rhs_free))
+    return [out], pxla.reshard_bytes(rhs, parts[1], None)
+  return [out], 0.
+
+pxla.partition_rules[dot_general_p] = _dot_general_partitions
+
+
 def _broadcast_shape_rule(operand, sizes):
   _check_shapelike('broadcast', 'sizes', sizes)
   return tuple(sizes) + operand.shape
@@ -3086,6 +3134,17 @@ broadcast_in_dim_p.def_impl(_broadcast_in_dim_impl)
 ad.deflinear(broadcast_in_dim_p, _broadcast_in_dim_transpose_rule)
 batching.primitive_batchers[broadcast_in_dim_p] = _broadcast_in_dim_batch_rule
 
+def _broadcast_in_dim_partitions(avals, parts, *, shape, broadcast_dimensions):
+  parts, = parts
+  if parts is None:
+    return [None], 0.
+  out = [1] * len(shape)
+  for d, p in zip(broadcast_dimensions, parts):
+    out[d] = p
+  return [tuple(out)], 0.
+
+pxla.partition_rules[broadcast_in_dim_p] = _broadcast_in_dim_partitions
+
 
 def _clamp_shape_rule(min, operand, max):
   if min.shape and min.shape != operand.shape:
@@ -3110,6 +3169,7 @@ ad.defjvp(clamp_p,
           lambda g, min, operand, max:
           select(lt(max, operand), _brcast(g, operand), _zeros(operand)))
 batching.defbroadcasting(clamp_p)
+pxla.partition_rules[clamp_p] = pxla.elementwise_partitions
 
 
 def _concatenate_shape_rule(*operands, **kwargs):
@@ -3390,6 +3450,32 @@ reshape_p.def_impl(_reshape_impl)
 ad.deflinear2(reshape_p, _reshape_transpose_rule)
 batching.primitive_batchers[reshape_p] = _reshape_batch_rule
 
+def _reshape_partitions(avals, parts, *, new_sizes, dimensions):
+  # A partitioned dimension stays partitioned if some output dimension starts
+  # at the same position in the flattened array and splits evenly the same
+  # number of ways, since then each device's block is unchanged.
+  aval, = avals
+  parts = pxla.normalize_partitions(parts[0])
+  if parts is None:
+    return [None], 0.
+  if dimensions is None:
+    out = [1] * len(new_sizes)
+    for i, p in enumerate(parts):
+      if p == 1:
+        continue
+      offset = prod(aval.shape[:i])
+      j = next((j for j in range(len(new_sizes))
+                if prod(new_sizes[:j]) == offset and new_sizes[j] % p == 0),
+               None)
+      if j is None:
+        break
+      out[j] = p
+    else:
+      return [tuple(out)], 0.
+  return [None], pxla.reshard_bytes(aval, parts, None)
+
+pxla.partition_rules[reshape_p] = _reshape_partitions
+
 
 def _rev_shape_rule(operand, *, dimensions):
   _check_shapelike('rev', 'dimensions', dimensions)
@@ -3448,6 +3534,12 @@ ad.deflinear(transpose_p,
 batching.primitive_batchers[transpose_p] = _transpose_batch_rule
 masking.masking_rules[transpose_p] = _transpose_masking_rule
 
+def _transpose_partitions(avals, parts, *, permutation):
+  parts, = parts
+  return [None if parts is None else tuple(parts[d] for d in permutation)], 0.
+
+pxla.partition_rules[transpose_p] = _transpose_partitions
+
 
 def _select_shape_rule(pred, on_true, on_false):
   if on_true.shape != on_false.shape:
@@ -3528,6 +3620,7 @@ ad.defjvp(select_p,
 ad.primitive_transposes[select_p] = _select_transpose_rule
 batching.primitive_batchers[select_p] = _select_batch_rule
 masking.masking_rules[select_p] = _select_masking_rule
+pxla.partition_rules[select_p] = pxla.elementwise_partitions
 
 
 def _slice_shape_rule(operand, *, start_indices, limit_indices, strides):
@@ -4409,6 +4502,7 @@ reduce_sum_p = standard_primitive(
   'reduce_sum', _reduce_sum_translation_rule)
 ad.deflinear2(reduce_sum_p, _reduce_sum_transpose_rule)
 batching.defreducer(reduce_sum_p)
+pxla.partition_rules[reduce_sum_p] = pxla.reduction_partitions
 _masking_defreducer(reduce_sum_p,
                     lambda shape, dtype: np.broadcast_to(np.array(0, dtype), shape))
 
@@ -4464,6 +4558,7 @@ reduce_prod_p = standard_primitive(
   'reduce_prod', _reduce_prod_translation_rule)
 ad.primitive_jvps[reduce_prod_p] = _reduce_prod_jvp_rule
 batching.defreducer(reduce_prod_p)
+pxla.partition_rules[reduce_prod_p] = pxla.reduction_partitions
 _masking_defreducer(reduce_prod_p,
                     lambda shape, dtype: np.broadcast_to(np.array(1, dtype), shape))
 
@@ -4493,6 +4588,7 @@ reduce_max_p = standard_primitive(_reduce_op_shape_rule, _input_dtype,
                                   'reduce_max', _reduce_max_translation_rule)
 ad.defjvp2(reduce_max_p, _reduce_chooser_jvp_rule)
 batching.defreducer(reduce_max_p)
+pxla.partition_rules[reduce_max_p] = pxla.reduction_partitions
 _masking_defreducer(reduce_max_p,
                     lambda shape, dtype: np.broadcast_to(np.array(-np.inf, dtype), shape))
 
@@ -4503,6 +4599,7 @@ reduce_min_p = standard_primitive(_reduce_op_shape_rule, _input_dtype,
                                   'reduce_min', _reduce_min_translation_rule)
 ad.defjvp2(reduce_min_p, _reduce_chooser_jvp_rule)
 batching.defreducer(reduce_min_p)
+pxla.partition_rules[reduce_min_p] = pxla.reduction_partitions
 _masking_defreducer(reduce_min_p,
                     lambda shape, dtype: np.broadcast_to(np.array(np.inf, dtype), shape))
 
@@ -4560,6 +4657,7 @@ _argmax_translation_rule = partial(_argminmax_translation_rule, xops.Gt,
 argmin_p = standard_primitive(_argminmax_shape_rule, _argminmax_dtype_rule,
                               'argmin', _argmin_translation_rule)
 batching.defreducer(argmin_p)
+pxla.partition_rules[argmin_p] = pxla.reduction_partitions
 ad.defjvp_zero(argmin_p)
 xla.backend_specific_translations['gpu'][argmin_p] = xla.lower_fun(
   partial(_argminmax_gpu_translation_rule, _reduce_min),
@@ -4568,6 +4666,7 @@ xla.backend_specific_translations['gpu'][argmin_p] = xla.lower_fun(
 argmax_p = standard_primitive(_argminmax_shape_rule, _argminmax_dtype_rule,
                               'argmax', _argmax_translation_rule)
 batching.defreducer(argmax_p)
+pxla.partition_rules[argmax_p] = pxla.reduction_partitions
 ad.defjvp_zero(argmax_p)
 xla.backend_specific_translations['gpu'][argmax_p] = xla.lower_fun(
   partial(_argminmax_gpu_translation_rule, _reduce_max),
@@ -4590,6 +4689,7 @@ _reduce_or_translation_rule = partial(_reduce_logical_translation_rule,
 reduce_or_p = standard_primitive(_reduce_logical_shape_rule, _fixed_dtype(np.bool_),
                                  'reduce_or', _reduce_or_translation_rule)
 batching.defreducer(reduce_or_p)
+pxla.partition_rules[reduce_or_p] = pxla.reduction_partitions
 
 
 _reduce_and_translation_rule = partial(_reduce_logical_translation_rule,
@@ -4597,6 +4697,7 @@ _reduce_and_translation_rule = partial(_reduce_logical_translation_rule,
 reduce_and_p = standard_primitive(_reduce_logical_shape_rule, _fixed_dtype(np.bool_),
                                  'reduce_and', _reduce_and_translation_rule)
 batching.defreducer(reduce_and_p)
+pxla.partition_rules[reduce_and_p] = pxla.reduction_partitions
 
 def _reduce_window_shape_rule(operand, init_value, *, jaxpr, consts,
                               window_dimensions, window_strides, padding,
@@ -26,10 +26,12 @@ from jax import tree_util
 from jax.lax import lax
 from jax.abstract_arrays import ShapedArray, raise_to_shaped
 from jax.interpreters import ad
+from jax.interpreters import batching
 from jax.interpreters import parallel
 from jax.interpreters import xla
 from jax.interpreters import pxla
 from jax.util import partial, unzip2, prod
+from jax.lib import xla_bridge as xb
 from jax.lib import xla_client as xc
 from jax.config import config
 
@@ -112,6 +114,86 @@ def pmean(x, axis_name, *, axis_index_groups=None):
   n = psum(1, axis_name=axis_name, axis_index_groups=axis_index_groups)
   return tree_util.tree_map(lambda v: v / n, x)
 
+def psum_bucketed(x, axis_name, *, bucket_bytes=4 * 2 ** 20,
+                  axis_index_groups=None):
+  """Compute an all-reduce sum of a pytree using a few large all-reduces.
+
+  Equivalent to ``psum(x, axis_name)``, but rather than reducing each leaf of
+  ``x`` separately the leaves are raveled and concatenated, per dtype and in
+  order, into flat buckets of at most ``bucket_bytes`` bytes. Each bucket is
+  all-reduced and then split back into leaves. For pytrees with many small
+  leaves, like the gradients of a model with many small parameters, this
+  replaces a long latency-bound sequence of all-reduces with a few
+  bandwidth-bound ones, which XLA can also overlap with other computation.
+
+  Args:
+    x: array(s) with a mapped axis named ``axis_name``.
+    axis_name: hashable Python object used to name a pmapped axis (see the
+      :func:`jax.pmap` documentation for more details).
+    bucket_bytes: the maximum size of each bucket in bytes. Leaves larger than
+      this are reduced on their own. Controls the number of all-reduces, which
+      is about the total size of ``x`` divided by ``bucket_bytes`` (plus one
+      per dtype).
+    axis_index_groups: optional list of lists containing axis indices, as in
+      :func:`psum`.
+
+  Returns:
+    Array(s) with the same shape as ``x`` representing the result of an
+    all-reduce sum along the axis ``axis_name``.
+  """
+  _validate_axis_index_groups(axis_index_groups)
+  leaves, treedef = tree_util.tree_flatten(x)
+  leaves = [lax.convert_element_type(l, np.int32)
+            if dtypes.dtype(l) == np.bool_ else l for l in leaves]
+  out = list(leaves)
+
+  # Only traced values are bucketed: the rest are reduced without any
+  # communication by psum, and keep their Python types that way.
+  constant_indices = [i for i, l in enumerate(leaves)
+                      if not isinstance(l, core.Tracer)]
+  if constant_indices:
+    reduced = psum([leaves[i] for i in constant_indices], axis_name,
+                   axis_index_groups=axis_index_groups)
+    for i, r in zip(constant_indices, reduced):
+      out[i] = r
+
+  buckets = collections.defaultdict(list)  # dtype -> [[leaf indices, nbytes]]
+  for i, leaf in enumerate(leaves):
+    if not isinstance(leaf, core.Tracer):
+      continue
+    dtype = np.dtype(leaf.dtype)
+    nbytes = prod(np.shape(leaf)) * dtype.itemsize
+    dtype_buckets = buckets[dtype]
+    if dtype_buckets and dtype_buckets[-1][1] + nbytes <= bucket_bytes:
+      dtype_buckets[-1][0].append(i)
+      dtype_buckets[-1][1] += nbytes
+    else:
+      dtype_buckets.append([[i], nbytes])
+  bucket_indices = [indices for dtype_buckets in buckets.values()
+                    for indices, _ in dtype_buckets]
+  if not bucket_indices:
+    return tree_util.tree_unflatten(treedef, out)
+
+  def ravel(i):
+    return lax.reshape(leaves[i], (prod(np.shape(leaves[i])),))
+  flat_buckets = [leaves[indices[0]] if len(indices) == 1
+                  else lax.concatenate([ravel(i) for i in indices], 0)
+                  for indices in bucket_indices]
+  reduced = psum_p.bind(*flat_buckets, axis_name=axis_name,
+                        axis_index_groups=axis_index_groups)
+  for indices, bucket in zip(bucket_indices, reduced):
+    if len(indices) == 1:
+      out[indices[0]] = bucket
+      continue
+    offset = 0
+    for i in indices:
+      shape = np.shape(leaves[i])
+      size = prod(shape)
+      out[i] = lax.reshape(lax.slice(bucket, (offset,), (offset + size,)),
+                           shape)
+      offset += size
+  return tree_util.tree_unflatten(treedef, out)
+
 def pmax(x, axis_name, *, axis_index_groups=None):
   """Compute an all-reduce max on ``x`` over the pmapped axis ``axis_name``.
 
@@ -286,16 +368,99 @@ def all_to_all(x, axis_name, split_axis, concat_axis):
                              axis_name=axis_name)
   return tree_util.tree_map(bind, x)
 
+def psum_scatter(x, axis_name, *, scatter_dimension=0, axis_index_groups=None,
+                 tiled=False):
+  """Compute an all-reduce sum on ``x`` and scatter the result across replicas.
+
+  If ``x`` is a pytree then the result is equivalent to mapping this function to
+  each leaf in the tree.
+
+  The sum is split along ``scatter_dimension`` into one block per replica, and
+  each replica only receives its own block, so that (unlike :func:`psum`) no
+  replica holds the whole result. This is the transpose of :func:`all_gather`.
+
+  On GPU and TPU this lowers to XLA's ReduceScatter when the installed jaxlib
+  exposes it, and otherwise to an AllToAll on TPU. On CPU, and on GPU with
+  older jaxlibs, it is computed from a full all-reduce, which saves memory but
+  not communication.
+
+  Args:
+    x: array(s) with a mapped axis named ``axis_name``.
+    axis_name: hashable Python object used to name a pmapped axis (see the
+      :func:`jax.pmap` documentation for more details).
+    scatter_dimension: a positional axis into which the all-reduce result is
+      scattered.
+    axis_index_groups: optional list of lists containing axis indices (e.g. for
+      an axis of size 4, [[0, 1], [2, 3]] would perform reduce-scatters over the
+      first two and last two replicas). Groups must cover all axis indices
+      exactly once, and all groups must be the same size.
+    tiled: when ``False``, ``x.shape[scatter_dimension]`` must equal the size of
+      the mapped axis (or of the groups), and that dimension is removed from the
+      result. When ``True``, it only needs to be divisible by that size, and
+      each replica receives a slice of it.
+
+  Returns:
+    Array(s) with the same shape as ``x``, except that ``scatter_dimension`` is
+    removed (or divided by the axis size when ``tiled``), holding this
+    replica's block of the all-reduce sum along the axis ``axis_name``.
+
+  For example, with 4 XLA devices available:
+
+  >>> x = np.arange(16.).reshape(4, 4)
+  >>> y = jax.pmap(lambda x: jax.lax.psum_scatter(x, 'i'), axis_name='i')(x)
+  >>> print(y)
+  [24. 28. 32. 36.]
+  """
+  _validate_axis_index_groups(axis_index_groups)
+  axis_size = _group_size(axis_name, axis_index_groups)
+  def bind(leaf):
+    if dtypes.dtype(leaf) == np.bool_:
+      leaf = lax.convert_element_type(leaf, np.int32)
+    if not tiled:
+      if np.shape(leaf)[scatter_dimension] != axis_size:
+        msg = ("psum_scatter requires the size of the mapped axis axis_name "
+               "to equal x.shape[scatter_dimension] unless tiled=True, but "
+               "they are {} and {} respectively.")
+        raise ValueError(msg.format(axis_size, np.shape(leaf)[scatter_dimension]))
+    out = psum_scatter_p.bind(leaf, scatter_dimension=scatter_dimension,
+                              axis_name=axis_name,
+                              axis_index_groups=axis_index_groups,
+                              axis_size=axis_size)
+    if not tiled:
+      shape = list(np.shape(out))
+      del shape[scatter_dimension]
+      out = lax.reshape(out, shape)
+    return out
+  return tree_util.tree_map(bind, x)
+
+def _group_size(axis_name, axis_index_groups):
+  if axis_index_groups is not None:
+    return len(axis_index_groups[0])
+  return psum(1, axis_name)
+
 ### parallel primitives
 
-def _allreduce_soft_pmap_rule(prim, reducer, vals, mapped, chunk_size,
-                              *, axis_name, axis_index_groups):
+def _allreduce_soft_pmap_rule(prim, reducer, identity, vals, mapped,
+                              chunk_size, valid, *, axis_name,
+                              axis_index_groups):
   if axis_index_groups is not None:
     raise NotImplementedError("soft_pmap does not yet support axis_index_groups")
-  reduced_vals = [reducer(x, [0]) if m else x for x, m in zip(vals, mapped)]
+  def reduce_chunk(x, m):
+    # An unmapped value stands for chunk_size equal values.
+    if not m:
+      x = batching.broadcast(x, chunk_size, 0)
+    if valid is not None:
+      # The chunk includes padding, which must not contribute to the result.
+      mask = lax.broadcast_in_dim(valid, x.shape, (0,))
+      x = lax.select(mask, x, lax.full_like(x, identity(x.dtype)))
+    return reducer(x, [0])
+  reduced_vals = [reduce_chunk(x, m) for x, m in zip(vals, mapped)]
   outs = prim.bind(*reduced_vals, axis_name=axis_name,
                    axis_index_groups=axis_index_groups)
-  return outs, (False,) * len(vals)
+  if prim.multiple_results:
+    return outs, (False,) * len(vals)
+  else:
+    return outs, False
 
 def _allreduce_translation_rule(prim, c, val, *, axis_name, axis_index_groups,
                                 axis_env, platform):
@@ -382,7 +547,8 @@ psum_p.multiple_results = True
 psum_p.def_impl(partial(pxla.apply_parallel_primitive, psum_p))
 psum_p.def_abstract_eval(lambda *args, **params: map(raise_to_shaped, args))
 pxla.soft_pmap_rules[psum_p] = \
-    partial(_allreduce_soft_pmap_rule, psum_p, lax._reduce_sum)
+    partial(_allreduce_soft_pmap_rule, psum_p, lax._reduce_sum,
+            lambda dtype: np.array(0, dtype))
 xla.parallel_translations[psum_p] = _psum_translation_rule
 pxla.parallel_pure_rules[psum_p] = lambda *args, shape: (x * prod(shape) for x in args)
 ad.deflinear(psum_p, _psum_transpose_rule)
@@ -393,6 +559,9 @@ pmax_p = core.Primitive('pmax')
 pmax_p.def_abstract_eval(lambda x, **params: raise_to_shaped(x))
 xla.parallel_translations[pmax_p] = \
     partial(_allreduce_translation_rule, lax.max_p)
+pxla.soft_pmap_rules[pmax_p] = \
+    partial(_allreduce_soft_pmap_rule, pmax_p, lax._reduce_max,
+            lax._get_max_identity)
 # pxla.split_axis_rules[pmax_p] = \
 #     partial(_allreduce_split_axis_rule, pmax_p, lax._reduce_max)
 
@@ -401,6 +570,9 @@ pmin_p = core.Primitive('pmin')
 pmin_p.def_abstract_eval(lambda x, **params: raise_to_shaped(x))
 xla.parallel_translations[pmin_p] = \
     partial(_allreduce_translation_rule, lax.min_p)
+pxla.soft_pmap_rules[pmin_p] = \
+    partial(_allreduce_soft_pmap_rule, pmin_p, lax._reduce_min,
+            lax._get_min_identity)
 # pxla.split_axis_rules[pmin_p] = \
 #     partial(_allreduce_split_axis_rule, pmin_p, lax._reduce_min)
 
@@ -472,6 +644,223 @@ ad.deflinear(all_to_all_p, _all_to_all_transpose_rule)
 pxla.multi_host_supported_collectives.add(all_to_all_p)
 
 
+def _replica_group_position(c, replica_groups, nreps):
+  # The position of this replica within its replica group, looked up from a
+  # constant table indexed by replica id.
+  table = np.zeros(nreps, np.uint32)
+  for group in replica_groups:
+    for position, replica in enumerate(group):
+      table[replica] = position
+  position = xops.DynamicSlice(xb.constant(c, table), [xops.ReplicaId(c)], [1])
+  return xops.Reshape(position, [])
+
+def _xla_psum(c, x, replica_groups):
+  # An all-reduce sum, with the special handling of complex and boolean values
+  # that _psum_translation_rule does.
+  replica_groups_protos = xc.make_replica_groups(replica_groups)
+  def all_reduce(v):
+    scalar = ShapedArray((), c.get_shape(v).numpy_dtype())
+    computation = xla.primitive_subcomputation(lax.add_p, scalar, scalar)
+    return xops.AllReduce(v, computation, replica_groups_protos, None, None)
+  dtype = c.get_shape(x).numpy_dtype()
+  if dtypes.issubdtype(dtype, np.complexfloating):
+    return xops.Complex(all_reduce(xops.Real(x)), all_reduce(xops.Imag(x)))
+  elif dtype == np.bool_:
+    # TODO(mattjj): remove when AllReduce PRED supported on CPU / GPU
+    summed = all_reduce(xops.ConvertElementType(x, xb.dtype_to_etype(np.int32)))
+    return xops.Ne(summed, xb.constant(c, np.array(0, np.int32)))
+  else:
+    return all_reduce(x)
+
+def _block_starts(c, dimension, block_size, ndim, position):
+  zero = xb.constant(c, np.zeros((), np.uint32))
+  start = xops.Mul(position, xb.constant(c, np.array(block_size, np.uint32)))
+  return [start if i == dimension else zero for i in range(ndim)]
+
+def _psum_scatter_abstract_eval(x, *, scatter_dimension, axis_name,
+                                axis_index_groups, axis_size):
+  shape = list(x.shape)
+  block_size, ragged = divmod(shape[scatter_dimension], axis_size)
+  if ragged:
+    msg = ("psum_scatter requires x.shape[scatter_dimension] to be divisible "
+           "by the size of the mapped axis, but they are {} and {}.")
+    raise ValueError(msg.format(shape[scatter_dimension], axis_size))
+  shape[scatter_dimension] = block_size
+  return ShapedArray(tuple(shape), x.dtype)
+
+def _psum_scatter_translation_rule(c, x, *, scatter_dimension, axis_name,
+                                   axis_index_groups, axis_size, axis_env,
+                                   platform):
+  replica_groups = _replica_groups(axis_env, axis_name, axis_index_groups)
+  dtype = c.get_shape(x).numpy_dtype()
+  if (platform in ("gpu", "tpu") and hasattr(xops, "ReduceScatter") and
+      not dtypes.issubdtype(dtype, np.complexfloating)):
+    scalar = ShapedArray((), dtype)
+    computation = xla.primitive_subcomputation(lax.add_p, scalar, scalar)
+    return xops.ReduceScatter(
+        x, computation, scatter_dimension=scatter_dimension,
+        shard_count=axis_size,
+        replica_groups=xc.make_replica_groups(replica_groups))
+  dims = list(c.get_shape(x).dimensions())
+  if platform == "tpu":
+    # Older jaxlibs don't expose ReduceScatter: exchange the blocks with an
+    # all-to-all, which moves as much data, and sum the received ones.
+    exchanged = xops.AllToAll(x, scatter_dimension, scatter_dimension,
+                              axis_size, xc.make_replica_groups(replica_groups))
+    block_dims = list(dims)
+    block_dims[scatter_dimension:scatter_dimension + 1] = [
+        axis_size, dims[scatter_dimension] // axis_size]
+    scalar = ShapedArray((), dtype)
+    computation = xla.primitive_subcomputation(lax.add_p, scalar, scalar)
+    return xops.Reduce(c, [xops.Reshape(exchanged, block_dims)],
+                       [xb.constant(c, np.array(0, dtype))], computation,
+                       [scatter_dimension])
+  # CPU implements neither ReduceScatter nor AllToAll, and neither do the GPU
+  # backends of older jaxlibs: all-reduce, then keep this replica's block.
+  dims[scatter_dimension] //= axis_size
+  position = _replica_group_position(c, replica_groups, axis_env.nreps)
+  starts = _block_starts(c, scatter_dimension, dims[scatter_dimension],
+                         len(dims), position)
+  return xops.DynamicSlice(_xla_psum(c, x, replica_groups), starts, dims)
+
+def _psum_scatter_transpose_rule(ct, *, scatter_dimension, axis_name,
+                                 axis_index_groups, axis_size):
+  return [all_gather_p.bind(ct, all_gather_dimension=scatter_dimension,
+                            axis_name=axis_name,
+                            axis_index_groups=axis_index_groups,
+                            axis_size=axis_size)]
+
+def _psum_scatter_batching_rule(vals, dims, *, scatter_dimension, **params):
+  x, = vals
+  bdim, = dims
+  x = _moveaxis(bdim, 0, x)
+  return psum_scatter_p.bind(x, scatter_dimension=scatter_dimension + 1,
+                             **params), 0
+
+def _psum_scatter_soft_pmap_rule(vals, mapped, chunk_size, valid, *,
+                                 scatter_dimension, axis_name,
+                                 axis_index_groups, axis_size):
+  if axis_index_groups is not None:
+    raise NotImplementedError("soft_pmap does not yet support axis_index_groups")
+  x, = vals
+  m, = mapped
+  # Sum the chunk first, leaving out the padding of a ragged axis.
+  if not m:
+    x = batching.broadcast(x, chunk_size, 0)
+  if valid is not None:
+    mask = lax.broadcast_in_dim(valid, x.shape, (0,))
+    x = lax.select(mask, x, lax.full_like(x, 0))
+  x = lax._reduce_sum(x, [0])
+  # Each device receives the blocks of its whole chunk, padded out to cover
+  # the padding of a ragged axis.
+  num_devices = xb.local_device_count()
+  block_size = x.shape[scatter_dimension] // axis_size
+  padding = [(0, 0, 0)] * x.ndim
+  padding[scatter_dimension] = (
+      0, (num_devices * chunk_size - axis_size) * block_size, 0)
+  x = lax.pad(x, lax._const(x, 0), padding)
+  out = psum_scatter_p.bind(x, scatter_dimension=scatter_dimension,
+                            axis_name=axis_name, axis_index_groups=None,
+                            axis_size=num_devices)
+  shape = list(out.shape)
+  shape[scatter_dimension:scatter_dimension + 1] = [chunk_size, block_size]
+  out = lax.reshape(out, shape)
+  return _moveaxis(scatter_dimension, 0, out), True
+
+psum_scatter_p = core.Primitive('psum_scatter')
+psum_scatter_p.def_abstract_eval(_psum_scatter_abstract_eval)
+xla.parallel_translations[psum_scatter_p] = _psum_scatter_translation_rule
+ad.deflinear(psum_scatter_p, _psum_scatter_transpose_rule)
+batching.primitive_batchers[psum_scatter_p] = _psum_scatter_batching_rule
+pxla.soft_pmap_rules[psum_scatter_p] = _psum_scatter_soft_pmap_rule
+pxla.multi_host_supported_collectives.add(psum_scatter_p)
+
+
+def _all_gather_abstract_eval(x, *, all_gather_dimension, axis_name,
+                              axis_index_groups, axis_size):
+  shape = list(x.shape)
+  shape[all_gather_dimension] *= axis_size
+  return ShapedArray(tuple(shape), x.dtype)
+
+def _all_gather_translation_rule(c, x, *, all_gather_dimension, axis_name,
+                                 axis_index_groups, axis_size, axis_env,
+                                 platform):
+  replica_groups = _replica_groups(axis_env, axis_name, axis_index_groups)
+  if platform in ("gpu", "tpu") and hasattr(xops, "AllGather"):
+    return xops.AllGather(
+        x, all_gather_dimension=all_gather_dimension, shard_count=axis_size,
+        replica_groups=xc.make_replica_groups(replica_groups))
+  shape = c.get_shape(x)
+  dims = list(shape.dimensions())
+  out_dims = list(dims)
+  out_dims[all_gather_dimension] *= axis_size
+  if platform == "tpu":
+    # Older jaxlibs don't expose AllGather: send a copy of the block to every
+    # replica with an all-to-all, then merge the received copies into
+    # all_gather_dimension.
+    stacked = xops.Broadcast(x, [axis_size])
+    gathered = xops.AllToAll(stacked, 0, 0, axis_size,
+                             xc.make_replica_groups(replica_groups))
+    perm = list(range(1, len(dims) + 1))
+    perm.insert(all_gather_dimension, 0)
+    return xops.Reshape(xops.Transpose(gathered, perm), out_dims)
+  # CPU implements neither AllGather nor AllToAll, and neither do the GPU
+  # backends of older jaxlibs: write this replica's block into zeros and
+  # all-reduce.
+  zeros = xops.Broadcast(xb.constant(c, np.array(0, shape.numpy_dtype())),
+                         out_dims)
+  position = _replica_group_position(c, replica_groups, axis_env.nreps)
+  starts = _block_starts(c, all_gather_dimension, dims[all_gather_dimension],
+                         len(dims), position)
+  padded = xops.DynamicUpdateSlice(zeros, x, starts)
+  return _xla_psum(c, padded, replica_groups)
+
+def _all_gather_transpose_rule(ct, *, all_gather_dimension, axis_name,
+                               axis_index_groups, axis_size):
+  return [psum_scatter_p.bind(ct, scatter_dimension=all_gather_dimension,
+                              axis_name=axis_name,
+                              axis_index_groups=axis_index_groups,
+                              axis_size=axis_size)]
+
+def _all_gather_batching_rule(vals, dims, *, all_gather_dimension, **params):
+  x, = vals
+  bdim, = dims
+  x = _moveaxis(bdim, 0, x)
+  return all_gather_p.bind(x, all_gather_dimension=all_gather_dimension + 1,
+                           **params), 0
+
+def _all_gather_soft_pmap_rule(vals, mapped, chunk_size, valid, *,
+                               all_gather_dimension, axis_name,
+                               axis_index_groups, axis_size):
+  if axis_index_groups is not None:
+    raise NotImplementedError("soft_pmap does not yet support axis_index_groups")
+  x, = vals
+  m, = mapped
+  if not m:
+    x = batching.broadcast(x, chunk_size, 0)
+  # Concatenate the chunk along all_gather_dimension, gather across devices,
+  # then drop the blocks of the padding of a ragged axis.
+  block_size = x.shape[all_gather_dimension + 1]
+  x = _moveaxis(0, all_gather_dimension, x)
+  shape = list(x.shape)
+  shape[all_gather_dimension:all_gather_dimension + 2] = [chunk_size * block_size]
+  x = lax.reshape(x, shape)
+  out = all_gather_p.bind(x, all_gather_dimension=all_gather_dimension,
+                          axis_name=axis_name, axis_index_groups=None,
+                          axis_size=xb.local_device_count())
+  out = lax.slice_in_dim(out, 0, axis_size * block_size,
+                         axis=all_gather_dimension)
+  return out, False
+
+all_gather_p = core.Primitive('all_gather')
+all_gather_p.def_abstract_eval(_all_gather_abstract_eval)
+xla.parallel_translations[all_gather_p] = _all_gather_translation_rule
+ad.deflinear(all_gather_p, _all_gather_transpose_rule)
+batching.primitive_batchers[all_gather_p] = _all_gather_batching_rule
+pxla.soft_pmap_rules[all_gather_p] = _all_gather_soft_pmap_rule
+pxla.multi_host_supported_collectives.add(all_gather_p)
+
+
 ### papply rules
 # TODO(skye): it would be nice if we could put these with their corresponding
 # primitives, but that currently causes circular dependencies. More refactoring
@@ -481,28 +870,37 @@ pxla.multi_host_supported_collectives.add(all_to_all_p)
 def _drop(x, dim, axis_name):
   return lax.dynamic_index_in_dim(x, axis_index(axis_name), dim, False)
 
-def _expand(dim, size, axis_name, x):
-  shape = list(x.shape)
-  shape.insert(dim, size)
-  out = lax.full(shape, lax._const(x, 0))
-  return lax.dynamic_update_index_in_dim(out, x, axis_index(axis_name), dim)
-
-def _allgather(x, dim, size, axis_name):
-  outs = tree_util.tree_map(partial(_expand, dim, size, axis_name), x)
-  return psum(outs, axis_name)
-
-def all_gather(x, axis_name):
+def _allgather(x, dim, size, axis_name, axis_index_groups=None):
+  def gather(leaf):
+    shape = list(np.shape(leaf))
+    shape.insert(dim, 1)
+    return all_gather_p.bind(lax.reshape(leaf, shape), all_gather_dimension=dim,
+                             axis_name=axis_name,
+                             axis_index_groups=axis_index_groups,
+                             axis_size=size)
+  return tree_util.tree_map(gather, x)
+
+def all_gather(x, axis_name, *, axis_index_groups=None):
   """Gather values of x across all replicas.
 
   If ``x`` is a pytree then the result is equivalent to mapping this function to
   each leaf in the tree.
 
-  This is equivalent to, but faster than, all_to_all(broadcast(x)).
+  This is equivalent to, but faster than, all_to_all(broadcast(x)). It is the
+  transpose of :func:`psum_scatter`.
+
+  On GPU and TPU this lowers to XLA's AllGather when the installed jaxlib
+  exposes it, and otherwise to an AllToAll on TPU. On CPU, and on GPU with
+  older jaxlibs, it is computed as an all-reduce of zero-padded blocks.
 
   Args:
     x: array(s) with a mapped axis named ``axis_name``.
     axis_name: hashable Python object used to name a pmapped axis (see the
       :func:`jax.pmap` documentation for more details).
+    axis_index_groups: optional list of lists containing axis indices (e.g. for
+      an axis of size 4, [[0, 1], [2, 3]] would gather over the first two and
+      last two replicas). Groups must cover all axis indices exactly once, and
+      all groups must be the same size.
 
   Returns:
     Array(s) representing the result of an all-gather along the axis
@@ -519,7 +917,9 @@ def all_gather(x, axis_name):
    [0 1 2 3]
    [0 1 2 3]]
   """
-  return _allgather(x, 0, psum(1, axis_name), axis_name)
+  _validate_axis_index_groups(axis_index_groups)
+  return _allgather(x, 0, _group_size(axis_name, axis_index_groups), axis_name,
+                    axis_index_groups)
 
 def _broadcasting_papply(prim, name, size, vals, axes, **params):
   x, y = vals
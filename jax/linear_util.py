@@ -62,11 +62,33 @@ dynamic positional arguments for the generators, and also the auxiliary output
 data must be immutable, because it will be stored in function memoization tables.
 """
 
-from typing import Any, Tuple, Callable
+from collections import OrderedDict
+import os
+import threading
+from typing import Any, Tuple, Callable, Dict, NamedTuple, Optional
 import weakref
 
+from .config import flags
 from .util import curry
 
+FLAGS = flags.FLAGS
+flags.DEFINE_integer(
+    'jax_compilation_cache_max_entries_per_function',
+    int(os.getenv('JAX_COMPILATION_CACHE_MAX_ENTRIES_PER_FUNCTION', '0')),
+    'Maximum number of compiled variants (e.g. shape specializations) kept in '
+    'memory for each function passed to jit, pmap or sharded_jit. Least '
+    'recently used variants are evicted first. 0 means unbounded.')
+flags.DEFINE_integer(
+    'jax_compilation_cache_max_entries',
+    int(os.getenv('JAX_COMPILATION_CACHE_MAX_ENTRIES', '0')),
+    'Maximum total number of compiled functions kept in memory across all '
+    'functions. 0 means unbounded.')
+flags.DEFINE_integer(
+    'jax_compilation_cache_max_bytes',
+    int(os.getenv('JAX_COMPILATION_CACHE_MAX_BYTES', '0')),
+    'Maximum estimated size in bytes of the compiled executables kept in '
+    'memory across all functions. 0 means unbounded.')
+
 class StoreException(Exception): pass
 
 
@@ -200,34 +222,234 @@ def wrap_init(f, params={}) -> WrappedFun:
   return WrappedFun(f, (), (), tuple(sorted(params.items())))
 
 
-def cache(call: Callable):
+class CacheInfo(NamedTuple):
+  """Statistics for a function memoized with :func:`cache`.
+
+  Attributes:
+    hits: number of calls served from the cache.
+    misses: number of calls that had to compute (e.g. compile) a new entry.
+    evictions: number of entries dropped to stay within the configured bounds.
+    currsize: number of entries currently cached.
+    nbytes: estimated size in bytes of the cached entries.
+  """
+  hits: int
+  misses: int
+  evictions: int
+  currsize: int
+  nbytes: int
+
+
+class _CacheEntry(object):
+  """A memoized value, along with its bookkeeping for LRU eviction."""
+  __slots__ = ("ans", "stores", "nbytes", "state", "table", "key",
+               "__weakref__")
+
+  def __init__(self, ans, stores, nbytes, state, table, key):
+    self.ans = ans
+    self.stores = stores
+    self.nbytes = nbytes
+    self.state = state
+    self.table = weakref.ref(table)
+    self.key = key
+
+  def touch(self):
+    """Records a cache hit on this entry, e.g. from a caller's own fast path."""
+    with _cache_lock:
+      self.state.hits += 1
+      if self in _lru:
+        _lru.move_to_end(self)
+        table = self.table()
+        if table is not None and self.key in table:
+          table.move_to_end(self.key)
+
+
+class _PendingEntry(object):
+  """An entry being computed by the thread `owner`."""
+  __slots__ = ("owner", "done")
+
+  def __init__(self):
+    self.owner = threading.get_ident()
+    self.done = threading.Event()
+
+
+class _CacheState(object):
+  """The memoization tables and counters of one `cache`-decorated function."""
+  __slots__ = ("name", "fun_caches", "pending", "hits", "misses", "evictions",
+               "__weakref__")
+
+  def __init__(self, name):
+    self.name = name
+    # Maps each underlying Python callable `fun.f` to an OrderedDict of its
+    # cache entries, ordered from least to most recently used.
+    self.fun_caches: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+    # Entries currently being computed, keyed by (fun.f, key), so that threads
+    # missing on an entry another thread is computing wait for it instead of
+    # computing it again.
+    self.pending: Dict[Tuple[Callable, Any], _PendingEntry] = {}
+    self.hits = self.misses = self.evictions = 0
+
+  def tables(self):
+    # Copy, as the WeakKeyDictionary may shrink under us during GC.
+    return list(self.fun_caches.values())
+
+  def info(self) -> CacheInfo:
+    with _cache_lock:
+      tables = self.tables()
+      return CacheInfo(self.hits, self.misses, self.evictions,
+                       sum(map(len, tables)),
+                       sum(e.nbytes for t in tables for e in t.values()))
+
+  def clear(self):
+    with _cache_lock:
+      for table in self.tables():
+        _forget_table(table)
+        table.clear()
+      self.fun_caches.clear()
+      self.hits = self.misses = self.evictions = 0
+
+
+# All live `cache`-decorated functions, reported by `cache_info`. Held weakly,
+# so that caches created on the fly disappear along with their function.
+_cache_states: 'weakref.WeakSet[_CacheState]' = weakref.WeakSet()
+# Every entry of every cache, from least to most recently used, and their total
+# size, used to enforce the global bounds without scanning all tables.
+_lru: 'OrderedDict[_CacheEntry, None]' = OrderedDict()
+_lru_nbytes = 0
+# Guards the tables and counters of all caches, which may be used from several
+# threads, e.g. by background compilation. It is not held while computing a
+# new entry, so that entries for different keys can be computed concurrently.
+_cache_lock = threading.RLock()
+
+
+def _forget(entry: _CacheEntry):
+  """Removes `entry` from the global LRU. Requires `_cache_lock`."""
+  global _lru_nbytes
+  if entry in _lru:
+    del _lru[entry]
+    _lru_nbytes -= entry.nbytes
+
+def _forget_table(table: OrderedDict):
+  with _cache_lock:
+    for entry in table.values():
+      _forget(entry)
+
+
+def cache(call: Callable, sizeof: Optional[Callable[[Any], int]] = None):
   """Memoization decorator for functions taking a WrappedFun as first argument.
 
+  Entries are evicted in least-recently-used order once the bounds set by the
+  ``jax_compilation_cache_max_entries_per_function``,
+  ``jax_compilation_cache_max_entries`` and ``jax_compilation_cache_max_bytes``
+  flags are exceeded. The global bounds apply jointly to all functions
+  memoized with this decorator.
+
   Args:
     call: a Python callable that takes a WrappedFun as its first argument. The
       underlying transforms and params on the WrappedFun are used as part of the
       memoization cache key.
+    sizeof: optional function estimating the size in bytes of a value returned
+      by ``call``, used for the ``jax_compilation_cache_max_bytes`` bound.
 
   Returns:
-     A memoized version of ``call``.
+     A memoized version of ``call``, with ``cache_clear`` and ``cache_info``
+     methods like those of ``functools.lru_cache``. Its ``cache_entry`` method
+     takes the same arguments but returns the cache entry holding the result,
+     which callers can keep a weak reference to and ``touch()`` on reuse.
   """
-  fun_caches: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+  state = _CacheState(fun_name(call))
+  _cache_states.add(state)
 
-  def memoized_fun(fun: WrappedFun, *args):
-    cache = fun_caches.setdefault(fun.f, {})
+  def cache_entry(fun: WrappedFun, *args) -> _CacheEntry:
     key = (fun.transforms, fun.params, args)
-    result = cache.get(key, None)
-    if result is not None:
-      ans, stores = result
-      fun.populate_stores(stores)
-    else:
+    pending_key = (fun.f, key)
+    while True:
+      with _cache_lock:
+        cache = state.fun_caches.get(fun.f)
+        if cache is None:
+          cache = state.fun_caches.setdefault(fun.f, OrderedDict())
+          # Drop the entries from the global LRU once `fun.f` is collected.
+          weakref.finalize(fun.f, _forget_table, cache)
+        entry = cache.get(key, None)
+        if entry is not None:
+          entry.touch()
+          break
+        pending = state.pending.get(pending_key)
+        if pending is None or pending.owner == threading.get_ident():
+          state.misses += 1
+          state.pending[pending_key] = pending = _PendingEntry()
+          break
+      # Another thread is computing this entry. Once it is done, look again:
+      # if it failed, we compute the entry (and raise its error) ourselves.
+      pending.done.wait()
+
+    if entry is not None:
+      fun.populate_stores(entry.stores)
+      return entry
+    try:
       ans = call(fun, *args)
-      cache[key] = (ans, fun.stores)
-    return ans
+      nbytes = sizeof(ans) if sizeof else 0
+      entry = _CacheEntry(ans, fun.stores, nbytes, state, cache, key)
+      with _cache_lock:
+        _insert(state, cache, entry)
+    finally:
+      with _cache_lock:
+        if state.pending.get(pending_key) is pending:
+          del state.pending[pending_key]
+      pending.done.set()
+    return entry
 
-  memoized_fun.cache_clear = fun_caches.clear  # type: ignore
+  def memoized_fun(fun: WrappedFun, *args):
+    return cache_entry(fun, *args).ans
+
+  memoized_fun.cache_entry = cache_entry  # type: ignore
+  memoized_fun.cache_clear = state.clear  # type: ignore
+  memoized_fun.cache_info = state.info  # type: ignore
   return memoized_fun
 
+def _insert(state: _CacheState, cache: OrderedDict, new_entry: _CacheEntry):
+  """Adds `new_entry` to `cache` and evicts entries beyond the bounds."""
+  global _lru_nbytes
+  old_entry = cache.pop(new_entry.key, None)
+  if old_entry is not None:
+    _forget(old_entry)
+  cache[new_entry.key] = new_entry
+  _lru[new_entry] = None
+  _lru_nbytes += new_entry.nbytes
+
+  max_per_fun = FLAGS.jax_compilation_cache_max_entries_per_function
+  if max_per_fun:
+    while len(cache) > max_per_fun:
+      _, victim = cache.popitem(last=False)
+      _forget(victim)
+      state.evictions += 1
+
+  max_entries = FLAGS.jax_compilation_cache_max_entries
+  max_bytes = FLAGS.jax_compilation_cache_max_bytes
+  while ((max_entries and len(_lru) > max_entries) or
+         (max_bytes and _lru_nbytes > max_bytes)):
+    victim = next(iter(_lru))
+    if victim is new_entry:
+      break  # never evict the entry we are about to return
+    _forget(victim)
+    table = victim.table()
+    if table is not None and table.get(victim.key) is victim:
+      del table[victim.key]
+    victim.state.evictions += 1
+
+def cache_info() -> Dict[str, CacheInfo]:
+  """Returns the :class:`CacheInfo` of every `cache`-decorated function.
+
+  Functions sharing a name are reported as one entry, whose counts are the sums
+  of theirs.
+  """
+  info: Dict[str, CacheInfo] = {}
+  for state in list(_cache_states):
+    state_info = state.info()
+    prev = info.get(state.name)
+    info[state.name] = (state_info if prev is None else
+                        CacheInfo(*map(sum, zip(prev, state_info))))
+  return info
+
 @transformation
 def hashable_partial(x, *args):
   ans = yield (x,) + args, {}
@@ -40,7 +40,8 @@ for the design and its motivation.
 
 
 from functools import partial
-from typing import Optional, Sequence, Union
+import os
+from typing import Callable, Dict, NamedTuple, Optional, Sequence, Union
 import warnings
 
 import numpy as np
@@ -55,6 +56,7 @@ from jax.lib import xla_client
 from jax.lib import cuda_prng
 from jax import core
 from jax import abstract_arrays
+from jax.config import flags
 from jax.numpy.linalg import cholesky
 from jax.interpreters import ad
 from jax.interpreters import batching
@@ -62,8 +64,27 @@ from jax.interpreters import xla
 from jax.util import prod
 
 
+FLAGS = flags.FLAGS
+flags.DEFINE_string(
+    'jax_prng_impl',
+    os.getenv('JAX_PRNG_IMPL', 'threefry2x32'),
+    'The counter-based PRNG that jax.random uses: "threefry2x32" or '
+    '"philox4x32". Keys made by one implementation should not be used with '
+    'another.')
+flags.DEFINE_integer(
+    'jax_random_bits_chunk_size',
+    int(os.getenv('JAX_RANDOM_BITS_CHUNK_SIZE', '0')),
+    'If positive, random bits are generated in chunks of this many values, '
+    'each from its own key split from the sampler\'s key, which bounds the '
+    'memory needed for temporaries. Changes the values sampled from a key. '
+    'Requests too large for a single call to the hash are always chunked.')
+
 _UINT_DTYPES = {8: jnp.uint8, 16: jnp.uint16, 32: jnp.uint32, 64: jnp.uint64}
 
+# The number of values per chunk for requests too large for one call to the
+# hash, whose counter is 32 bits.
+_DEFAULT_CHUNK_SIZE = 2 ** 26
+
 
 def PRNGKey(seed: int) -> jnp.ndarray:
   """Create a pseudo-random number generator (PRNG) key given an integer seed.
@@ -75,7 +96,12 @@ def PRNGKey(seed: int) -> jnp.ndarray:
     A PRNG key, which is modeled as an array of shape (2,) and dtype uint32. The
     key is constructed from a 64-bit seed by effectively bit-casting to a pair
     of uint32 values (or from a 32-bit seed by first padding out with zeros).
+    The key is made by the PRNG implementation chosen by the
+    ``jax_prng_impl`` flag, which the other functions in this module use too.
   """
+  return _prng_impl().seed(seed)
+
+def _seed_key(seed) -> jnp.ndarray:
   if np.shape(seed):
     raise TypeError("PRNGKey seed must be a scalar.")
   convert = lambda k: lax.reshape(lax.convert_element_type(k, np.uint32), [1])
@@ -253,6 +279,204 @@ def threefry_2x32(keypair, count):
   return lax.reshape(out[:-1] if odd_size else out, count.shape)
 
 
+### Philox
+
+
+# Multipliers and key increments of Philox 4x32, from Salmon et al. (2011).
+_PHILOX_M = (0xD2511F53, 0xCD9E8D57)
+_PHILOX_W = (np.uint32(0x9E3779B9), np.uint32(0xBB67AE85))
+
+def _mulhilo32(a, x):
+  """The high and low words of the 64-bit product of uint32 constant a and x.
+
+  The high word is assembled from 16-bit limbs, so only 32-bit arithmetic is
+  used and no 64-bit types are needed when jax_enable_x64 is off.
+  """
+  a_hi, a_lo = np.uint32(a >> 16), np.uint32(a & 0xFFFF)
+  mask = np.uint32(0xFFFF)
+  shift = np.uint32(16)
+  x_hi, x_lo = x >> shift, x & mask
+  lo_lo, lo_hi, hi_lo = x_lo * a_lo, x_hi * a_lo, x_lo * a_hi
+  carry = (lo_lo >> shift) + (lo_hi & mask) + (hi_lo & mask)
+  hi = x_hi * a_hi + (lo_hi >> shift) + (hi_lo >> shift) + (carry >> shift)
+  return hi, x * np.uint32(a)
+
+def _philox4x32_lowering(key1, key2, x1, x2, x3, x4):
+  """Apply the Philox 4x32-10 bijection to counters (x1, x2, x3, x4)."""
+  x = [x1, x2, x3, x4]
+  ks = [key1, key2]
+  for i in range(10):
+    if i:
+      ks = [ks[0] + _PHILOX_W[0], ks[1] + _PHILOX_W[1]]
+    hi0, lo0 = _mulhilo32(_PHILOX_M[0], x[0])
+    hi1, lo1 = _mulhilo32(_PHILOX_M[1], x[2])
+    x = [hi1 ^ x[1] ^ ks[0], lo1, hi0 ^ x[3] ^ ks[1], lo0]
+  return tuple(x)
+
+def _philox4x32_abstract_eval(*args):
+  if any(a.dtype != jnp.uint32 for a in args):
+    raise TypeError("Arguments to philox4x32 must have uint32 type, got {}"
+                    .format(args))
+  if all(isinstance(arg, abstract_arrays.ShapedArray) for arg in args):
+    shape = lax._broadcasting_shape_rule("philox4x32", *args)
+    aval = abstract_arrays.ShapedArray(shape, jnp.dtype(jnp.uint32))
+  else:
+    aval = abstract_arrays.UnshapedArray(jnp.dtype(jnp.uint32))
+  return (aval,) * 4
+
+philox4x32_p = core.Primitive("philox4x32")
+philox4x32_p.multiple_results = True
+philox4x32_p.def_impl(partial(xla.apply_primitive, philox4x32_p))
+philox4x32_p.def_abstract_eval(_philox4x32_abstract_eval)
+batching.defbroadcasting(philox4x32_p)
+xla.translations[philox4x32_p] = xla.lower_fun(_philox4x32_lowering,
+                                               multiple_results=True)
+
+
+def _bind_broadcast(prim, *args):
+  shape = lax.broadcast_shapes(*(np.shape(x) for x in args))
+  return prim.bind(*(jnp.broadcast_to(x, shape) for x in args))
+
+@jit
+def philox_4x32(keypair, count):
+  """Apply the Philox 4x32-10 bijection.
+
+  Args:
+    keypair: a pair of 32bit unsigned integers used for the key.
+    count: an array of dtype uint32 whose trailing axis of size 4 holds the
+      words of each 128-bit counter.
+
+  Returns:
+    An array of dtype uint32 with the same shape as `count`.
+  """
+  key1, key2 = keypair
+  if not lax.dtype(key1) == lax.dtype(key2) == lax.dtype(count) == np.uint32:
+    msg = "philox_4x32 requires uint32 arguments, got {}"
+    raise TypeError(msg.format([lax.dtype(x) for x in [key1, key2, count]]))
+  if count.shape[-1:] != (4,):
+    raise ValueError("philox_4x32 requires counts with a trailing axis of "
+                     "size 4, got shape {}.".format(count.shape))
+  out = _bind_broadcast(philox4x32_p, key1, key2,
+                        *(count[..., i] for i in range(4)))
+  return jnp.stack(out, -1)
+
+
+### PRNG implementations
+
+
+class PRNGImpl(NamedTuple):
+  """A counter-based PRNG algorithm that `jax.random` can dispatch to.
+
+  Keys of every implementation are arrays of shape (2,) and dtype uint32, but
+  keys and streams of different implementations are unrelated, so keys made by
+  one shouldn't be used with another.
+
+  Attributes:
+    name: the value of the ``jax_prng_impl`` flag that selects it.
+    seed: maps an integer seed to a key.
+    split: maps keys of shape (..., 2) and a static number ``num`` to new keys
+      of shape (..., num, 2).
+    fold_in: maps keys of shape (..., 2) and integer data broadcasting with
+      their leading axes to new keys.
+    random_words: maps a key and a static ``count`` to an array of ``count``
+      uniformly random uint32 words.
+  """
+  name: str
+  seed: Callable[[int], jnp.ndarray]
+  split: Callable[[jnp.ndarray, int], jnp.ndarray]
+  fold_in: Callable[[jnp.ndarray, jnp.ndarray], jnp.ndarray]
+  random_words: Callable[[jnp.ndarray, int], jnp.ndarray]
+
+
+_PRNG_IMPLS: Dict[str, PRNGImpl] = {}
+
+def register_prng_impl(impl: PRNGImpl):
+  """Makes a :class:`PRNGImpl` selectable with the ``jax_prng_impl`` flag."""
+  _PRNG_IMPLS[impl.name] = impl
+
+# The jitted helpers of split, fold_in and the samplers take the name of the
+# implementation as a static argument, so that changing jax_prng_impl retraces
+# them instead of replaying traces of the previous implementation. Samplers that
+# call other samplers while being traced don't pass it on: the flag still has
+# the value they were called with.
+def _prng_impl(name: Optional[str] = None) -> PRNGImpl:
+  name = name or FLAGS.jax_prng_impl
+  try:
+    return _PRNG_IMPLS[name]
+  except KeyError:
+    raise ValueError(f"Unknown PRNG implementation {name!r}, expected one of "
+                     f"{sorted(_PRNG_IMPLS)}.") from None
+
+
+def _data_words(data):
+  # Like PRNGKey, split the data into a pair of 32-bit words.
+  data = jnp.asarray(data)
+  if jnp.iinfo(data.dtype).bits == 64:
+    hi = lax.convert_element_type(
+        lax.shift_right_logical(data, lax._const(data, 32)), np.uint32)
+  else:
+    hi = jnp.zeros(data.shape, np.uint32)
+  return hi, lax.convert_element_type(data, np.uint32)
+
+
+def _threefry_split(keys, num):
+  # Lays out the words like threefry_2x32 of the counts iota(2 * num): the
+  # first words of the hash of the counts (i, num + i) for all i, then all of
+  # their second words.
+  counts = lax.iota(np.uint32, num)
+  bits = _bind_broadcast(threefry2x32_p, keys[..., 0:1], keys[..., 1:2],
+                         counts, counts + np.uint32(num))
+  return lax.reshape(jnp.concatenate(bits, -1), keys.shape[:-1] + (num, 2))
+
+def _threefry_fold_in(keys, data):
+  bits = _bind_broadcast(threefry2x32_p, keys[..., 0], keys[..., 1],
+                         *_data_words(data))
+  return jnp.stack(bits, -1)
+
+def _threefry_random_words(key, count):
+  return threefry_2x32(key, lax.iota(np.uint32, count))
+
+
+# Philox derives keys and random words from counters (i, tag, 0, 0), where the
+# tag keeps the counters of split, fold_in and random_words apart.
+_PHILOX_WORDS, _PHILOX_SPLIT, _PHILOX_FOLD_IN = map(np.uint32, range(3))
+
+def _philox_split(keys, num):
+  # Each counter gives four words, i.e. two new keys.
+  n = -(-num // 2)
+  counts = lax.iota(np.uint32, n)
+  zero = np.uint32(0)
+  words = _bind_broadcast(philox4x32_p, keys[..., 0:1], keys[..., 1:2], counts,
+                          _PHILOX_SPLIT, zero, zero)
+  new_keys = lax.reshape(jnp.stack(words, -1), keys.shape[:-1] + (2 * n, 2))
+  return new_keys[..., :num, :]
+
+def _philox_fold_in(keys, data):
+  hi, lo = _data_words(data)
+  zero = np.uint32(0)
+  words = _bind_broadcast(philox4x32_p, keys[..., 0], keys[..., 1], lo, hi,
+                          _PHILOX_FOLD_IN, zero)
+  return jnp.stack(words[:2], -1)
+
+@partial(jit, static_argnums=(1,))
+def _philox_random_words(key, count):
+  n = -(-count // 4)
+  counts = lax.iota(np.uint32, n)
+  zero = np.uint32(0)
+  words = _bind_broadcast(philox4x32_p, key[0], key[1], counts, _PHILOX_WORDS,
+                          zero, zero)
+  return lax.slice(lax.reshape(jnp.stack(words, -1), (4 * n,)), (0,), (count,))
+
+
+register_prng_impl(PRNGImpl("threefry2x32", _seed_key, _threefry_split,
+                            _threefry_fold_in, _threefry_random_words))
+register_prng_impl(PRNGImpl("philox4x32", _seed_key, _philox_split,
+                            _philox_fold_in, _philox_random_words))
+
+
+### split and fold_in
+
+
 def split(key: jnp.ndarray, num: int = 2) -> jnp.ndarray:
   """Splits a PRNG key into `num` new keys by adding a leading axis.
 
@@ -264,12 +488,11 @@ def split(key: jnp.ndarray, num: int = 2) -> jnp.ndarray:
   Returns:
     An array with shape (num, 2) and dtype uint32 representing `num` new keys.
   """
-  return _split(key, int(num))  # type: ignore
+  return _split(key, int(num), FLAGS.jax_prng_impl)  # type: ignore
 
-@partial(jit, static_argnums=(1,))
-def _split(key, num) -> jnp.ndarray:
-  counts = lax.iota(np.uint32, num * 2)
-  return lax.reshape(threefry_2x32(key, counts), (num, 2))
+@partial(jit, static_argnums=(1, 2))
+def _split(key, num, impl) -> jnp.ndarray:
+  return _prng_impl(impl).split(key, num)
 
 
 def fold_in(key, data):
@@ -283,27 +506,88 @@ def fold_in(key, data):
     A new PRNGKey that is a deterministic function of the inputs and is
     statistically safe for producing a stream of new pseudo-random values.
   """
-  return _fold_in(key, data)
+  return _fold_in(key, data, FLAGS.jax_prng_impl)
 
-@jit
-def _fold_in(key, data):
-  return threefry_2x32(key, PRNGKey(data))
+@partial(jit, static_argnums=(2,))
+def _fold_in(key, data, impl):
+  return _prng_impl(impl).fold_in(key, data)
+
+
+def _check_prng_key_array(name, keys):
+  keys = jnp.asarray(keys)
+  if keys.shape[-1:] != (2,) or keys.dtype != np.uint32:
+    raise TypeError(f"{name} requires an array of PRNG keys with shape (..., 2) "
+                    f"and dtype uint32, got {keys.shape} and {keys.dtype}.")
+  return keys
+
+
+def split_many(keys: jnp.ndarray, num: int = 2) -> jnp.ndarray:
+  """Splits each of an array of PRNG keys into `num` new keys.
+
+  The result is the same as mapping :func:`split` over the leading axes of
+  `keys` with :func:`jax.vmap`, but all the new keys are derived by a single
+  call to the hash, without going through the batching interpreter.
+
+  Args:
+    keys: an array with shape (..., 2) and dtype uint32 of PRNG keys.
+    num: optional, a positive integer indicating the number of keys to produce
+      from each key (default 2).
+
+  Returns:
+    An array with shape (..., num, 2) and dtype uint32, where
+    ``split_many(keys, num)[i]`` equals ``split(keys[i], num)``.
+  """
+  keys = _check_prng_key_array("split_many", keys)
+  return _split(keys, int(num), FLAGS.jax_prng_impl)  # type: ignore
+
+
+def fold_in_many(keys: jnp.ndarray, data: jnp.ndarray) -> jnp.ndarray:
+  """Folds an array of data into an array of PRNG keys.
 
+  The result is the same as mapping :func:`fold_in` over the leading axes of
+  `keys` and `data` with :func:`jax.vmap`, but all the new keys are derived by
+  a single call to the hash, without going through the batching interpreter.
 
-def _random_bits(key, bit_width, shape):
-  """Sample uniform random bits of given width and shape using PRNG key."""
+  Args:
+    keys: an array with shape (..., 2) and dtype uint32 of PRNG keys.
+    data: an array of integers whose shape broadcasts with ``keys.shape[:-1]``.
+
+  Returns:
+    An array of new PRNG keys with shape ``broadcast_shapes(keys.shape[:-1],
+    data.shape) + (2,)`` and dtype uint32.
+  """
+  keys = _check_prng_key_array("fold_in_many", keys)
+  if not jnp.issubdtype(lax.dtype(data), np.integer):
+    raise TypeError("fold_in_many requires integer data, got {}."
+                    .format(lax.dtype(data)))
+  return _fold_in(keys, data, FLAGS.jax_prng_impl)
+
+
+def _random_bits(key, bit_width, shape, chunk_size=None, impl=None):
+  """Sample uniform random bits of given width and shape using PRNG key.
+
+  The words are generated by the PRNG implementation named by ``impl``, which
+  defaults to the ``jax_prng_impl`` flag.
+
+  If ``chunk_size`` is given, or defaults to a positive
+  ``jax_random_bits_chunk_size``, or the request is too large for a single call
+  to the hash, the bits are generated in chunks by ``_random_bits_chunked``.
+  """
+  impl = _prng_impl(impl)
   if not _is_prng_key(key):
     raise TypeError("_random_bits got invalid prng key.")
   if bit_width not in (8, 16, 32, 64):
     raise TypeError("requires 8-, 16-, 32- or 64-bit field width.")
-  size = np.prod(shape)
+  size = prod(shape)
   max_count = int(np.ceil(bit_width * size / 32))
-  if max_count >= jnp.iinfo(np.uint32).max:
-    # TODO(mattjj): just split the key here
-    raise TypeError("requesting more random bits than a single call provides.")
-
-  counts = lax.iota(np.uint32, max_count)
-  bits = threefry_2x32(key, counts)
+  if chunk_size is None:
+    chunk_size = FLAGS.jax_random_bits_chunk_size or None
+  if chunk_size is None and max_count >= jnp.iinfo(np.uint32).max:
+    chunk_size = _DEFAULT_CHUNK_SIZE
+  if chunk_size is not None and size > chunk_size:
+    return _random_bits_chunked(key, bit_width, shape, chunk_size, impl.name)
+
+  bits = impl.random_words(key, max_count)
   dtype = _UINT_DTYPES[bit_width]
   if bit_width == 64:
     bits = [lax.convert_element_type(x, dtype) for x in jnp.split(bits, 2)]
@@ -325,6 +609,28 @@ def _random_bits(key, bit_width, shape):
   return lax.reshape(bits, shape)
 
 
+def _random_bits_chunked(key, bit_width, shape, chunk_size, impl):
+  """Sample random bits in chunks of ``chunk_size`` values.
+
+  Each chunk is generated from its own key, split from ``key``, one after
+  another with ``lax.map``, so the counters and other temporaries of the hash
+  only ever cover a single chunk. This also lifts the limit of ``2 ** 32``
+  32-bit words per call.
+  """
+  if chunk_size <= 0 or int(np.ceil(bit_width * chunk_size / 32)) >= \
+      jnp.iinfo(np.uint32).max:
+    raise ValueError("chunk_size must be positive and provide fewer than "
+                     f"2 ** 32 32-bit words, got {chunk_size}.")
+  size = prod(shape)
+  num_chunks = -(-size // chunk_size)
+  keys = _split(key, num_chunks, impl)
+  chunks = lax.map(lambda k: _random_bits(k, bit_width, (chunk_size,),
+                                          chunk_size, impl), keys)
+  bits = lax.slice(lax.reshape(chunks, (num_chunks * chunk_size,)), (0,),
+                   (size,))
+  return lax.reshape(bits, shape)
+
+
 ### random samplers
 
 
@@ -364,10 +670,11 @@ def uniform(key: jnp.ndarray,
                      f"got {dtype}")
   dtype = dtypes.canonicalize_dtype(dtype)
   shape = abstract_arrays.canonicalize_shape(shape)
-  return _uniform(key, shape, dtype, minval, maxval)  # type: ignore
+  return _uniform(key, shape, dtype, minval, maxval,
+                  FLAGS.jax_prng_impl)  # type: ignore
 
-@partial(jit, static_argnums=(1, 2))
-def _uniform(key, shape, dtype, minval, maxval) -> jnp.ndarray:
+@partial(jit, static_argnums=(1, 2, 5))
+def _uniform(key, shape, dtype, minval, maxval, impl) -> jnp.ndarray:
   _check_shape("uniform", shape)
   if not jnp.issubdtype(dtype, np.floating):
     raise TypeError("uniform only accepts floating point dtypes.")
@@ -380,7 +687,7 @@ def _uniform(key, shape, dtype, minval, maxval) -> jnp.ndarray:
   if nbits not in (16, 32, 64):
     raise TypeError("uniform only accepts 32- or 64-bit dtypes.")
 
-  bits = _random_bits(key, nbits, shape)
+  bits = _random_bits(key, nbits, shape, impl=impl)
 
   # The strategy here is to randomize only the mantissa bits with an exponent of
   # 1 (after applying the bias), then shift and scale to the desired range. The
@@ -417,10 +724,10 @@ def randint(key: jnp.ndarray,
   """
   dtype = dtypes.canonicalize_dtype(dtype)
   shape = abstract_arrays.canonicalize_shape(shape)
-  return _randint(key, shape, minval, maxval, dtype)
+  return _randint(key, shape, minval, maxval, dtype, FLAGS.jax_prng_impl)
 
-@partial(jit, static_argnums=(1, 4))
-def _randint(key, shape, minval, maxval, dtype):
+@partial(jit, static_argnums=(1, 4, 5))
+def _randint(key, shape, minval, maxval, dtype, impl):
   _check_shape("randint", shape, np.shape(minval), np.shape(maxval))
   if not jnp.issubdtype(dtype, np.integer):
     raise TypeError("randint only accepts integer dtypes.")
@@ -439,8 +746,8 @@ def _randint(key, shape, minval, maxval, dtype):
   # This algorithm is biased whenever (maxval - minval) is not a power of 2.
   # We generate double the number of random bits required by the dtype so as to
   # reduce that bias.
-  k1, k2 = split(key)
-  rbits = lambda key: _random_bits(key, nbits, shape)
+  k1, k2 = _split(key, 2, impl)
+  rbits = lambda key: _random_bits(key, nbits, shape, impl=impl)
   higher_bits, lower_bits = rbits(k1), rbits(k2)
 
   unsigned_dtype = _UINT_DTYPES[nbits]
@@ -473,10 +780,10 @@ def shuffle(key: jnp.ndarray, x: jnp.ndarray, axis: int = 0) -> jnp.ndarray:
   msg = ("jax.random.shuffle is deprecated and will be removed in a future release. "
          "Use jax.random.permutation")
   warnings.warn(msg, FutureWarning)
-  return _shuffle(key, x, axis)  # type: ignore
+  return _shuffle(key, x, axis, None, FLAGS.jax_prng_impl)  # type: ignore
 
 
-def permutation(key, x):
+def permutation(key, x, method: str = "sort", rounds: Optional[int] = None):
   """
   Permute elements of an array along its first axis or return a permuted range.
 
@@ -486,25 +793,47 @@ def permutation(key, x):
   Args:n
     key: a PRNGKey used as the random key.
     x: the array or integer range to be shuffled.
+    method: optional, how to draw the permutation. ``"sort"`` (default) sorts
+      by random 32-bit keys, in as many passes as needed to make it unlikely
+      that any two elements are left with the same keys. ``"feistel"`` maps
+      each index through a keyed Feistel network, a pseudorandom bijection,
+      which needs no sorting and is much faster for large arrays. Its
+      permutations are pseudorandom rather than exactly uniform, so arrays
+      with fewer than ``2 ** 12`` elements are sorted instead.
+    rounds: optional, the number of sorting passes or Feistel rounds. Defaults
+      to enough passes for the size of `x` when sorting, and to 8 Feistel
+      rounds.
 
   Returns:
     A shuffled version of x or array range
   """
+  if method not in ("sort", "feistel"):
+    raise ValueError(f"method must be 'sort' or 'feistel', got {method!r}.")
+  if rounds is not None and int(rounds) <= 0:
+    raise ValueError(f"rounds must be positive, got {rounds}.")
+  rounds = None if rounds is None else int(rounds)
+  impl = FLAGS.jax_prng_impl
   if not np.ndim(x):
     # scalar case, must be a concrete integer
     if not np.issubdtype(lax.dtype(x), np.integer):
       raise TypeError("x must be an integer or at least 1-dimensional")
     x = int(x)
-    return _shuffle(key, jnp.arange(x), 0)
+    if method == "feistel" and x >= _FEISTEL_MIN_SIZE:
+      return _feistel_permutation(key, x, rounds or _FEISTEL_ROUNDS, impl)
+    return _shuffle(key, jnp.arange(x), 0, rounds, impl)
+  elif method == "feistel" and np.shape(x)[0] >= _FEISTEL_MIN_SIZE:
+    ind = _feistel_permutation(key, np.shape(x)[0],
+                               rounds or _FEISTEL_ROUNDS, impl)
+    return jnp.asarray(x)[ind]
   elif np.ndim(x) == 1:
-    return _shuffle(key, x, 0)
+    return _shuffle(key, x, 0, rounds, impl)
   else:
-    ind = _shuffle(key, jnp.arange(x.shape[0]), 0)
+    ind = _shuffle(key, jnp.arange(x.shape[0]), 0, rounds, impl)
     return x[ind]
 
 
-@partial(jit, static_argnums=(2,))
-def _shuffle(key, x, axis) -> jnp.ndarray:
+@partial(jit, static_argnums=(2, 3, 4))
+def _shuffle(key, x, axis, num_rounds, impl) -> jnp.ndarray:
   # On parallel architectures, Fisher-Yates is more expensive than doing
   # multiple sorts. This algorithm is based on one developed and analyzed by
   # tjablin@. We sort according to randomly-generated 32bit keys, but those keys
@@ -519,18 +848,49 @@ def _shuffle(key, x, axis) -> jnp.ndarray:
   # info, and for the original implementation of this algorithm. See also
   # Section 2 of http://people.csail.mit.edu/costis/6896sp11/lec5s.pdf for
   # another analysis (where the keys are generated one bit at a time).
-  exponent = 3  # see tjablin@'s analysis for explanation of this parameter
-  uint32max = jnp.iinfo(np.uint32).max
-  num_rounds = int(np.ceil(exponent * np.log(x.size) / np.log(uint32max)))
+  if num_rounds is None:
+    exponent = 3  # see tjablin@'s analysis for explanation of this parameter
+    uint32max = jnp.iinfo(np.uint32).max
+    num_rounds = int(np.ceil(exponent * np.log(x.size) / np.log(uint32max)))
 
   for _ in range(num_rounds):
-    key, subkey = split(key)
-    sort_keys = _random_bits(subkey, 32, x.shape)
+    key, subkey = _split(key, 2, impl)
+    sort_keys = _random_bits(subkey, 32, x.shape, impl=impl)
     _, x = lax.sort_key_val(sort_keys, x, axis)
 
   return x
 
 
+# Feistel networks on only a few bits give measurably nonuniform permutations,
+# and sorting that few elements is cheap.
+_FEISTEL_MIN_SIZE = 2 ** 12
+_FEISTEL_ROUNDS = 8
+
+@partial(jit, static_argnums=(1, 2, 3))
+def _feistel_permutation(key, n, rounds, impl) -> jnp.ndarray:
+  # The network permutes the 2 ** bits integers of bits >= log2(n) bits, split
+  # into left and right halves that differ by at most a bit. Each round maps
+  # (left, right) to (right, left ^ f(right)), where f is the random word of a
+  # round key folded with `right`. Keeping the images that fall below n, in
+  # order, gives a permutation of range(n) from a single pass over fewer than
+  # 2 * n integers, instead of cycle walking each image into range.
+  bits = int(np.ceil(np.log2(n)))
+  left_bits, right_bits = bits - bits // 2, bits // 2
+  x = lax.iota(np.uint32, 2 ** bits)
+  left = x >> np.uint32(right_bits)
+  right = x & np.uint32(2 ** right_bits - 1)
+  for round_key in _split(key, rounds, impl):
+    f = _fold_in(round_key, right, impl)[..., 0]
+    left, right = right, left ^ (f & np.uint32(2 ** left_bits - 1))
+    left_bits, right_bits = right_bits, left_bits
+  y = (left << np.uint32(right_bits)) | right
+
+  in_range = y < n
+  slots = jnp.where(in_range, jnp.cumsum(in_range) - 1, n)
+  dtype = dtypes.canonicalize_dtype(jnp.int_)
+  return jnp.zeros(n + 1, dtype).at[slots].set(y.astype(dtype))[:n]
+
+
 def choice(key, a, shape=(), replace=True, p=None):
   """Generates a random sample from a given 1-D array.
 
@@ -580,12 +940,126 @@ def choice(key, a, shape=(), replace=True, p=None):
       result = ind if a.ndim == 0 else a[ind]
     else:
       # Gumbel top-k trick: https://timvieira.github.io/blog/post/2019/09/16/algorithms-for-sampling-without-replacement/
-      g = -gumbel(key, (n_inputs,)) - jnp.log(p)
-      ind = jnp.argsort(g)[:n_draws]
+      # Only the n_draws largest perturbed logits are needed. With the jaxlibs
+      # this tree supports, XLA lowers top_k to a full sort plus a slice on CPU
+      # and GPU, so there it costs the same as the argsort it replaced.
+      g = gumbel(key, (n_inputs,)) + jnp.log(p)
+      _, ind = lax.top_k(g, n_draws)
       result = ind if a.ndim == 0 else a[ind]
   return result.reshape(shape)
 
 
+class AliasTable(NamedTuple):
+  """Walker's alias table of a categorical distribution over ``n`` items.
+
+  A draw picks a bucket ``i`` uniformly at random, and returns ``i`` with
+  probability ``prob[i]`` and ``alias[i]`` otherwise. Build one with
+  :func:`alias_table` and draw from it with :func:`alias_choice`.
+  """
+  prob: jnp.ndarray
+  alias: jnp.ndarray
+
+
+def alias_table(p) -> AliasTable:
+  """Builds an alias table for drawing from a fixed categorical distribution.
+
+  Building the table takes O(n log n) work, after which :func:`alias_choice`
+  draws each sample in O(1), independently of ``n``. This pays off over
+  :func:`choice` with ``replace=True``, whose draws each search the cumulative
+  sum of ``p``, when many samples are drawn from the same distribution across
+  calls. The table is a pytree, so it can be passed into jitted functions.
+
+  Args:
+    p: 1-D array of nonnegative weights, not all zero, proportional to the
+      probabilities of the ``n`` items.
+
+  Returns:
+    An :class:`AliasTable`.
+  """
+  p = jnp.asarray(p)
+  if p.ndim != 1 or p.shape[0] == 0:
+    raise ValueError(f"p must be a nonempty 1-dimensional array, got shape "
+                     f"{p.shape}.")
+  if not jnp.issubdtype(p.dtype, np.floating):
+    p = p.astype(dtypes.canonicalize_dtype(dtypes.float_))
+  return _alias_table(p)
+
+@jit
+def _alias_table(p) -> AliasTable:
+  # Builds the table of the sequential "sweep" of Vose's method, where each
+  # heavy item (of weight above the mean) fills the buckets of light items in
+  # order, and once its own weight falls below the mean its bucket is in turn
+  # filled by the next heavy item, in parallel from prefix sums (Huebschle-
+  # Schneider and Sanders, "Parallel Weighted Random Sampling", 2019).
+  n = p.shape[0]
+  w = p * (n / jnp.sum(p))
+  heavy = w > 1
+  deficit = jnp.where(heavy, 0, 1 - w)
+  deficit_after = jnp.cumsum(deficit)
+  # Shift rather than subtract, so that ties between the searches below, which
+  # are common for integer weights, compare identically rounded values.
+  deficit_before = jnp.concatenate([jnp.zeros(1, w.dtype), deficit_after[:-1]])
+
+  # Move the heavy items, in order, to the front, and pad their cumulative
+  # excess weights with infinity.
+  num_heavy = jnp.sum(heavy)
+  items = lax.iota(np.int32, n)
+  slots = jnp.where(heavy, jnp.cumsum(heavy) - 1, n)
+  heavy_items = jnp.zeros(n + 1, np.int32).at[slots].set(items)[:n]
+  excess = jnp.zeros(n + 1, w.dtype).at[slots].set(w - 1)[:n]
+  excess_after = jnp.where(items < num_heavy, jnp.cumsum(excess), jnp.inf)
+
+  # A light item's bucket is filled by the first heavy item whose cumulative
+  # excess covers the deficits before it.
+  last_heavy = jnp.maximum(num_heavy - 1, 0)
+  filler = jnp.minimum(jnp.searchsorted(excess_after, deficit_before), last_heavy)
+  prob = jnp.where(heavy, 1, w)
+  alias = heavy_items[filler]
+
+  # A heavy item stops filling at the first light item whose deficit takes the
+  # cumulative deficit past its cumulative excess. What it has left is its own
+  # bucket's probability, and the next heavy item fills the rest.
+  stop = jnp.searchsorted(deficit_after, excess_after, side='right')
+  left = 1 + excess_after - deficit_after[jnp.minimum(stop, n - 1)]
+  heavy_prob = jnp.where(stop < n, jnp.clip(left, 0, 1), 1)
+  next_heavy = heavy_items[jnp.minimum(items + 1, last_heavy)]
+  is_heavy_slot = items < num_heavy
+  target = jnp.where(is_heavy_slot, heavy_items, n)
+  prob = jnp.concatenate([prob, jnp.zeros(1, prob.dtype)]).at[target].set(
+      jnp.where(is_heavy_slot, heavy_prob, 0))[:n]
+  alias = jnp.concatenate([alias, jnp.zeros(1, np.int32)]).at[target].set(
+      next_heavy)[:n]
+  return AliasTable(prob, alias)
+
+
+def alias_choice(key: jnp.ndarray, table: AliasTable,
+                 shape: Sequence[int] = (), a=None) -> jnp.ndarray:
+  """Draws samples with replacement from the distribution of an alias table.
+
+  Args:
+    key: a PRNGKey used as the random key.
+    table: an :class:`AliasTable` built by :func:`alias_table`.
+    shape: optional, a tuple of nonnegative integers representing the result
+      shape. Default ().
+    a: optional 1-D array of the ``n`` items to draw. If not given, the
+      indices of the items are returned.
+
+  Returns:
+    An array of shape `shape` containing samples from `a`, or their indices.
+  """
+  shape = abstract_arrays.canonicalize_shape(shape)
+  ind = _alias_choice(key, table, shape, FLAGS.jax_prng_impl)
+  return ind if a is None else jnp.asarray(a)[ind]
+
+@partial(jit, static_argnums=(2, 3))
+def _alias_choice(key, table, shape, impl) -> jnp.ndarray:
+  n = table.prob.shape[0]
+  bucket_key, coin_key = _split(key, 2, impl)
+  buckets = randint(bucket_key, shape, 0, n)
+  coins = uniform(coin_key, shape, table.prob.dtype)
+  return jnp.where(coins < table.prob[buckets], buckets, table.alias[buckets])
+
+
 def normal(key: jnp.ndarray,
            shape: Sequence[int] = (),
            dtype: np.dtype = dtypes.float_) -> jnp.ndarray:
@@ -606,10 +1080,10 @@ def normal(key: jnp.ndarray,
                      f"got {dtype}")
   dtype = dtypes.canonicalize_dtype(dtype)
   shape = abstract_arrays.canonicalize_shape(shape)
-  return _normal(key, shape, dtype)  # type: ignore
+  return _normal(key, shape, dtype, FLAGS.jax_prng_impl)  # type: ignore
 
-@partial(jit, static_argnums=(1, 2))
-def _normal(key, shape, dtype) -> jnp.ndarray:
+@partial(jit, static_argnums=(1, 2, 3))
+def _normal(key, shape, dtype, impl) -> jnp.ndarray:
   _check_shape("normal", shape)
   lo = np.nextafter(np.array(-1., dtype), 0., dtype=dtype)
   hi = np.array(1., dtype)
@@ -648,10 +1122,11 @@ def multivariate_normal(key: jnp.ndarray,
   dtype = dtypes.canonicalize_dtype(dtype)
   if shape is not None:
     shape = abstract_arrays.canonicalize_shape(shape)
-  return _multivariate_normal(key, mean, cov, shape, dtype)  # type: ignore
+  return _multivariate_normal(key, mean, cov, shape, dtype,
+                              FLAGS.jax_prng_impl)  # type: ignore
 
-@partial(jit, static_argnums=(3, 4))
-def _multivariate_normal(key, mean, cov, shape, dtype) -> jnp.ndarray:
+@partial(jit, static_argnums=(3, 4, 5))
+def _multivariate_normal(key, mean, cov, shape, dtype, impl) -> jnp.ndarray:
   if not np.ndim(mean) >= 1:
     msg = "multivariate_normal requires mean.ndim >= 1, got mean.ndim == {}"
     raise ValueError(msg.format(np.ndim(mean)))
@@ -704,10 +1179,11 @@ def truncated_normal(key: jnp.ndarray,
   dtype = dtypes.canonicalize_dtype(dtype)
   if shape is not None:
     shape = abstract_arrays.canonicalize_shape(shape)
-  return _truncated_normal(key, lower, upper, shape, dtype)  # type: ignore
+  return _truncated_normal(key, lower, upper, shape, dtype,
+                           FLAGS.jax_prng_impl)  # type: ignore
 
-@partial(jit, static_argnums=(3, 4))
-def _truncated_normal(key, lower, upper, shape, dtype) -> jnp.ndarray:
+@partial(jit, static_argnums=(3, 4, 5))
+def _truncated_normal(key, lower, upper, shape, dtype, impl) -> jnp.ndarray:
   if shape is None:
     shape = lax.broadcast_shapes(np.shape(lower), np.shape(upper))
   else:
@@ -746,10 +1222,10 @@ def bernoulli(key: jnp.ndarray,
     msg = "bernoulli probability `p` must have a floating dtype, got {}."
     raise TypeError(msg.format(dtype))
   p = lax.convert_element_type(p, dtype)
-  return _bernoulli(key, p, shape)  # type: ignore
+  return _bernoulli(key, p, shape, FLAGS.jax_prng_impl)  # type: ignore
 
-@partial(jit, static_argnums=(2,))
-def _bernoulli(key, p, shape) -> jnp.ndarray:
+@partial(jit, static_argnums=(2, 3))
+def _bernoulli(key, p, shape, impl) -> jnp.ndarray:
   if shape is None:
     shape = np.shape(p)
   else:
@@ -823,10 +1299,10 @@ def cauchy(key, shape=(), dtype=dtypes.float_):
                      f"dtype, got {dtype}")
   dtype = dtypes.canonicalize_dtype(dtype)
   shape = abstract_arrays.canonicalize_shape(shape)
-  return _cauchy(key, shape, dtype)
+  return _cauchy(key, shape, dtype, FLAGS.jax_prng_impl)
 
-@partial(jit, static_argnums=(1, 2))
-def _cauchy(key, shape, dtype):
+@partial(jit, static_argnums=(1, 2, 3))
+def _cauchy(key, shape, dtype, impl):
   _check_shape("cauchy", shape)
   u = uniform(key, shape, dtype, minval=jnp.finfo(dtype).eps, maxval=1.)
   pi = _constant_like(u, np.pi)
@@ -859,10 +1335,10 @@ def dirichlet(key, alpha, shape=None, dtype=dtypes.float_):
   dtype = dtypes.canonicalize_dtype(dtype)
   if shape is not None:
     shape = abstract_arrays.canonicalize_shape(shape)
-  return _dirichlet(key, alpha, shape, dtype)
+  return _dirichlet(key, alpha, shape, dtype, FLAGS.jax_prng_impl)
 
-@partial(jit, static_argnums=(2, 3))
-def _dirichlet(key, alpha, shape, dtype):
+@partial(jit, static_argnums=(2, 3, 4))
+def _dirichlet(key, alpha, shape, dtype, impl):
   if not np.ndim(alpha) >= 1:
     msg = "dirichlet requires alpha.ndim >= 1, got alpha.ndim == {}"
     raise ValueError(msg.format(np.ndim(alpha)))
@@ -895,10 +1371,10 @@ def exponential(key, shape=(), dtype=dtypes.float_):
                      f"dtype, got {dtype}")
   dtype = dtypes.canonicalize_dtype(dtype)
   shape = abstract_arrays.canonicalize_shape(shape)
-  return _exponential(key, shape, dtype)
+  return _exponential(key, shape, dtype, FLAGS.jax_prng_impl)
 
-@partial(jit, static_argnums=(1, 2))
-def _exponential(key, shape, dtype):
+@partial(jit, static_argnums=(1, 2, 3))
+def _exponential(key, shape, dtype, impl):
   _check_shape("exponential", shape)
   u = uniform(key, shape, dtype)
   # taking 1 - u to move the domain of log to (0, 1] instead of [0, 1)
@@ -1022,10 +1498,10 @@ def gamma(key, a, shape=None, dtype=dtypes.float_):
   dtype = dtypes.canonicalize_dtype(dtype)
   if shape is not None:
     shape = abstract_arrays.canonicalize_shape(shape)
-  return _gamma(key, a, shape, dtype)
+  return _gamma(key, a, shape, dtype, FLAGS.jax_prng_impl)
 
-@partial(jit, static_argnums=(2, 3))
-def _gamma(key, a, shape, dtype):
+@partial(jit, static_argnums=(2, 3, 4))
+def _gamma(key, a, shape, dtype, impl):
   if shape is None:
     shape = np.shape(a)
   else:
@@ -1037,8 +1513,8 @@ def _gamma(key, a, shape, dtype):
   return random_gamma_p.bind(key, a)
 
 
-@partial(jit, static_argnums=(2, 3, 4))
-def _poisson_knuth(key, lam, shape, dtype, max_iters):
+@partial(jit, static_argnums=(2, 3, 4, 5))
+def _poisson_knuth(key, lam, shape, dtype, max_iters, impl):
   # Knuth's algorithm for generating Poisson random variates.
   # Reference:
   # https://en.wikipedia.org/wiki/Poisson_distribution#Generating_Poisson-distributed_random_variables
@@ -1060,8 +1536,8 @@ def _poisson_knuth(key, lam, shape, dtype, max_iters):
   return (k - 1).astype(dtype)
 
 
-@partial(jit, static_argnums=(2, 3, 4))
-def _poisson_rejection(key, lam, shape, dtype, max_iters):
+@partial(jit, static_argnums=(2, 3, 4, 5))
+def _poisson_rejection(key, lam, shape, dtype, max_iters, impl):
   # Transformed rejection due to Hormann.
   # Reference:
   # http://citeseer.ist.psu.edu/viewdoc/citations;jsessionid=1BEB35946CC807879F55D42512E5490C?doi=10.1.1.48.3054.
@@ -1103,8 +1579,8 @@ def _poisson_rejection(key, lam, shape, dtype, max_iters):
   return k.astype(dtype)
 
 
-@partial(jit, static_argnums=(2, 3))
-def _poisson(key, lam, shape, dtype):
+@partial(jit, static_argnums=(2, 3, 4))
+def _poisson(key, lam, shape, dtype, impl):
   # The implementation matches TensorFlow and NumPy:
   # https://github.com/tensorflow/tensorflow/blob/v2.2.0-rc3/tensorflow/core/kernels/random_poisson_op.cc
   # https://github.com/numpy/numpy/blob/v1.18.3/numpy/random/src/distributions/distributions.c#L574
@@ -1118,8 +1594,9 @@ def _poisson(key, lam, shape, dtype):
   max_iters = dtype.type(jnp.iinfo(dtype).max)  # insanely conservative
   return lax.select(
       use_knuth,
-      _poisson_knuth(key, lam_knuth, shape, dtype, max_iters),
-      _poisson_rejection(key, lam_rejection, shape, dtype, max_iters),
+      _poisson_knuth(key, lam_knuth, shape, dtype, max_iters, impl),
+      _poisson_rejection(key, lam_rejection, shape, dtype, max_iters,
+                         impl),
   )
 
 
@@ -1142,7 +1619,7 @@ def poisson(key, lam, shape=(), dtype=dtypes.int_):
   if np.shape(lam) != shape:
     lam = jnp.broadcast_to(lam, shape)
   lam = lax.convert_element_type(lam, np.float32)
-  return _poisson(key, lam, shape, dtype)
+  return _poisson(key, lam, shape, dtype, FLAGS.jax_prng_impl)
 
 
 def gumbel(key, shape=(), dtype=dtypes.float_):
@@ -1163,10 +1640,10 @@ def gumbel(key, shape=(), dtype=dtypes.float_):
                      f"dtype, got {dtype}")
   dtype = dtypes.canonicalize_dtype(dtype)
   shape = abstract_arrays.canonicalize_shape(shape)
-  return _gumbel(key, shape, dtype)
+  return _gumbel(key, shape, dtype, FLAGS.jax_prng_impl)
 
-@partial(jit, static_argnums=(1, 2))
-def _gumbel(key, shape, dtype):
+@partial(jit, static_argnums=(1, 2, 3))
+def _gumbel(key, shape, dtype, impl):
   _check_shape("gumbel", shape)
   return -jnp.log(-jnp.log(
       uniform(key, shape, dtype, minval=jnp.finfo(dtype).eps, maxval=1.)))
@@ -1220,10 +1697,10 @@ def laplace(key, shape=(), dtype=dtypes.float_):
                      f"dtype, got {dtype}")
   dtype = dtypes.canonicalize_dtype(dtype)
   shape = abstract_arrays.canonicalize_shape(shape)
-  return _laplace(key, shape, dtype)
+  return _laplace(key, shape, dtype, FLAGS.jax_prng_impl)
 
-@partial(jit, static_argnums=(1, 2))
-def _laplace(key, shape, dtype):
+@partial(jit, static_argnums=(1, 2, 3))
+def _laplace(key, shape, dtype, impl):
   _check_shape("laplace", shape)
   u = uniform(
       key, shape, dtype, minval=-1. + jnp.finfo(dtype).epsneg, maxval=1.)
@@ -1248,10 +1725,10 @@ def logistic(key, shape=(), dtype=dtypes.float_):
                      f"dtype, got {dtype}")
   dtype = dtypes.canonicalize_dtype(dtype)
   shape = abstract_arrays.canonicalize_shape(shape)
-  return _logistic(key, shape, dtype)
+  return _logistic(key, shape, dtype, FLAGS.jax_prng_impl)
 
-@partial(jit, static_argnums=(1, 2))
-def _logistic(key, shape, dtype):
+@partial(jit, static_argnums=(1, 2, 3))
+def _logistic(key, shape, dtype, impl):
   # Mathematically, we can compute the distribution by generating uniformly-distributed
   # numbers x in the open interval (a, b) and computing:
   #   z = log[ (x - a) / (b - x))
@@ -1292,10 +1769,10 @@ def pareto(key, b, shape=None, dtype=dtypes.float_):
   dtype = dtypes.canonicalize_dtype(dtype)
   if shape is not None:
     shape = abstract_arrays.canonicalize_shape(shape)
-  return _pareto(key, b, shape, dtype)
+  return _pareto(key, b, shape, dtype, FLAGS.jax_prng_impl)
 
-@partial(jit, static_argnums=(2, 3))
-def _pareto(key, b, shape, dtype):
+@partial(jit, static_argnums=(2, 3, 4))
+def _pareto(key, b, shape, dtype, impl):
   if shape is None:
     shape = np.shape(b)
   else:
@@ -1328,10 +1805,10 @@ def t(key, df, shape=(), dtype=dtypes.float_):
                      f"dtype, got {dtype}")
   dtype = dtypes.canonicalize_dtype(dtype)
   shape = abstract_arrays.canonicalize_shape(shape)
-  return _t(key, df, shape, dtype)
+  return _t(key, df, shape, dtype, FLAGS.jax_prng_impl)
 
-@partial(jit, static_argnums=(2, 3))
-def _t(key, df, shape, dtype):
+@partial(jit, static_argnums=(2, 3, 4))
+def _t(key, df, shape, dtype, impl):
   if shape is None:
     shape = np.shape(df)
   else:
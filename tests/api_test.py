@@ -17,7 +17,10 @@ import collections
 from contextlib import contextmanager
 import copy
 from functools import partial
+import gc
 import re
+import tempfile
+import time
 import unittest
 import warnings
 import weakref
@@ -34,6 +37,8 @@ from jax import jit, grad, device_put, jacfwd, jacrev, hessian
 from jax import api, core, lax, lax_reference
 from jax.core import Primitive
 from jax.interpreters import ad
+from jax.interpreters import masking
+from jax.interpreters import pxla
 from jax.interpreters import xla
 from jax.lib import xla_bridge as xb
 from jax import test_util as jtu
@@ -621,6 +626,12 @@ class APITest(jtu.JaxTestCase):
     self.assertRaisesRegex(ValueError, "DeviceArray has been deleted.",
                             lambda: repr(x))
 
+  def test_deleted_devicearray_op_by_op(self):
+    x = jnp.ones(3)
+    x.delete()
+    self.assertRaisesRegex(ValueError, "DeviceArray has been deleted.",
+                           lambda: lax.add(x, x))
+
   def test_devicearray_block_until_ready(self):
     x = device_put(1.)
     y = x.block_until_ready()
@@ -954,6 +965,361 @@ class APITest(jtu.JaxTestCase):
     self.assertIsInstance(x, xla.DeviceArray)
     self.assertEqual(x.device_buffer.device(), device)
 
+  def test_jit_cache_info(self):
+    f = lambda x: x + 1
+    before = api.cache_info()['_xla_callable']
+    api.jit(f)(1.)
+    api.jit(f)(2.)
+    after = api.cache_info()['_xla_callable']
+    self.assertEqual(after.misses - before.misses, 1)
+    self.assertEqual(after.hits - before.hits, 1)
+    self.assertEqual(after.currsize - before.currsize, 1)
+
+  def test_cache_info_merges_caches_with_the_same_name(self):
+    def make_cache():
+      def same_name_callable(fun, x):
+        return fun.call_wrapped(x)
+      return lu.cache(same_name_callable)
+    cache1, cache2 = make_cache(), make_cache()
+    f = lu.wrap_init(lambda x: x + 1)
+    cache1(f, 1)
+    cache1(f, 1)
+    cache2(f, 2)
+    info = lu.cache_info()['same_name_callable']
+    self.assertEqual(info.misses, 2)
+    self.assertEqual(info.hits, 1)
+    self.assertEqual(info.currsize, 2)
+
+    del cache1, cache2, f
+    gc.collect()
+    self.assertNotIn('same_name_callable', lu.cache_info())
+
+  def test_jit_cache_max_entries_per_function(self):
+    traces = []
+    def f(x):
+      traces.append(x.shape)
+      return x.sum()
+
+    prev = FLAGS.jax_compilation_cache_max_entries_per_function
+    config.update('jax_compilation_cache_max_entries_per_function', 2)
+    try:
+      f_jit = api.jit(f)
+      before = api.cache_info()['_xla_callable']
+      f_jit(np.ones(1))
+      f_jit(np.ones(2))
+      f_jit(np.ones(1))  # makes shape (2,) the least recently used entry
+      f_jit(np.ones(3))  # evicts shape (2,)
+      f_jit(np.ones(1))
+      self.assertEqual(traces, [(1,), (2,), (3,)])
+      f_jit(np.ones(2))
+      self.assertEqual(traces, [(1,), (2,), (3,), (2,)])
+      after = api.cache_info()['_xla_callable']
+      self.assertEqual(after.evictions - before.evictions, 2)
+    finally:
+      config.update('jax_compilation_cache_max_entries_per_function', prev)
+
+  def test_jit_cache_max_entries_global(self):
+    traces = []
+    def f(x):
+      traces.append('f')
+      return x + 1
+    def g(x):
+      traces.append('g')
+      return x * 2
+
+    prev = FLAGS.jax_compilation_cache_max_entries
+    config.update('jax_compilation_cache_max_entries', 1)
+    try:
+      f_jit, g_jit = api.jit(f), api.jit(g)
+      f_jit(1.)
+      g_jit(1.)  # evicts everything else, including f's entry
+      g_jit(1.)
+      f_jit(1.)
+      self.assertEqual(traces, ['f', 'g', 'f'])
+      self.assertEqual(sum(info.currsize for info in lu.cache_info().values()),
+                       1)
+    finally:
+      config.update('jax_compilation_cache_max_entries', prev)
+
+  def test_primitive_cache_info(self):
+    x = jnp.arange(5.)
+    lax.sin(x)
+    before = api.cache_info()['xla_primitive_callable']
+    lax.sin(x)
+    lax.sin(x + 1)
+    after = api.cache_info()['xla_primitive_callable']
+    self.assertEqual(after.misses, before.misses)
+    self.assertGreaterEqual(after.hits - before.hits, 2)
+
+    lax.sin(jnp.arange(7.))
+    self.assertEqual(
+        api.cache_info()['xla_primitive_callable'].misses - after.misses, 1)
+
+  def test_primitive_cache_max_entries(self):
+    prev = FLAGS.jax_primitive_cache_max_entries
+    config.update('jax_primitive_cache_max_entries', 2)
+    try:
+      for n in range(1, 5):
+        self.assertAllClose(lax.neg(np.ones(n, np.float32)),
+                            -np.ones(n, np.float32))
+      info = api.cache_info()['xla_primitive_callable']
+      self.assertLessEqual(info.currsize, 2)
+      self.assertGreaterEqual(info.evictions, 2)
+    finally:
+      config.update('jax_primitive_cache_max_entries', prev)
+
+  def test_primitive_dispatch_multiple_results_and_tokens(self):
+    x = jnp.array([3., 1., 2.])
+    for _ in range(2):
+      out = lax.sort((x, x + 1), num_keys=1)
+      self.assertAllClose(out, (jnp.array([1., 2., 3.]),
+                                jnp.array([2., 3., 4.])))
+      token = lax.create_token(x)
+      token = lax.after_all(token, token)
+      self.assertIsInstance(token, xla.Token)
+
+  @contextmanager
+  def count_xla_call_impls(self):
+    impl = xla.xla_call_p.impl
+    count = [0]
+    def counting_impl(*args, **params):
+      count[0] += 1
+      return impl(*args, **params)
+    xla.xla_call_p.impl = counting_impl
+    try:
+      yield count
+    finally:
+      xla.xla_call_p.impl = impl
+
+  def test_jit_dispatch_fast_path(self):
+    if not config.omnistaging_enabled:
+      raise unittest.SkipTest("the fast path requires omnistaging")
+    f = api.jit(lambda x, y: (x + y, x * y))
+    x, y = jnp.arange(3.), jnp.ones(3)
+    with self.count_xla_call_impls() as count:
+      f(x, y)
+      before = api.cache_info()['_xla_callable']
+      out = f(x, y)
+      after = api.cache_info()['_xla_callable']
+    self.assertAllClose(out, (x + y, x * y))
+    # The second call goes straight to the executable, bypassing xla_call, but
+    # is still recorded as a hit of the _xla_callable cache.
+    self.assertEqual(count[0], 1)
+    self.assertEqual(after.hits - before.hits, 1)
+    self.assertEqual(after.misses, before.misses)
+
+  def test_jit_dispatch_fast_path_signature_changes(self):
+    traces = []
+    def f(x, n, scale=1.):
+      traces.append((np.shape(x), n))
+      return {'a': x * n * scale}
+
+    f_jit = api.jit(f, static_argnums=(1,))
+    self.assertAllClose(f_jit(np.ones(2), 2), {'a': 2 * np.ones(2)})
+    self.assertAllClose(f_jit(np.ones(2), 2), {'a': 2 * np.ones(2)})
+    self.assertAllClose(f_jit(np.ones(3), 2), {'a': 2 * np.ones(3)})
+    self.assertAllClose(f_jit(np.ones(2), 3), {'a': 3 * np.ones(2)})
+    self.assertAllClose(f_jit(np.ones(2), 2, scale=2.),
+                        {'a': 4 * np.ones(2)})
+    self.assertAllClose(f_jit(np.ones(2, np.int32), 2),
+                        {'a': 2 * np.ones(2, np.int32)}, check_dtypes=True)
+    self.assertEqual(len(traces), 5)
+
+  def test_jit_dispatch_fast_path_under_transformations(self):
+    f = api.jit(lambda x: jnp.sin(x) * x)
+    f(2.)
+    f(2.)
+    self.assertAllClose(grad(f)(2.), np.cos(2.) * 2. + np.sin(2.))
+    self.assertAllClose(api.vmap(f)(jnp.arange(3.)),
+                        jnp.sin(jnp.arange(3.)) * jnp.arange(3.))
+    self.assertAllClose(api.jit(f)(2.), np.sin(2.) * 2.)
+
+  def test_jit_dispatch_fast_path_checks_args(self):
+    f = api.jit(lambda x: x)
+    f(1.)
+    for _ in range(2):
+      self.assertRaisesRegex(TypeError, "is not a valid JAX type",
+                             lambda: f("foo"))
+
+  def test_jit_dispatch_fast_path_pending_device_array(self):
+    if not config.omnistaging_enabled:
+      raise unittest.SkipTest("the fast path requires omnistaging")
+    f = api.jit(lambda x: x * 2)
+    x = jnp.arange(3.)
+    x.block_until_ready()
+    with self.count_xla_call_impls() as count:
+      for i in range(3):
+        with api.eager_fusion():
+          y = x + i
+          self.assertIsInstance(y, xla.PendingDeviceArray)
+          self.assertAllClose(f(y), 2 * (np.arange(3.) + i),
+                              check_dtypes=False)
+    self.assertEqual(count[0], 1)
+
+  def test_jit_dispatch_fast_path_disabled(self):
+    prev = FLAGS.jax_jit_dispatch_fast_path
+    config.update('jax_jit_dispatch_fast_path', False)
+    try:
+      f = api.jit(lambda x: x + 1)
+      with self.count_xla_call_impls() as count:
+        f(1.)
+        self.assertAllClose(f(1.), 2.)
+      self.assertEqual(count[0], 2)
+    finally:
+      config.update('jax_jit_dispatch_fast_path', prev)
+
+  def test_jit_compile_populates_cache(self):
+    traces = []
+    def f(x, n):
+      traces.append(np.shape(x))
+      return x * n
+
+    f_jit = api.jit(f, static_argnums=(1,))
+    f_jit.compile(api.ShapeDtypeStruct((3,), np.float32), 2)
+    self.assertEqual(traces, [(3,)])
+    before = api.cache_info()['_xla_callable']
+    self.assertAllClose(f_jit(np.ones(3, np.float32), 2),
+                        2 * np.ones(3, np.float32))
+    after = api.cache_info()['_xla_callable']
+    self.assertEqual(traces, [(3,)])
+    self.assertEqual(after.misses, before.misses)
+
+  def test_jit_compile_async(self):
+    traces = []
+    def f(x, y):
+      traces.append((np.shape(x), np.shape(y)))
+      return {'sum': x + y}
+
+    f_jit = api.jit(f)
+    shapes = [(1,), (2,), (3,)]
+    futures = [f_jit.compile_async(api.ShapeDtypeStruct(s, np.float32),
+                                   y=api.ShapeDtypeStruct(s, np.float32))
+               for s in shapes]
+    for fut in futures:
+      self.assertIsNone(fut.result())
+    self.assertCountEqual(traces, [(s, s) for s in shapes])
+    with self.count_xla_call_impls() as count:
+      for s in shapes:
+        x = np.ones(s, np.float32)
+        self.assertAllClose(f_jit(x, y=x), {'sum': 2 * x})
+    self.assertEqual(count[0], 0)  # all served by the dispatch fast path
+    self.assertEqual(len(traces), len(shapes))
+
+  def test_jit_compile_async_error(self):
+    f_jit = api.jit(lambda x, y: jnp.dot(x, y))
+    fut = f_jit.compile_async(api.ShapeDtypeStruct((2, 3), np.float32),
+                              api.ShapeDtypeStruct((4,), np.float32))
+    self.assertRaisesRegex(TypeError, "Incompatible shapes for dot.*",
+                           fut.result)
+
+  def test_jit_concurrent_compiles_are_deduplicated(self):
+    traces = []
+    def f(x):
+      traces.append(np.shape(x))
+      time.sleep(0.05)  # give the other threads time to miss on the same key
+      return x + 1
+
+    f_jit = api.jit(f)
+    before = api.cache_info()['_xla_callable']
+    x = api.ShapeDtypeStruct((4,), np.float32)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+      futures = [executor.submit(f_jit.compile, x) for _ in range(8)]
+      for fut in futures:
+        fut.result()
+    after = api.cache_info()['_xla_callable']
+    self.assertEqual(traces, [(4,)])
+    self.assertEqual(after.misses - before.misses, 1)
+    self.assertEqual(after.hits - before.hits, 7)
+
+  def test_precompile(self):
+    traces = []
+    def f(x, y):
+      traces.append('f')
+      return x * y
+    def g(x):
+      traces.append('g')
+      return x - lax.psum(x, 'i')
+
+    f_jit = api.jit(f)
+    g_pmap = api.pmap(g, axis_name='i')
+    n = xb.device_count()
+    x = api.ShapeDtypeStruct((3,), np.float32)
+    api.precompile([(f_jit, (x, x)),
+                    (f_jit, (x,), dict(y=x)),
+                    (g_pmap, (api.ShapeDtypeStruct((n, 2), np.float32),))],
+                   max_workers=2)
+    self.assertCountEqual(traces, ['f', 'f', 'g'])
+
+    ones = np.ones(3, np.float32)
+    self.assertAllClose(f_jit(ones, ones), ones)
+    self.assertAllClose(f_jit(ones, y=ones), ones)
+    self.assertAllClose(g_pmap(np.ones((n, 2), np.float32)),
+                        np.full((n, 2), 1. - n, np.float32))
+    self.assertCountEqual(traces, ['f', 'f', 'g'])
+
+  def test_precompile_error(self):
+    f_jit = api.jit(lambda x: jnp.dot(x, jnp.ones(4)))
+    g_jit = api.jit(lambda x: x + 1)
+    x = api.ShapeDtypeStruct((3,), np.float32)
+    self.assertRaisesRegex(
+        TypeError, "Incompatible shapes for dot.*",
+        lambda: api.precompile([(f_jit, (x,)), (g_jit, (x,))]))
+
+  def test_jit_shape_buckets(self):
+    traces = []
+    def f(x, y):
+      traces.append('f')
+      return jnp.sin(x) * y, jnp.sum(x)
+
+    f_jit = api.jit(f, in_shapes=['n', 'n'])
+    before = api.cache_info()['jit_shape_buckets']
+    for n in [3, 4, 5, 7, 8, 3]:
+      x = np.arange(n, dtype=np.float32)
+      y = np.full(n, 2., np.float32)
+      out, total = f_jit(x, y)
+      self.assertEqual(out.shape, (n,))
+      self.assertAllClose(out, np.sin(x) * y)
+      self.assertAllClose(total, np.sum(x))
+    self.assertLen(traces, 2)  # one per bucket: 4 and 8
+    self.assertEqual(f_jit.bucket_info(), api.BucketInfo(
+        calls=6, shapes=5, buckets=2, compiles_avoided=3))
+    after = api.cache_info()['jit_shape_buckets']
+    self.assertEqual(after.calls - before.calls, 6)
+    self.assertEqual(after.compiles_avoided - before.compiles_avoided, 3)
+
+  def test_jit_shape_buckets_dtypes(self):
+    def f(x):
+      # The output structure depends on the dtype, not just on the shape.
+      return x * 2 if x.dtype == np.float32 else (x, x > 1)
+    f_jit = api.jit(f, in_shapes=['n'])
+    out = f_jit(np.arange(3, dtype=np.float32))
+    self.assertAllClose(out, np.arange(3, dtype=np.float32) * 2)
+    out, pos = f_jit(np.arange(3, dtype=np.int32))
+    self.assertAllClose(out, np.arange(3, dtype=np.int32))
+    self.assertAllClose(pos, np.arange(3) > 1)
+    self.assertEqual(f_jit.bucket_info(), api.BucketInfo(
+        calls=2, shapes=2, buckets=2, compiles_avoided=0))
+
+  def test_jit_shape_buckets_explicit(self):
+    traces = []
+    def f(x):
+      traces.append('f')
+      return x.T
+    f_jit = api.jit(f, in_shapes=['(n, _)'], shape_buckets=[10, 20])
+    for n in [2, 9, 15]:
+      x = jnp.ones((n, 3))
+      self.assertAllClose(f_jit(x), np.ones((3, n)))
+    self.assertLen(traces, 2)
+    self.assertRaisesRegex(ValueError, "Size 21 is larger than the largest "
+                           "shape bucket 20.",
+                           lambda: f_jit(jnp.ones((21, 3))))
+
+  def test_jit_shape_buckets_shape_mismatch(self):
+    f_jit = api.jit(lambda x, y: x + y, in_shapes=['n', 'n'])
+    self.assertRaisesRegex(masking.ShapeError, "Argument shapes .* do not "
+                           "match in_shapes.*",
+                           lambda: f_jit(np.ones(2), np.ones(3)))
+
   def test_jit_of_noncallable(self):
     self.assertRaisesRegex(TypeError, "Expected a callable value.*",
                            lambda: api.jit(3))
@@ -978,6 +1344,108 @@ class APITest(jtu.JaxTestCase):
     for x, y in zip(xs, ys):
       self.assertAllClose(x, y)
 
+  def test_device_put_and_get_many_leaves(self):
+    xs = {str(i): np.full((i, 2), i, np.float32) for i in range(50)}
+    ys = api.device_put(xs)
+    self.assertEqual(set(ys), set(xs))
+    for k in xs:
+      self.assertIsInstance(ys[k], xla.DeviceArray)
+      self.assertAllClose(ys[k], xs[k])
+    zs = api.device_get(ys)
+    for k in xs:
+      self.assertIsInstance(zs[k], np.ndarray)
+      self.assertAllClose(zs[k], xs[k])
+
+  def test_device_put_under_jit(self):
+    f = api.jit(lambda x: api.device_put({'a': x, 'b': 2 * x})['b'])
+    self.assertAllClose(f(3.), 6.)
+
+  def test_device_get_out(self):
+    x = {'a': jnp.arange(3.), 'b': [jnp.ones((2, 2)), np.float32(4)]}
+    out = {'a': np.zeros(3, np.float32),
+           'b': [np.zeros((2, 2), np.float32), np.zeros((), np.float32)]}
+    result = api.device_get(x, out=out)
+    self.assertIs(result, out)
+    self.assertAllClose(out, x)
+    self.assertIsNone(x['a']._npy_value)
+
+    with tempfile.NamedTemporaryFile() as f:
+      mmap = np.lib.format.open_memmap(f.name, mode='w+', dtype=np.float32,
+                                       shape=(2, 2))
+      api.device_get(x['b'][0], out=mmap)
+      mmap.flush()
+      self.assertAllClose(np.load(f.name), np.ones((2, 2)))
+
+    self.assertRaisesRegex(ValueError, "device_get out array has shape.*",
+                           lambda: api.device_get(x['a'], np.zeros(4)))
+    self.assertRaisesRegex(TypeError, "device_get out has tree structure.*",
+                           lambda: api.device_get(x, out['a']))
+
+  def test_device_get_out_sharded(self):
+    n = xb.local_device_count()
+    x = api.pmap(lambda x: x * 2)(np.arange(2 * n, dtype=np.float32).reshape(n, 2))
+    out = np.zeros((n, 2), np.float32)
+    api.device_get(x, out=out)
+    self.assertAllClose(out, 2 * np.arange(2 * n).reshape(n, 2))
+
+  def test_prefetch_to_device(self):
+    xs = [(np.full(3, i, np.float32), {'y': np.int32(i)}) for i in range(5)]
+    it = api.prefetch_to_device(iter(xs), 2)
+    ys = list(it)
+    self.assertLen(ys, 5)
+    for x, y in zip(xs, ys):
+      self.assertIsInstance(y[0], xla.DeviceArray)
+      self.assertAllClose(x, y)
+    stats = it.stats()
+    self.assertEqual(stats.batches, 5)
+    self.assertLessEqual(stats.mean_queue_depth, 2)
+    self.assertRaises(StopIteration, lambda: next(it))
+
+  def test_prefetch_to_device_committed(self):
+    device = api.devices()[-1]
+    x, = api.prefetch_to_device([np.arange(3)], 1, device)
+    self.assertEqual(x.device_buffer.device(), device)
+    self.assertEqual(x._device, device)
+
+  def test_prefetch_to_device_sharded(self):
+    devices = api.local_devices()
+    n = len(devices)
+    xs = [np.arange(2 * n, dtype=np.float32).reshape(n, 2) + i
+          for i in range(3)]
+    f = api.pmap(lambda x: x * 2)
+    for x, y in zip(xs, api.prefetch_to_device(xs, 2, devices)):
+      self.assertIsInstance(y, pxla.ShardedDeviceArray)
+      self.assertEqual([b.device() for b in y.device_buffers], devices)
+      self.assertAllClose(f(y), x * 2)
+
+  def test_prefetch_to_device_error(self):
+    def gen():
+      yield np.ones(3)
+      raise ValueError("bad batch")
+    it = api.prefetch_to_device(gen())
+    self.assertAllClose(next(it), np.ones(3))
+    self.assertRaisesRegex(ValueError, "bad batch", lambda: next(it))
+
+  def test_prefetch_to_device_close(self):
+    it = api.prefetch_to_device(iter(lambda: np.ones(3), None), 2)
+    next(it)
+    it.close()
+    self.assertRaises(StopIteration, lambda: next(it))
+
+  def test_prefetch_to_device_stops_when_dropped(self):
+    it = api.prefetch_to_device(iter(lambda: np.ones(3), None), 2)
+    next(it)
+    thread = it._thread
+    del it
+    gc.collect()
+    thread.join(timeout=10)
+    self.assertFalse(thread.is_alive())
+
+  def test_prefetch_to_device_end_is_not_a_stall(self):
+    it = api.prefetch_to_device(iter([]), 2)
+    self.assertEqual(list(it), [])
+    self.assertEqual(it.stats().stalls, 0)
+
   def test_concurrent_jit(self):
     @jit
     def f(x):
@@ -2088,6 +2556,97 @@ class LazyTest(jtu.JaxTestCase):
     self.assertAllClose(x, np.ones(3), check_dtypes=False)
     self.assertAllClose(y, np.ones(3) + np.ones(3), check_dtypes=False)
 
+
+class EagerFusionTest(jtu.JaxTestCase):
+
+  count_compiles = LazyTest.count_compiles
+
+  def test_ops_are_deferred_and_fused(self):
+    x = jnp.ones(4)
+    x.block_until_ready()
+    with api.eager_fusion():
+      with self.count_compiles() as count:
+        y = jnp.sin(x)
+        z = y * y + jnp.cos(x) * jnp.cos(x)
+        self.assertIsInstance(z, xla.PendingDeviceArray)
+        self.assertEqual(count[0], 0)
+        self.assertAllClose(z, np.ones(4, np.float32))
+      self.assertEqual(count[0], 1)
+    self.assertAllClose(y, np.sin(np.ones(4, np.float32)))
+
+  def test_fused_computations_are_cached(self):
+    x = jnp.arange(5.)
+    x.block_until_ready()
+    def step(x):
+      return jnp.exp(-x) + 2 * x
+
+    with api.eager_fusion():
+      step(x).block_until_ready()
+      with self.count_compiles() as count:
+        for _ in range(3):
+          out = step(x)
+          out.block_until_ready()
+    self.assertEqual(count[0], 0)
+    self.assertAllClose(out, np.exp(-np.arange(5.)) + 2 * np.arange(5.),
+                        check_dtypes=False)
+
+  def test_forcing(self):
+    with api.eager_fusion():
+      x = jnp.arange(3.) + 1
+      self.assertTrue(bool(x[0] > 0))  # Python control flow
+      self.assertEqual(str(x + 1), str(np.arange(3.) + 2))
+      self.assertAllClose(api.jit(lambda x: x * 2)(x + 1),
+                          2 * (np.arange(3.) + 2), check_dtypes=False)
+      self.assertAllClose(lax.sort(x - 1), np.arange(3.), check_dtypes=False)
+      self.assertAllClose(api.grad(lambda x: jnp.sum(x ** 2))(x + 0),
+                          2 * (np.arange(3.) + 1), check_dtypes=False)
+
+  def test_inputs_are_snapshotted(self):
+    x = np.ones(3, np.float32)
+    with api.eager_fusion():
+      y = lax.add(x, x)
+      x[:] = 0
+      self.assertAllClose(y, 2 * np.ones(3, np.float32))
+
+  def test_max_ops(self):
+    prev = FLAGS.jax_eager_fusion_max_ops
+    config.update('jax_eager_fusion_max_ops', 2)
+    try:
+      x = jnp.ones(3)
+      x.block_until_ready()
+      with api.eager_fusion():
+        ys = [x]
+        for _ in range(5):
+          ys.append(ys[-1] + 1)
+        self.assertIsNone(ys[1]._fusion_trace)  # flushed once the trace filled
+        self.assertAllClose(ys[-1], 6 * np.ones(3), check_dtypes=False)
+    finally:
+      config.update('jax_eager_fusion_max_ops', prev)
+
+  def test_committed_arrays_are_not_fused(self):
+    device = api.devices()[-1]
+    x = api.device_put(jnp.ones(3), device)
+    with api.eager_fusion():
+      y = x + 1
+    self.assertNotIsInstance(y, xla.PendingDeviceArray)
+    self.assertEqual(y.device_buffer.device(), device)
+
+  def test_disabled_by_default(self):
+    self.assertNotIsInstance(jnp.ones(3) + 1, xla.PendingDeviceArray)
+    with api.eager_fusion():
+      with api.eager_fusion(False):
+        self.assertNotIsInstance(jnp.ones(3) + 1, xla.PendingDeviceArray)
+
+  def test_nested_disable_flushes_outer_trace(self):
+    with api.eager_fusion():
+      x = jnp.ones(3) + 1
+      with api.eager_fusion(False):
+        self.assertAllClose(x, 2 * np.ones(3), check_dtypes=False)  # flushes
+      y = x + 1
+      self.assertIsInstance(y, xla.PendingDeviceArray)
+      self.assertAllClose(y, 3 * np.ones(3), check_dtypes=False)
+
+
 class CustomJVPTest(jtu.JaxTestCase):
 
   def test_basic(self):
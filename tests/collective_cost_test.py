@@ -0,0 +1,87 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+
+from absl.testing import absltest
+from absl.testing import parameterized
+
+from jax import test_util as jtu
+from jax.experimental import collective_cost
+
+from jax.config import config
+config.parse_flags_with_absl()
+
+
+def synthetic_measurements(collective, latency, seconds_per_byte):
+  return [collective_cost.Measurement(
+              collective, nbytes, n,
+              latency * collective_cost.steps(collective, n) +
+              seconds_per_byte * collective_cost.traffic(collective, nbytes, n))
+          for n in (2, 4, 8) for nbytes in (2 ** 12, 2 ** 16, 2 ** 20)]
+
+
+class CollectiveCostTest(jtu.JaxTestCase):
+
+  @parameterized.named_parameters(
+      {"testcase_name": "_" + collective, "collective": collective}
+      for collective in collective_cost.COLLECTIVES)
+  def testFitRecoversCoefficients(self, collective):
+    latency, seconds_per_byte = 5e-6, 1e-10
+    model = collective_cost.fit(
+        synthetic_measurements(collective, latency, seconds_per_byte))
+    cost = model.costs[collective]
+    self.assertAllClose(cost.latency, latency, rtol=1e-6, check_dtypes=False)
+    self.assertAllClose(cost.seconds_per_byte, seconds_per_byte, rtol=1e-6,
+                        check_dtypes=False)
+    self.assertAllClose(model.estimate(collective, 2 ** 18, 4),
+                        latency * collective_cost.steps(collective, 4) +
+                        seconds_per_byte *
+                        collective_cost.traffic(collective, 2 ** 18, 4),
+                        rtol=1e-6, check_dtypes=False)
+
+  def testFitIsNonnegative(self):
+    # Times that shrink with the device count can't be explained by a
+    # positive latency, so it is fitted as zero.
+    measurements = [("psum", 2 ** 20, n, 1e-3 / n) for n in (2, 4, 8)]
+    cost = collective_cost.fit(measurements).costs["psum"]
+    self.assertEqual(cost.latency, 0.)
+    self.assertGreater(cost.seconds_per_byte, 0.)
+
+  def testTraffic(self):
+    self.assertEqual(collective_cost.traffic("psum", 1024, 4), 1536)
+    self.assertEqual(collective_cost.traffic("all_gather", 1024, 4), 3072)
+    self.assertEqual(collective_cost.traffic("psum_scatter", 1024, 4), 768)
+    self.assertEqual(collective_cost.traffic("ppermute", 1024, 4), 1024)
+    self.assertEqual(collective_cost.steps("psum", 1), 0)
+    with self.assertRaisesRegex(ValueError, "Unknown collective"):
+      collective_cost.steps("pbroadcast", 4)
+
+  def testSaveLoad(self):
+    model = collective_cost.fit(
+        synthetic_measurements("psum", 1e-6, 1e-9) +
+        synthetic_measurements("ppermute", 2e-6, 2e-9), platform="cpu")
+    with tempfile.TemporaryDirectory() as tmpdir:
+      path = os.path.join(tmpdir, "model.json")
+      model.save(path)
+      loaded = collective_cost.CostModel.load(path)
+    self.assertEqual(loaded.platform, "cpu")
+    self.assertEqual(loaded.costs, model.costs)
+    with self.assertRaisesRegex(KeyError, "No fitted cost for 'all_gather'"):
+      loaded.estimate("all_gather", 1024, 4)
+
+
+if __name__ == "__main__":
+  absltest.main(testLoader=jtu.JaxTestLoader())
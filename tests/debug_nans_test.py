@@ -49,6 +49,22 @@ class DebugNaNsTest(jtu.JaxTestCase):
     with self.assertRaises(FloatingPointError):
       _ = 0. / A
 
+  def testJitWithDonatedArgsIsNotRerun(self):
+    traces = []
+    def f(x):
+      traces.append(x)
+      return 0. / x
+    f_jit = jax.jit(f, donate_argnums=0)
+    f_jit(jnp.array(1.))  # populates the dispatch fast path
+    with self.assertRaises(FloatingPointError):
+      f_jit(jnp.array(0.))
+    self.assertLen(traces, 1)
+
+    g_jit = jax.jit(lambda x: f(x) + 0., donate_argnums=0)
+    with self.assertRaises(FloatingPointError):
+      g_jit(jnp.array(0.))
+    self.assertLen(traces, 2)
+
 
 if __name__ == '__main__':
   absltest.main(testLoader=jtu.JaxTestLoader())
@@ -0,0 +1,135 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import subprocess
+import sys
+import textwrap
+from unittest import SkipTest
+
+from absl.testing import absltest
+import numpy as np
+
+from jax import test_util as jtu
+from jax.experimental import host_data
+from jax.interpreters import pxla
+from jax.lib import xla_bridge
+
+from jax.config import config
+config.parse_flags_with_absl()
+
+
+def run_simulated_hosts(host_count, script, local_device_count=2):
+  """Runs `script` in `host_count` processes, each standing in for one host.
+
+  Each process gets `local_device_count` CPU devices and the globals
+  `host_id` and `host_count`, and must print a single line of JSON. Returns
+  the parsed outputs, ordered by host id.
+  """
+  if not sys.platform.startswith("linux"):
+    raise SkipTest("simulated hosts are only supported on Linux")
+  env = dict(os.environ)
+  env["XLA_FLAGS"] = (env.get("XLA_FLAGS", "") +
+                      f" --xla_force_host_platform_device_count={local_device_count}")
+  env["CUDA_VISIBLE_DEVICES"] = ""
+  procs = []
+  for host_id in range(host_count):
+    prelude = f"host_id = {host_id}\nhost_count = {host_count}\n"
+    procs.append(subprocess.Popen(
+        [sys.executable, "-c", prelude + textwrap.dedent(script)], env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE))
+  outputs = []
+  for proc in procs:
+    stdout, stderr = proc.communicate(timeout=300)
+    if proc.returncode:
+      raise RuntimeError(f"simulated host failed:\n{stderr.decode()}")
+    outputs.append(json.loads(stdout.decode().strip().splitlines()[-1]))
+  return outputs
+
+
+class HostDataTest(jtu.JaxTestCase):
+
+  def testHostBatchSlice(self):
+    self.assertEqual(host_data.host_batch_slice(32, 0, 4), slice(0, 8))
+    self.assertEqual(host_data.host_batch_slice(32, 3, 4), slice(24, 32))
+    self.assertEqual(host_data.host_batch_slice(32), slice(0, 32))
+    with self.assertRaisesRegex(ValueError, "divisible by the number of hosts"):
+      host_data.host_batch_slice(30, 0, 4)
+    with self.assertRaisesRegex(ValueError, "host_id must be in"):
+      host_data.host_batch_slice(32, 4, 4)
+
+  def testGlobalBatchIndices(self):
+    batches = list(host_data.global_batch_indices(10, 4, num_epochs=2))
+    self.assertEqual([b.tolist() for b in batches],
+                     [[0, 1, 2, 3], [4, 5, 6, 7]] * 2)
+
+    batches = list(host_data.global_batch_indices(12, 4, seed=0, num_epochs=2))
+    self.assertLen(batches, 6)
+    for epoch in (batches[:3], batches[3:]):
+      self.assertEqual(sorted(np.concatenate(epoch).tolist()), list(range(12)))
+    again = list(host_data.global_batch_indices(12, 4, seed=0, num_epochs=2))
+    self.assertAllClose(batches, again)
+
+  def testHostLocalBatches(self):
+    num_devices = xla_bridge.local_device_count()
+    data = np.arange(100 * num_devices * 3, dtype=np.float32).reshape(-1, 3)
+    batches = host_data.host_local_batches(
+        lambda idx: {"x": data[idx], "idx": idx}, len(data), 4 * num_devices,
+        num_epochs=1)
+    count = 0
+    for batch in batches:
+      self.assertIsInstance(batch["x"], pxla.ShardedDeviceArray)
+      self.assertEqual(batch["x"].shape, (num_devices, 4, 3))
+      idx = np.asarray(batch["idx"]).ravel()
+      self.assertAllClose(np.asarray(batch["x"]).reshape(-1, 3), data[idx])
+      count += 1
+    self.assertEqual(count, len(data) // (4 * num_devices))
+
+  def testHostLocalBatchesBadLoadFn(self):
+    batches = host_data.host_local_batches(
+        lambda idx: np.zeros(3), 100, xla_bridge.local_device_count())
+    with self.assertRaisesRegex(ValueError, "leading axis of size"):
+      next(batches)
+
+  def testSimulatedHosts(self):
+    host_count, local_device_count, global_batch_size = 3, 2, 12
+    outputs = run_simulated_hosts(host_count, """
+        import json
+        import jax
+        import numpy as np
+        from jax.experimental import host_data
+
+        assert jax.local_device_count() == 2
+        batches = host_data.host_local_batches(
+            lambda idx: idx, num_examples=50, global_batch_size=12, seed=7,
+            num_epochs=1, host_id=host_id, host_count=host_count)
+        print(json.dumps([np.asarray(b).tolist() for b in batches]))
+        """, local_device_count)
+
+    expected = list(host_data.global_batch_indices(
+        50, global_batch_size, seed=7, num_epochs=1))
+    per_device = global_batch_size // (host_count * local_device_count)
+    for step, global_batch in enumerate(expected):
+      # Host h's devices hold the h-th contiguous slice of the global batch,
+      # which is how a multi-host pmap lays out its global mapped axis.
+      loaded = np.concatenate([np.asarray(out[step]).reshape(-1)
+                               for out in outputs])
+      self.assertAllClose(loaded, global_batch)
+      for out in outputs:
+        self.assertEqual(np.shape(out[step]), (local_device_count, per_device))
+
+
+if __name__ == "__main__":
+  absltest.main(testLoader=jtu.JaxTestLoader())
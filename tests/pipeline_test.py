@@ -0,0 +1,165 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from functools import partial
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+
+import jax
+from jax import test_util as jtu
+import jax.numpy as jnp
+from jax.experimental import pipeline
+from jax.lib import xla_bridge
+
+from jax.config import config
+config.parse_flags_with_absl()
+
+
+def stage_fn(w, x):
+  return jnp.tanh(jnp.dot(x, w))
+
+
+def stage_fns(num_stages):
+  # Distinct code per stage, with a shared parameter structure.
+  return [lambda w, x, s=s: jnp.sin(jnp.dot(x, w)) + s for s in range(num_stages)]
+
+
+def loss_fn(y, target):
+  return jnp.mean((y - target) ** 2)
+
+
+def sequential(stages, ws, x):
+  stages = stages if isinstance(stages, list) else [stages] * len(ws)
+  for f, w in zip(stages, ws):
+    x = f(w, x)
+  return x
+
+
+def sequential_loss(stages, ws, microbatches, targets):
+  outputs = [sequential(stages, ws, x) for x in microbatches]
+  return jnp.mean(jnp.stack([loss_fn(y, t) for y, t in zip(outputs, targets)]))
+
+
+class PipelineTest(jtu.JaxTestCase):
+
+  def _problem(self, num_microbatches=5):
+    num_stages = xla_bridge.device_count()
+    rng = np.random.RandomState(0)
+    ws = rng.randn(num_stages, 3, 3).astype(np.float32) / 2
+    microbatches = rng.randn(num_microbatches, 2, 3).astype(np.float32)
+    targets = rng.randn(num_microbatches, 2, 3).astype(np.float32)
+    return num_stages, ws, microbatches, targets
+
+  @parameterized.named_parameters(
+      {"testcase_name": "_stages={}_microbatches={}".format(S, M),
+       "num_stages": S, "num_microbatches": M}
+      for S, M in [(1, 3), (2, 1), (3, 5), (4, 8), (4, 2)])
+  def testSchedule(self, num_stages, num_microbatches):
+    for name in ["gpipe", "1f1b"]:
+      schedule = pipeline.pipeline_schedule(name, num_stages, num_microbatches)
+      done = {}
+      for kind, table in [("F", schedule.forward), ("B", schedule.backward)]:
+        for t, s in zip(*np.nonzero(table >= 0)):
+          done[(kind, s, table[t, s])] = t
+      self.assertEqual(len(done), 2 * num_stages * num_microbatches)
+      for (kind, s, i), t in done.items():
+        if kind == "F" and s > 0:
+          self.assertLess(done[("F", s - 1, i)], t)
+        if kind == "B":
+          self.assertLess(done[("F", s, i)], t)
+          if s < num_stages - 1:
+            self.assertLess(done[("B", s + 1, i)], t)
+      # A stage runs at most one pass per tick.
+      busy = (schedule.forward >= 0).astype(int) + (schedule.backward >= 0)
+      self.assertLessEqual(busy.max(), 1)
+
+    gpipe = pipeline.pipeline_schedule("gpipe", num_stages, num_microbatches)
+    one_f_one_b = pipeline.pipeline_schedule("1f1b", num_stages,
+                                             num_microbatches)
+    self.assertEqual(gpipe.buffer_size, num_microbatches)
+    self.assertLessEqual(one_f_one_b.buffer_size,
+                         min(num_stages, num_microbatches))
+    self.assertEqual(len(one_f_one_b.forward), len(gpipe.forward))
+
+  def testBadSchedule(self):
+    with self.assertRaisesRegex(ValueError, "schedule must be one of"):
+      pipeline.pipeline_schedule("interleaved", 2, 4)
+
+  @parameterized.named_parameters(
+      {"testcase_name": "_per_stage_fns={}".format(per_stage),
+       "per_stage": per_stage}
+      for per_stage in [False, True])
+  def testPipelineApply(self, per_stage):
+    num_stages, ws, microbatches, _ = self._problem()
+    stages = stage_fns(num_stages) if per_stage else stage_fn
+    f = jax.pmap(partial(pipeline.pipeline_apply, stages, axis_name='i'),
+                 axis_name='i', in_axes=(0, None))
+    ans = f(ws, microbatches)
+    expected = np.stack([sequential(stages, ws, x) for x in microbatches])
+    for out in ans:
+      self.assertAllClose(out, expected, check_dtypes=False)
+
+  def testPipelineApplyGrad(self):
+    _, ws, microbatches, targets = self._problem()
+
+    @partial(jax.pmap, axis_name='i', in_axes=(0, None, None))
+    def grads(w, microbatches, targets):
+      def loss(w):
+        outputs = pipeline.pipeline_apply(stage_fn, w, microbatches,
+                                          axis_name='i')
+        # Every device computes the full loss, so per-stage gradients add up
+        # over the devices that backpropagate through the final psum.
+        return (jnp.mean(jax.vmap(loss_fn)(outputs, targets)) /
+                jax.lax.psum(1, 'i'))
+      return jax.grad(loss)(w)
+
+    ans = grads(ws, microbatches, targets)
+    expected = jax.grad(partial(sequential_loss, stage_fn))(
+        ws, microbatches, targets)
+    self.assertAllClose(ans, expected, check_dtypes=False, atol=1e-5,
+                        rtol=1e-5)
+
+  @parameterized.named_parameters(
+      {"testcase_name": "_schedule={}_per_stage_fns={}".format(
+          schedule, per_stage),
+       "schedule": schedule, "per_stage": per_stage}
+      for schedule in ["gpipe", "1f1b"]
+      for per_stage in [False, True])
+  def testPipelineValueAndGrad(self, schedule, per_stage):
+    num_stages, ws, microbatches, targets = self._problem()
+    stages = stage_fns(num_stages) if per_stage else stage_fn
+    f = jax.pmap(partial(pipeline.pipeline_value_and_grad, stages, loss_fn,
+                         axis_name='i', schedule=schedule),
+                 axis_name='i', in_axes=(0, None, None))
+    loss, grads = f(ws, microbatches, targets)
+    expected_loss, expected_grads = jax.value_and_grad(
+        partial(sequential_loss, stages))(ws, microbatches, targets)
+    self.assertAllClose(loss, np.full(num_stages, expected_loss),
+                        check_dtypes=False, atol=1e-5, rtol=1e-5)
+    self.assertAllClose(grads, expected_grads, check_dtypes=False, atol=1e-5,
+                        rtol=1e-5)
+
+  def testWrongNumberOfStages(self):
+    num_stages, ws, microbatches, _ = self._problem()
+    f = jax.pmap(partial(pipeline.pipeline_apply,
+                         stage_fns(num_stages + 1), axis_name='i'),
+                 axis_name='i', in_axes=(0, None))
+    with self.assertRaisesRegex(ValueError, "stage functions for a pipeline"):
+      f(ws, microbatches)
+
+
+if __name__ == "__main__":
+  absltest.main(testLoader=jtu.JaxTestLoader())
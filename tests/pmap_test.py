@@ -18,6 +18,7 @@ from functools import partial
 import itertools as it
 import gc
 import os
+import tempfile
 from random import shuffle
 from typing import Optional, cast
 from unittest import SkipTest
@@ -143,6 +144,78 @@ class PmapTest(jtu.JaxTestCase):
     ans = f(x)
     self.assertAllClose(ans, expected, check_dtypes=False)
 
+  def testGatherBool(self):
+    f = pmap(lambda x: lax.all_gather(x, 'i'), axis_name='i')
+    x = np.arange(xla_bridge.device_count()) % 2 == 0
+    self.assertAllClose(f(x), np.array([x] * xla_bridge.device_count()))
+
+  def testGatherReplicaGroups(self):
+    replicas = xla_bridge.device_count()
+    if replicas % 2 != 0:
+      raise SkipTest
+    axis_index_groups = np.arange(replicas).reshape(2, replicas // 2).tolist()
+    f = pmap(lambda x: lax.all_gather(x, 'i',
+                                      axis_index_groups=axis_index_groups), 'i')
+    x = np.arange(replicas * 3, dtype=np.float32).reshape(replicas, 3)
+    halves = [x[:replicas // 2], x[replicas // 2:]]
+    expected = np.array([halves[i // (replicas // 2)] for i in range(replicas)])
+    self.assertAllClose(f(x), expected)
+
+  def testPsumScatter(self):
+    n = xla_bridge.device_count()
+    x = np.arange(n * n * 3, dtype=np.float32).reshape(n, n, 3)
+    f = pmap(lambda x: lax.psum_scatter(x, 'i'), axis_name='i')
+    self.assertAllClose(f(x), x.sum(0))
+
+    f = pmap(lambda x: lax.psum_scatter(x, 'i', scatter_dimension=1,
+                                        tiled=True), axis_name='i')
+    x = np.arange(n * 3 * 2 * n, dtype=np.float32).reshape(n, 3, 2 * n)
+    expected = x.sum(0).reshape(3, n, 2).transpose(1, 0, 2)
+    self.assertAllClose(f(x), expected)
+
+  def testPsumScatterReplicaGroups(self):
+    replicas = xla_bridge.device_count()
+    if replicas % 2 != 0:
+      raise SkipTest
+    group_size = replicas // 2
+    axis_index_groups = np.arange(replicas).reshape(2, group_size).tolist()
+    f = pmap(lambda x: lax.psum_scatter(
+        x, 'i', axis_index_groups=axis_index_groups), 'i')
+    x = np.arange(replicas * group_size * 2, dtype=np.float32).reshape(
+        replicas, group_size, 2)
+    sums = [x[:group_size].sum(0), x[group_size:].sum(0)]
+    expected = np.array([sums[i // group_size][i % group_size]
+                         for i in range(replicas)])
+    self.assertAllClose(f(x), expected)
+
+  def testPsumScatterShapeError(self):
+    n = xla_bridge.device_count()
+    f = pmap(lambda x: lax.psum_scatter(x, 'i'), axis_name='i')
+    with self.assertRaisesRegex(ValueError, "psum_scatter requires"):
+      f(np.ones((n, n + 1)))
+
+  def testPsumScatterAllGatherTranspose(self):
+    n = xla_bridge.device_count()
+    rng = np.random.RandomState(0)
+    x = rng.randn(n, n, 3).astype(np.float32)
+    ct = rng.randn(n, 3).astype(np.float32)
+
+    # psum_scatter and all_gather are each other's transpose.
+    f = pmap(lambda x, ct: jax.vjp(lambda x: lax.psum_scatter(x, 'i'), x)[1](ct),
+             axis_name='i')
+    self.assertAllClose(f(x, ct)[0], np.broadcast_to(ct, (n, n, 3)))
+
+    g = pmap(lambda x, ct: jax.vjp(lambda x: lax.all_gather(x, 'i'), x)[1](ct),
+             axis_name='i')
+    ct = rng.randn(n, n, 3).astype(np.float32)
+    self.assertAllClose(g(x[:, 0], ct)[0], ct.sum(0), rtol=1e-5)
+
+  def testPsumScatterVmap(self):
+    n = xla_bridge.device_count()
+    x = np.arange(n * 2 * n, dtype=np.float32).reshape(n, 2, n)
+    f = pmap(vmap(lambda x: lax.psum_scatter(x, 'i'), in_axes=0), axis_name='i')
+    self.assertAllClose(f(x), x.sum(0).T)
+
   def testTrees(self):
     ptranspose = lambda x, axis_name: lax.all_to_all(x, axis_name, 0, 0)
     def protate(x, axis_name):
@@ -477,6 +550,45 @@ class PmapTest(jtu.JaxTestCase):
     ans = f(x)
     self.assertAllClose(ans, expected, check_dtypes=False)
 
+  @parameterized.named_parameters(
+      {"testcase_name": "_bucket_bytes={}".format(bucket_bytes),
+       "bucket_bytes": bucket_bytes}
+      for bucket_bytes in [1, 64, 2 ** 20])
+  def testPsumBucketed(self, bucket_bytes):
+    n = xla_bridge.device_count()
+    rng = np.random.RandomState(0)
+    tree = {'w': [rng.randn(n, 3, 2).astype(np.float32) for _ in range(5)],
+            'b': rng.randn(n).astype(np.float32),
+            'step': np.arange(n, dtype=np.int32),
+            'mask': np.arange(n) % 2 == 0}
+
+    f = pmap(lambda t: lax.psum_bucketed(t, 'i', bucket_bytes=bucket_bytes),
+             'i')
+    expected = pmap(lambda t: lax.psum(t, 'i'), 'i')(tree)
+    ans = f(tree)
+    self.assertEqual(tree_util.tree_structure(ans),
+                     tree_util.tree_structure(expected))
+    self.assertAllClose(ans, expected)
+
+  @jtu.skip_on_devices("gpu")  # GPU emits one tuple all-reduce per dtype
+  def testPsumBucketedCollectiveCount(self):
+    leaves = [np.ones((4, 4), np.float32) for _ in range(10)]
+    count = lambda f: jax.xla_computation(f, axis_env=[('i', 2)])(
+        leaves).as_hlo_text().count(' all-reduce(')
+
+    self.assertEqual(count(lambda xs: lax.psum(xs, 'i')), 10)
+    self.assertEqual(count(lambda xs: lax.psum_bucketed(xs, 'i')), 1)
+    self.assertEqual(count(
+        lambda xs: lax.psum_bucketed(xs, 'i', bucket_bytes=4 * 16 * 5)), 2)
+
+  def testPsumBucketedGrad(self):
+    n = xla_bridge.device_count()
+    xs = [np.arange(n * 2, dtype=np.float32).reshape(n, 2) + i
+          for i in range(3)]
+    loss = lambda xs: sum(jnp.sum(jnp.sin(x)) for x in xs)
+    f = lambda g: pmap(lambda xs: g(jax.grad(loss)(xs), 'i'), 'i')(xs)
+    self.assertAllClose(f(lax.psum_bucketed), f(lax.psum))
+
   def testNestedPmapReplicaGroups(self):
     replicas = xla_bridge.device_count()
     if replicas % 4 != 0:
@@ -1061,6 +1173,57 @@ class PmapTest(jtu.JaxTestCase):
     expected = np.ones(n) / n
     self.assertAllClose(ans, expected, check_dtypes=False)
 
+  @ignore_soft_pmap_warning()
+  def testSoftPmapRagged(self):
+    if not config.omnistaging_enabled: raise SkipTest("requires omnistaging")
+    n = xla_bridge.device_count()
+    for size in [1, n + 1, 3 * n - 1]:
+      x = np.arange(size * 2, dtype=np.float32).reshape(size, 2)
+      ans = soft_pmap(lambda x: 2 * x + 1, 'i')(x)
+      self.assertIsInstance(ans, pxla.ShardedDeviceArray)
+      self.assertEqual(ans.shape, (size, 2))
+      self.assertAllClose(ans, 2 * x + 1)
+      if ans.sharding_spec is not None:
+        self.assertEqual(pxla.spec_to_indices(ans.shape, ans.sharding_spec),
+                         ans.indices)
+      for buf, idx in zip(ans.device_buffers, ans.indices):
+        self.assertAllClose(buf.to_py(), (2 * x + 1)[idx])
+
+  @ignore_soft_pmap_warning()
+  def testSoftPmapRaggedShardedInput(self):
+    if not config.omnistaging_enabled: raise SkipTest("requires omnistaging")
+    size = xla_bridge.device_count() + 1
+    x = np.arange(size * 2, dtype=np.float32).reshape(size, 2)
+    f = soft_pmap(lambda x: 2 * x + 1, 'i')
+    y = f(x)
+    ans = f(y)
+    self.assertIsNone(y._npy_value)  # padded on device, not via the host
+    self.assertAllClose(ans, 4 * x + 3)
+
+  @ignore_soft_pmap_warning()
+  def testSoftPmapRaggedCollectives(self):
+    if not config.omnistaging_enabled: raise SkipTest("requires omnistaging")
+    size = xla_bridge.device_count() + 1
+    x = -1 - np.arange(size, dtype=np.float32)  # padding zeros would win pmax
+    def f(x, y):
+      return (x / lax.psum(x, 'i'), lax.pmax(x, 'i'), lax.pmin(x, 'i'),
+              lax.psum(y, 'i'), lax.psum(1, 'i'))
+    ans = soft_pmap(f, 'i', in_axes=(0, None))(x, np.float32(2))
+    expected = (x / x.sum(), np.full(size, x.max()), np.full(size, x.min()),
+                np.full(size, 2. * size), np.full(size, size))
+    self.assertAllClose(ans, expected, check_dtypes=False)
+
+  @ignore_soft_pmap_warning()
+  def testSoftPmapPsumScatterAllGather(self):
+    if not config.omnistaging_enabled: raise SkipTest("requires omnistaging")
+    for size in [2 * xla_bridge.device_count(), xla_bridge.device_count() + 1]:
+      x = np.arange(size * size * 2, dtype=np.float32).reshape(size, 2 * size)
+      def f(x):
+        return (lax.psum_scatter(x, 'i', tiled=True), lax.all_gather(x[:2], 'i'))
+      scattered, gathered = soft_pmap(f, 'i')(x)
+      self.assertAllClose(scattered, x.sum(0).reshape(size, 2))
+      self.assertAllClose(gathered, np.broadcast_to(x[:, :2], (size, size, 2)))
+
   @ignore_soft_pmap_warning()
   def testSoftPmapAxisIndex(self):
     if not config.omnistaging_enabled: raise SkipTest("requires omnistaging")
@@ -1574,6 +1737,67 @@ class PmapWithDevicesTest(jtu.JaxTestCase):
     expected = np.sin(x + y[None])
     self.assertAllClose(ans, expected, check_dtypes=False)
 
+  def _mesh(self):
+    if not config.omnistaging_enabled:
+      raise SkipTest("requires omnistaging")
+    if xla_bridge.device_count() % 2 != 0:
+      raise SkipTest("test requires an even number of devices")
+    devices = np.array(xla_bridge.devices()).reshape(2, -1)
+    return pxla.Mesh(devices, ('data', 'model'))
+
+  def testMesh(self):
+    mesh = self._mesh()
+
+    @partial(pmap, devices=mesh)
+    def f(x):
+      return (lax.psum(x, 'data'), lax.psum(x, 'model'),
+              lax.psum(x, ('data', 'model')),
+              lax.axis_index('data'), lax.axis_index('model'))
+
+    x = np.arange(prod(mesh.shape) * 3, dtype=np.float32).reshape(
+        mesh.shape + (3,))
+    data_sum, model_sum, total, data_idx, model_idx = f(x)
+    self.assertAllClose(data_sum, np.broadcast_to(x.sum(0, keepdims=True), x.shape))
+    self.assertAllClose(model_sum, np.broadcast_to(x.sum(1, keepdims=True), x.shape))
+    self.assertAllClose(total, np.broadcast_to(x.sum((0, 1)), x.shape))
+    rows, cols = np.indices(mesh.shape)
+    self.assertAllClose(data_idx, rows.astype(np.int32))
+    self.assertAllClose(model_idx, cols.astype(np.int32))
+
+    self.assertIsInstance(total, pxla.ShardedDeviceArray)
+    self.assertEqual(total.sharding_spec,
+                     pxla.mesh_sharding_spec(mesh, total.aval))
+    self.assertEqual([b.device() for b in total.device_buffers],
+                     list(mesh.device_list))
+
+  @ignore_jit_of_pmap_warning()
+  def testMeshMatchesNestedPmap(self):
+    mesh = self._mesh()
+    fun = lambda x: x * lax.psum(x, 'model') - lax.pmax(x, 'data')
+    nested = pmap(pmap(fun, axis_name='model'), axis_name='data')
+    x = np.random.RandomState(0).randn(*mesh.shape, 4).astype(np.float32)
+    self.assertAllClose(pmap(fun, devices=mesh)(x), nested(x))
+    self.assertAllClose(jit(pmap(fun, devices=mesh))(x), nested(x))
+
+  def testMeshResultsAreNotResharded(self):
+    mesh = self._mesh()
+    f = pmap(lambda x: x + 1, devices=mesh)
+    y = f(np.zeros(mesh.shape, np.float32))
+    flat = pxla.flatten_mesh_axes(y, mesh)
+    self.assertEqual(flat.shape, (mesh.size,))
+    for b, flat_b in zip(y.device_buffers, flat.device_buffers):
+      self.assertIs(b, flat_b)
+    self.assertAllClose(f(y), 2 * np.ones(mesh.shape, np.float32))
+
+  def testMeshErrors(self):
+    mesh = self._mesh()
+    with self.assertRaisesRegex(ValueError, "axis_name and axis_size"):
+      pmap(lambda x: x, axis_name='i', devices=mesh)
+    with self.assertRaisesRegex(ValueError, "match the mesh shape"):
+      pmap(lambda x: x, devices=mesh)(np.zeros((mesh.size,)))
+    with self.assertRaisesRegex(ValueError, "one axis name per axis"):
+      pxla.Mesh(mesh.devices, ('data',))
+
 
 class ShardedDeviceArrayTest(jtu.JaxTestCase):
 
@@ -1605,6 +1829,78 @@ class ShardedDeviceArrayTest(jtu.JaxTestCase):
       actual = [f.result() for f in futures]
     self.assertAllClose(actual, expected, check_dtypes=False)
 
+  def testStreamToHost(self):
+    n = xla_bridge.device_count()
+    x = np.arange(n * 3, dtype=np.float32).reshape(n, 3)
+    y = pmap(lambda x: x * 2)(x)
+    shards = list(y.stream_to_host())
+    self.assertLen(shards, n)
+    self.assertCountEqual([idx for idx, _ in shards], range(n))
+    for idx, shard in shards:
+      self.assertAllClose(shard, 2 * x[idx])
+    self.assertIsNone(y._npy_value)
+
+  def testStreamToHostOut(self):
+    n = xla_bridge.device_count()
+    x = np.arange(n * 3, dtype=np.float32).reshape(n, 3)
+    y = pmap(lambda x: x * 2)(x)
+    with tempfile.NamedTemporaryFile() as f:
+      out = np.lib.format.open_memmap(f.name, mode='w+', dtype=np.float32,
+                                      shape=x.shape)
+      for idx, shard in y.stream_to_host(out):
+        self.assertTrue(np.shares_memory(shard, out))
+      out.flush()
+      self.assertAllClose(np.load(f.name), 2 * x)
+    self.assertRaisesRegex(ValueError, "stream_to_host out array has shape.*",
+                           lambda: list(y.stream_to_host(np.zeros(3))))
+
+  def testStreamToHostCached(self):
+    n = xla_bridge.device_count()
+    x = np.arange(n * 4, dtype=np.float32).reshape(n, 4)
+    y = pmap(lambda x: x)(x)
+    np.asarray(y)  # caches a host copy, which the shards are then read from
+    shards = dict(y.stream_to_host())
+    self.assertLen(shards, n)
+    self.assertAllClose(shards[n - 1], x[n - 1])
+
+  def testReshardReplicatedWithoutHostRoundTrip(self):
+    n = xla_bridge.device_count()
+    x = pmap(lambda x: x)(np.arange(n * 3.).reshape(n, 3))
+    f = pmap(lambda x, y: x + y, in_axes=(None, 0))
+    ans = f(x, np.arange(n, dtype=np.float32))
+    expected = np.arange(n * 3.).reshape(n, 3)[None] + np.arange(n)[:, None, None]
+    self.assertAllClose(ans, expected, check_dtypes=False)
+    self.assertIsNone(x._npy_value)  # no copy to host was made
+
+  def testReshardNestedWithoutHostRoundTrip(self):
+    if xla_bridge.device_count() < 4:
+      raise SkipTest("requires 4 devices")
+    devices = xla_bridge.devices()[:4]
+    x = np.arange(2 * 2 * 3.).reshape(2, 2, 3)
+    y = pmap(pmap(lambda x: x), devices=devices)(x)
+    self.assertEqual(len(y.device_buffers), 4)
+    ans = pmap(lambda x: x * 2, devices=devices[2:])(y)
+    self.assertAllClose(ans, x * 2, check_dtypes=False)
+    self.assertEqual([b.device() for b in ans.device_buffers], devices[2:])
+    self.assertIsNone(y._npy_value)
+
+  def testReshardBuffer(self):
+    if xla_bridge.device_count() < 4:
+      raise SkipTest("requires 4 devices")
+    devices = xla_bridge.devices()[:4]
+    x = np.arange(4 * 6, dtype=np.float32).reshape(4, 6)
+    spec = pxla.ShardingSpec(shards_per_axis=(2, 2),
+                             is_axis_materialized=(True, True),
+                             replication_factors=[])
+    indices = pxla.spec_to_indices(x.shape, spec)
+    bufs = [xla.device_put(x[idx], d) for idx, d in zip(indices, devices)]
+    arr = pxla.ShardedDeviceArray(ShapedArray(x.shape, x.dtype), spec, bufs)
+    for idx in [slice(None), 1, (slice(1, 3), slice(2, 5)), (3, slice(0, 6))]:
+      buf = pxla._reshard_buffer(arr, idx, devices[0])
+      self.assertEqual(buf.device(), devices[0])
+      self.assertAllClose(buf.to_py(), x[idx])
+    self.assertIsNone(arr._npy_value)
+
 
 class SpecToIndicesTest(jtu.JaxTestCase):
 
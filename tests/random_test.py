@@ -154,6 +154,40 @@ class LaxRandomTest(jtu.JaxTestCase):
       expected64 = np.array([676898860, 3164047411, 4010691890], dtype=np.uint32)
     self.assertArraysEqual(bits64, expected64)
 
+  @parameterized.named_parameters(jtu.cases_from_list(
+      {"testcase_name": "_bit_width={}_shape={}".format(bit_width, shape),
+       "bit_width": bit_width, "shape": shape}
+      for bit_width in [8, 16, 32, 64]
+      for shape in [(1000,), (10, 100), (7, 11, 13)]))
+  def testRngRandomBitsChunked(self, bit_width, shape):
+    key = random.PRNGKey(1701)
+    chunk_size = 128
+    bits = random._random_bits(key, bit_width, shape, chunk_size)
+    self.assertEqual(bits.shape, shape)
+    self.assertEqual(bits.dtype,
+                     random._random_bits(key, bit_width, (1,)).dtype)
+
+    # Each chunk comes from its own key, split from the sampler's key.
+    num_chunks = -(-np.prod(shape) // chunk_size)
+    expected = np.concatenate(
+        [random._random_bits(k, bit_width, (chunk_size,))
+         for k in random.split(key, num_chunks)])[:np.prod(shape)]
+    self.assertArraysEqual(bits, expected.reshape(shape))
+
+    jitted = api.jit(lambda k: random._random_bits(k, bit_width, shape,
+                                                   chunk_size))
+    self.assertArraysEqual(jitted(key), bits)
+
+  def testRngRandomBitsChunkSizeLargerThanRequest(self):
+    key = random.PRNGKey(1701)
+    self.assertArraysEqual(random._random_bits(key, 32, (10,), 128),
+                           random._random_bits(key, 32, (10,)))
+
+  def testRngRandomBitsBadChunkSize(self):
+    key = random.PRNGKey(1701)
+    with self.assertRaisesRegex(ValueError, "chunk_size must be positive"):
+      random._random_bits(key, 32, (10,), 0)
+
   @parameterized.named_parameters(jtu.cases_from_list(
       {"testcase_name": "_dtype={}".format(np.dtype(dtype).name), "dtype": dtype}
       for dtype in float_dtypes))
@@ -247,6 +281,50 @@ class LaxRandomTest(jtu.JaxTestCase):
       assert len(np.unique(sample1)) == len(np.ravel(sample1))
     self.assertAllClose(sample1, sample2)
 
+  def testChoiceWeightedWithoutReplacement(self):
+    N = 10000
+    p = np.ones(N, np.float32)
+    p[::2] = 0
+    p[1:10:2] = 1e9  # these five hold nearly all of the mass
+    sample = random.choice(random.PRNGKey(0), N, (5,), replace=False, p=p)
+    self.assertArraysEqual(np.sort(sample), np.arange(1, 10, 2, dtype=np.int32))
+
+  @parameterized.named_parameters(jtu.cases_from_list(
+      {"testcase_name": "_{}".format(name), "p": p}
+      for name, p in [
+          ("uniform", np.ones(7)),
+          ("single", np.array([3.])),
+          ("one_hot", np.array([0., 0., 1., 0.])),
+          ("skewed", np.array([100., 1., 1., 1., 0., 20.])),
+          ("random", np.random.RandomState(0).exponential(size=50) ** 3),
+          ("ints", np.arange(20)),
+          ("tied_ints", np.array([2, 1, 4, 4, 4])),
+          ("tied_ints_2", np.array([1, 2, 5, 5, 4, 5])),
+          ("tied_ints_3", np.array([5, 1, 5, 2, 4, 5]))]))
+  def testAliasTable(self, p):
+    table = random.alias_table(p)
+    prob, alias = np.asarray(table.prob), np.asarray(table.alias)
+    self.assertTrue(np.all((prob >= 0) & (prob <= 1)))
+    # Each bucket's leftover probability goes to its alias.
+    n = len(p)
+    implied = prob.copy()
+    np.add.at(implied, alias, 1 - prob)
+    self.assertAllClose(implied / n, p / np.sum(p), atol=1e-5,
+                        check_dtypes=False)
+
+  def testAliasChoice(self):
+    p = np.array([0.1, 0.0, 0.5, 0.15, 0.25])
+    table = random.alias_table(p)
+    rand = lambda key: random.alias_choice(key, table, (10000,))
+    sample = rand(random.PRNGKey(0))
+    self.assertArraysEqual(sample, api.jit(rand)(random.PRNGKey(0)))
+    self._CheckChiSquared(np.asarray(sample), lambda x: p[x])
+
+    a = np.arange(5, dtype=np.float32) * 10
+    items = random.alias_choice(random.PRNGKey(0), table, (2, 3), a)
+    self.assertEqual(items.shape, (2, 3))
+    self.assertEqual(items.dtype, np.float32)
+
   @parameterized.named_parameters(jtu.cases_from_list(
       {"testcase_name": "_{}".format(jtu.format_shape_dtype_string(shape, dtype)),
        "dtype": dtype, "shape": shape}
@@ -281,12 +359,52 @@ class LaxRandomTest(jtu.JaxTestCase):
     self.assertFalse(np.all(perm1 == np.arange(100)))  # seems unlikely!
     self.assertAllClose(np.sort(perm1), np.arange(100), check_dtypes=False)
 
+  @parameterized.named_parameters(jtu.cases_from_list(
+      {"testcase_name": "_n={}_rounds={}".format(n, rounds),
+       "n": n, "rounds": rounds}
+      for n in [10, 4096, 5000, 2 ** 16 + 1]
+      for rounds in [None, 3]))
+  def testPermutationFeistel(self, n, rounds):
+    key = random.PRNGKey(0)
+    rand = lambda key: random.permutation(key, n, method="feistel",
+                                          rounds=rounds)
+    perm = rand(key)
+    self.assertArraysEqual(perm, api.jit(rand)(key))
+    self.assertEqual(perm.dtype, jnp.arange(n).dtype)
+    self.assertArraysEqual(np.sort(perm), np.arange(n))
+    self.assertFalse(np.all(perm == np.arange(n)))  # seems unlikely!
+    self.assertFalse(np.all(perm == random.permutation(
+        random.PRNGKey(1), n, method="feistel", rounds=rounds)))
+
+  def testPermutationFeistelArray(self):
+    key = random.PRNGKey(0)
+    x = np.arange(5000 * 3).reshape(5000, 3)
+    perm = random.permutation(key, x, method="feistel")
+    self.assertArraysEqual(perm, x[random.permutation(key, 5000,
+                                                      method="feistel")])
+
+  def testPermutationFeistelIsUniformish(self):
+    # The position of an element, and the number of fixed points, of a
+    # uniformly random permutation.
+    n = 2 ** 12 + 7
+    keys = random.split(random.PRNGKey(0), 1000)
+    perms = np.stack([random.permutation(k, n, method="feistel")
+                      for k in keys])
+    self._CheckChiSquared(np.argmax(perms == 0, axis=1) * 16 // n,
+                          lambda x: np.full(x.shape, 1 / 16))
+    self.assertAllClose(np.mean(np.sum(perms == np.arange(n), axis=1)), 1.,
+                        atol=0.2, check_dtypes=False)
+
   def testPermutationErrors(self):
     key = random.PRNGKey(0)
     with self.assertRaises(TypeError):
       random.permutation(key, 10.)
     with self.assertRaises(core.ConcretizationTypeError):
       api.jit(random.permutation)(key, 10)
+    with self.assertRaisesRegex(ValueError, "method must be"):
+      random.permutation(key, 10, method="fisher_yates")
+    with self.assertRaisesRegex(ValueError, "rounds must be positive"):
+      random.permutation(key, 10, rounds=0)
 
   @parameterized.named_parameters(jtu.cases_from_list(
       {"testcase_name": "_p={}_dtype={}".format(p, np.dtype(dtype).name),
@@ -662,6 +780,126 @@ class LaxRandomTest(jtu.JaxTestCase):
     keys = [random.fold_in(key, i) for i in range(10)]
     assert np.unique(np.ravel(keys)).shape == (20,)
 
+  @parameterized.named_parameters(jtu.cases_from_list(
+      {"testcase_name": "_batch_shape={}_num={}".format(batch_shape, num),
+       "batch_shape": batch_shape, "num": num}
+      for batch_shape in [(), (3,), (2, 4)]
+      for num in [1, 2, 5]))
+  def testSplitMany(self, batch_shape, num):
+    keys = random.split(random.PRNGKey(0), int(np.prod(batch_shape)))
+    keys = keys.reshape(batch_shape + (2,))
+    ans = random.split_many(keys, num)
+    expected = np.reshape(vmap(lambda k: random.split(k, num))(
+        keys.reshape(-1, 2)), batch_shape + (num, 2))
+    self.assertArraysEqual(ans, expected)
+    self.assertArraysEqual(api.jit(random.split_many, static_argnums=1)(
+        keys, num), expected)
+
+  @parameterized.named_parameters(jtu.cases_from_list(
+      {"testcase_name": "_batch_shape={}_data_shape={}".format(
+          batch_shape, data_shape),
+       "batch_shape": batch_shape, "data_shape": data_shape}
+      for batch_shape, data_shape in [((), ()), ((5,), (5,)), ((5,), ()),
+                                      ((2, 3), (2, 3)), ((2, 3), (3,))]))
+  def testFoldInMany(self, batch_shape, data_shape):
+    keys = random.split(random.PRNGKey(0), int(np.prod(batch_shape)))
+    keys = keys.reshape(batch_shape + (2,))
+    data = np.arange(int(np.prod(data_shape)), dtype=np.int32).reshape(data_shape) - 2
+    ans = random.fold_in_many(keys, data)
+    flat_data = np.broadcast_to(data, batch_shape).reshape(-1)
+    expected = np.reshape(vmap(random.fold_in)(keys.reshape(-1, 2), flat_data),
+                          batch_shape + (2,))
+    self.assertArraysEqual(ans, expected)
+
+  def testBatchedKeyErrors(self):
+    with self.assertRaisesRegex(TypeError, "array of PRNG keys"):
+      random.split_many(np.zeros((3, 3), np.uint32))
+    with self.assertRaisesRegex(TypeError, "array of PRNG keys"):
+      random.fold_in_many(np.zeros((3, 2), np.int32), 0)
+    with self.assertRaisesRegex(TypeError, "integer data"):
+      random.fold_in_many(random.split(random.PRNGKey(0)), 1.5)
+
+  def testPhilox4x32(self):
+    # Known answers from the test vectors of the reference implementation,
+    # https://github.com/DEShawResearch/random123/blob/main/examples/kat_vectors
+    def result_to_hex(result):
+      return tuple(hex(x.copy()).rstrip("L") for x in result)
+
+    result = random.philox_4x32(np.uint32([0, 0]), np.uint32([0, 0, 0, 0]))
+    self.assertEqual(("0x6627e8d5", "0xe169c58d", "0xbc57ac4c", "0x9b00dbd8"),
+                     result_to_hex(result))
+
+    result = random.philox_4x32(np.uint32([-1, -1]), np.uint32([-1] * 4))
+    self.assertEqual(("0x408f276d", "0x41c83b0e", "0xa20bc7c6", "0x6d5451fd"),
+                     result_to_hex(result))
+
+    result = random.philox_4x32(
+        np.uint32([0xa4093822, 0x299f31d0]),
+        np.uint32([0x243f6a88, 0x85a308d3, 0x13198a2e, 0x03707344]))
+    self.assertEqual(("0xd16cfe09", "0x94fdcceb", "0x5001e420", "0x24126ea1"),
+                     result_to_hex(result))
+
+  @parameterized.named_parameters(jtu.cases_from_list(
+      {"testcase_name": "_impl={}".format(impl), "impl": impl}
+      for impl in ["threefry2x32", "philox4x32"]))
+  def testPRNGImpl(self, impl):
+    prev = FLAGS.jax_prng_impl
+    config.update('jax_prng_impl', impl)
+    try:
+      key = random.PRNGKey(1701)
+      keys = random.split(key, 5)
+      self.assertEqual(keys.shape, (5, 2))
+      self.assertEqual(np.unique(np.ravel(keys)).shape, (10,))
+      self.assertArraysEqual(random.split_many(keys, 3),
+                             vmap(lambda k: random.split(k, 3))(keys))
+
+      data = np.arange(5, dtype=np.int32)
+      folded = random.fold_in_many(keys, data)
+      self.assertArraysEqual(folded, vmap(random.fold_in)(keys, data))
+      self.assertEqual(np.unique(np.ravel(folded)).shape, (10,))
+
+      bits = random._random_bits(key, 32, (10000,))
+      self.assertArraysEqual(bits, random._random_bits(key, 32, (10000,),
+                                                       impl=impl))
+      self._CheckCollisions(bits, 32)
+      self._CheckKolmogorovSmirnovCDF(np.asarray(bits) / 2. ** 32,
+                                      scipy.stats.uniform().cdf)
+      self.assertArraysEqual(random._random_bits(key, 32, (1000,), 128),
+                             random._random_bits(key, 32, (1000,), 128, impl))
+    finally:
+      config.update('jax_prng_impl', prev)
+
+  def testSamplersFollowPRNGImplFlag(self):
+    key = random.PRNGKey(0)
+    prev = FLAGS.jax_prng_impl
+    samples = {}
+    try:
+      for impl in ["threefry2x32", "philox4x32", "threefry2x32"]:
+        config.update('jax_prng_impl', impl)
+        bits = random._random_bits(key, 32, (100,), impl=impl)
+        expected = (np.asarray(bits) >> 9) / 2. ** 23
+        uniform = random.uniform(key, (100,), np.float32)
+        self.assertAllClose(uniform, expected.astype(np.float32))
+        samples.setdefault(impl, []).append(
+            (random.normal(key, (10,)), random.permutation(key, 10)))
+    finally:
+      config.update('jax_prng_impl', prev)
+    (n1, p1), (n2, p2) = samples["threefry2x32"]
+    self.assertArraysEqual(n1, n2)
+    self.assertArraysEqual(p1, p2)
+    (n3, _), = samples["philox4x32"]
+    self.assertFalse(np.any(np.asarray(n1) == np.asarray(n3)))
+
+  def testPRNGImplsDiffer(self):
+    key = random.PRNGKey(0)
+    threefry = random._random_bits(key, 32, (100,), impl="threefry2x32")
+    philox = random._random_bits(key, 32, (100,), impl="philox4x32")
+    self.assertFalse(np.any(np.asarray(threefry) == np.asarray(philox)))
+
+  def testUnknownPRNGImpl(self):
+    with self.assertRaisesRegex(ValueError, "Unknown PRNG implementation"):
+      random._random_bits(random.PRNGKey(0), 32, (10,), impl="mt19937")
+
   def testStaticShapeErrors(self):
     if config.read("jax_disable_jit"):
       raise SkipTest("test only relevant when jit enabled")
@@ -30,6 +30,7 @@ from jax import test_util as jtu
 from jax import tree_util
 from jax.interpreters import pxla
 from jax.interpreters.sharded_jit import sharded_jit, with_sharding_constraint
+from jax.interpreters.sharded_jit import plan_partitions
 from jax.interpreters.sharded_jit import PartitionSpec as P
 import jax.numpy as jnp
 
@@ -200,6 +201,41 @@ class ShardedJitTest(jtu.JaxTestCase):
     expected = expected_f(x)
     self.assertAllClose(actual, expected, check_dtypes=False)
 
+  def testAutoPartition(self):
+    if jax.local_device_count() < 2:
+      raise SkipTest("requires 2 devices")
+
+    @partial(sharded_jit, in_parts=(P(2, 1), None), out_parts=None,
+             auto_partition=True)
+    def f(x, w):
+      return jnp.tanh(jnp.dot(x, w)) + 1
+
+    x = np.arange(64, dtype=np.float32).reshape(16, 4) / 64
+    w = np.ones((4, 8), np.float32)
+    actual = f(x, w)
+    self.assertAllClose(actual, np.tanh(x @ w) + 1, check_dtypes=False)
+    # The output inherits the row partitioning of x.
+    self.assertLen(actual.device_buffers, 2)
+    self.assertEqual(actual.device_buffers[0].to_py().shape, (8, 8))
+
+  def testAutoPartitionCaching(self):
+    if jax.local_device_count() < 2:
+      raise SkipTest("requires 2 devices")
+
+    @partial(sharded_jit, in_parts=(P(2, 1), None), out_parts=None,
+             auto_partition=True)
+    def f(x, w):
+      return jnp.tanh(jnp.dot(x, w))
+
+    x = np.ones((8, 4), np.float32)
+    w = np.ones((4, 4), np.float32)
+    f(x, w)
+    before = jax.cache_info()['_sharded_callable']
+    self.assertAllClose(f(x, w), np.tanh(x @ w), check_dtypes=False)
+    after = jax.cache_info()['_sharded_callable']
+    self.assertEqual(after.misses, before.misses)
+    self.assertEqual(after.hits - before.hits, 1)
+
   @parameterized.named_parameters({
       "testcase_name": f"_partition_input={partition_input}",
       "partition_input": partition_input
@@ -288,6 +324,88 @@ class ShardedJitTestNoTpu(jtu.JaxTestCase):
     # Annotation from sharded_jit
     self.assertIn("sharding={replicated}", hlo.as_hlo_text())
 
+  def testAutoPartitionAnnotations(self):
+    @partial(sharded_jit, in_parts=(P(2, 1), None), out_parts=None,
+             auto_partition=True)
+    def f(x, w):
+      return lax.tanh(lax.dot(x, w))
+
+    hlo = jax.xla_computation(f)(np.ones((8, 4)), np.ones((4, 4)))
+    hlo_text = hlo.as_hlo_text()
+    # The input, the dot, the tanh and the output are all partitioned.
+    self.assertGreaterEqual(hlo_text.count("sharding={devices=[2,1]0,1}"), 4)
+
+
+def _f32(*shape):
+  return jax.ShapeDtypeStruct(shape, np.float32)
+
+
+class PartitionPropagationTest(jtu.JaxTestCase):
+
+  @parameterized.named_parameters(
+      {"testcase_name": "_" + name, "fun": fun, "args": args,
+       "in_parts": in_parts, "out_parts": out_parts, "comm_bytes": comm_bytes}
+      for name, fun, args, in_parts, out_parts, comm_bytes in [
+          ("elementwise", lambda x, y: lax.tanh(lax.mul(x, y)),
+           (_f32(8, 8), _f32(8, 8)), (P(2, 1), None), P(2, 1), 0),
+          # y is all-to-all'd from columns to rows: 256 bytes * (1/2) / 2.
+          ("elementwise_mismatch", lax.add, (_f32(8, 8), _f32(8, 8)),
+           (P(2, 1), P(1, 2)), P(2, 1), 64),
+          ("dot_rows", lax.dot, (_f32(8, 4), _f32(4, 6)), (P(2, 1), None),
+           P(2, 1), 0),
+          ("dot_cols", lax.dot, (_f32(8, 4), _f32(4, 6)), (None, P(1, 2)),
+           P(1, 2), 0),
+          # Partial sums of the (8, 6) output are all-reduced: 2 * 192 * (1/2).
+          ("dot_contracting", lax.dot, (_f32(8, 4), _f32(4, 6)),
+           (P(1, 2), None), None, 192),
+          # Both operands partitioned along output dimensions: gather w.
+          ("dot_both", lax.dot, (_f32(8, 4), _f32(4, 6)), (P(2, 1), P(1, 2)),
+           P(2, 1), 48),
+          ("sum_kept", lambda x: jnp.sum(x, axis=1), (_f32(8, 8),), P(2, 1),
+           P(2), 0),
+          # The (8,) sum over the partitioned axis is all-reduced: 2 * 32 / 2.
+          ("sum_reduced", lambda x: jnp.sum(x, axis=0), (_f32(8, 8),),
+           P(2, 1), None, 32),
+          ("transpose", lambda x: lax.transpose(x, (1, 0)), (_f32(8, 4),),
+           P(2, 1), P(1, 2), 0),
+          ("reshape_split", lambda x: lax.reshape(x, (2, 4, 4)),
+           (_f32(8, 4),), P(2, 1), P(2, 1, 1), 0),
+          ("reshape_flatten", lambda x: lax.reshape(x, (32,)), (_f32(8, 4),),
+           P(2, 1), P(2), 0),
+          # Flattening away partitioned columns gathers them: 128 bytes / 2.
+          ("reshape_gather", lambda x: lax.reshape(x, (32,)), (_f32(8, 4),),
+           P(1, 2), None, 64),
+          ("broadcast_in_dim",
+           lambda x: lax.broadcast_in_dim(x, (3, 8, 4), (1, 2)),
+           (_f32(8, 4),), P(2, 1), P(1, 2, 1), 0),
+          ("constraint", lambda x: with_sharding_constraint(x, P(1, 2)),
+           (_f32(8, 8),), P(2, 1), P(1, 2), 64),
+      ])
+  def testPropagation(self, fun, args, in_parts, out_parts, comm_bytes):
+    plan = plan_partitions(fun, in_parts)(*args)
+    self.assertEqual(plan.out_parts, out_parts)
+    self.assertAllClose(plan.comm_bytes, comm_bytes, check_dtypes=False)
+    self.assertEqual(len(plan.comm), 0 if comm_bytes == 0 else 1)
+
+  def testPropagationThroughJit(self):
+    @jit
+    def inner(x):
+      return lax.neg(x)
+
+    plan = plan_partitions(lambda x: (inner(x), x), P(4, 1))(_f32(8, 8))
+    self.assertEqual(plan.out_parts, (P(4, 1), P(4, 1)))
+    self.assertEqual(plan.comm_bytes, 0)
+
+  def testCommReportOrder(self):
+    def f(x, w):
+      y = lax.dot(x, w)              # contracting dimension partitioned
+      return jnp.sum(y, axis=0)      # replicated input, no communication
+
+    plan = plan_partitions(f, (P(1, 2), P(2, 1)))(_f32(8, 4), _f32(4, 6))
+    self.assertIsNone(plan.out_parts)
+    self.assertLen(plan.comm, 1)
+    self.assertStartsWith(plan.comm[0][0], "dot_general")
+
 class PmapOfShardedJitTest(jtu.JaxTestCase):
 
   def setUp(self):